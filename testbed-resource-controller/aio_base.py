@@ -0,0 +1,339 @@
+"""
+    asyncio counterparts of the resource-controller and service classes in base.py
+
+    Controllers built on these classes run on an asyncio server (Quart on an ASGI worker), so one worker
+    serves many concurrent requests while the bridge or Redis are slow. A controller is ported from
+    base.py by importing from aio_base/aio_utils, creating a Quart app and declaring its methods async.
+
+    refer https://quart.palletsprojects.com/en/latest/how_to_guides/flask_migration.html
+"""
+import asyncio
+import logging
+
+from http import HTTPStatus
+from abc import abstractmethod
+from quart import Quart, request, jsonify, make_response
+from quart.views import MethodView
+from quart_cors import cors
+
+import binding
+import config
+import log_shipper
+import metrics
+from aio_redis_pool import get_redis, pool_stats
+from aio_utils import abort_json, authentication_required
+from utils import add_property, add_action, compiled_description, register_api
+
+
+log = logging.getLogger(__name__)
+
+
+class API(MethodView):
+    """
+    API: basic API
+    """
+    def __init__(self):
+        # Views are created per request: share the connection pool of the worker process
+        self.redis = get_redis()
+
+
+class DescriptionAPI(API):
+    """
+    DescriptionAPI: API for return the description of the service or resource
+    The description is serialized once per process and revalidated by clients with ETag / If-None-Match
+    """
+
+    async def get(self):
+        """
+        get: responses description of the service or resource
+        :return:
+        """
+        compiled = compiled_description()
+        if compiled is None:
+            return await make_response(jsonify(None), HTTPStatus.OK)
+
+        # The client already has this description
+        if request.if_none_match.contains(compiled.etag):
+            response = await make_response('', HTTPStatus.NOT_MODIFIED)
+        elif compiled.gzipped is not None and 'gzip' in request.accept_encodings:
+            response = await make_response(compiled.gzipped, HTTPStatus.OK)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = await make_response(compiled.body, HTTPStatus.OK)
+
+        response.set_etag(compiled.etag)
+        response.headers['Content-Type'] = 'application/json'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    @staticmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to quart app automatically
+        :param _app: quart app
+        :return: None
+        """
+        view = DescriptionAPI.as_view('description_api')
+        # Description API View
+        _app.add_url_rule('/', view_func=view, methods=['GET', ])
+
+
+class StatsAPI(API):
+    """
+    StatsAPI: API for return the runtime statistics of the worker process
+    """
+
+    async def get(self):
+        """
+        get: responses the connection pool statistics of the worker which served the request
+        :return:
+        """
+        return jsonify({
+            "redisPool": pool_stats(),
+            "logShipper": log_shipper.get_shipper().stats()
+        }), HTTPStatus.OK
+
+    @staticmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to quart app automatically
+        :param _app: quart app
+        :return: None
+        """
+        view = StatsAPI.as_view('stats_api')
+        # Stats API View
+        _app.add_url_rule('/stats', view_func=view, methods=['GET', ])
+
+
+class MetricsAPI(API):
+    """
+    MetricsAPI: API for return the metrics of the controller in Prometheus text format
+    """
+
+    async def get(self):
+        """
+        get: responses the metrics, aggregated over the worker processes in multiprocess mode
+        :return:
+        """
+        body, content_type = metrics.render()
+        return body, HTTPStatus.OK, {'Content-Type': content_type}
+
+    @staticmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to quart app automatically, and time every request of the app
+        :param _app: quart app
+        :return: None
+        """
+        view = MetricsAPI.as_view('metrics_api')
+        # Metrics API View
+        _app.add_url_rule('/metrics', view_func=view, methods=['GET', ])
+        metrics.init_app(_app)
+
+
+class BindAPI(API):
+    """
+    BindAPI: API for bind/unbind user to the service or resource
+    After a user is bound to the resource, the user becomes the owner of the resource until unbound himself/herself
+    """
+
+    @add_property(
+        name="user",
+        title="Show bound user info",
+        description="It shows whether the user is bound and the user's ID",
+        properties={
+            "bound": {
+                "type": "integer"
+            },
+            "userId": {
+                "type": "string"
+            }
+        },
+        path="/user",
+        security="nosec_sc"
+    )
+    async def get(self):
+        """
+        get: responses currently bound user's ID
+        :return: [quart HTTP response in JSON] bound user's ID
+        """
+        user_id = await binding.owner_async()
+        return jsonify({
+            "bound": int(user_id is not None),
+            "userId": user_id
+        }), HTTPStatus.OK
+
+    async def post(self, action):
+        """
+        post: receive bind or unbind action from users
+        :param action: command on the resource, which is specified on URL
+        :return: [quart HTTP response in JSON] action acceptance result
+        """
+        # Bind action
+        if action == "bind":
+            return await self.bind()
+
+        # Unbind action
+        elif action == "unbind":
+            return await self.unbind()
+
+        # Reject other actions
+        else:
+            abort_json(HTTPStatus.BAD_REQUEST, "Invalid action.")
+
+    @add_action(
+        name="bind",
+        title="Bind resource",
+        description="It binds the resource to the user who requested it",
+        output={"userId": {"type": "string"}},
+        path="/user/bind"
+    )
+    @authentication_required
+    async def bind(self):
+        # Read user id and optional lease of the binding in seconds from HTTP request header
+        user_id = request.headers.get('USER-ID')
+        ttl = request.headers.get('LEASE-TTL')
+
+        # Bind user atomically: the resource is free or already bound to the user
+        try:
+            result, owner = await binding.bind_async(user_id, ttl)
+        except ValueError:
+            abort_json(HTTPStatus.BAD_REQUEST, "Invalid lease.")
+
+        # Raise 409 Conflict error if the resource is already bound to another user
+        if result != binding.BOUND:
+            abort_json(HTTPStatus.CONFLICT, "Resource bound to another user.")
+
+        # Bind user successfully
+        return jsonify({
+            "userId": owner
+        }), HTTPStatus.OK
+
+    @add_action(
+        name="unbind",
+        title="Unbind resource",
+        description="It unbinds the user currently bound to the resource",
+        output={"userId": {"type": "string"}},
+        path="/user/unbind"
+    )
+    @authentication_required
+    async def unbind(self):
+        # Read user id from HTTP request header
+        user_id = request.headers.get('USER-ID')
+
+        # Check the owner and unbind in one atomic round trip
+        result, owner = await binding.unbind_async(user_id)
+
+        # Raise 401 error if the resource is not bound,
+        # or 409 Conflict error if the resource is already bound to another user
+        if result != binding.BOUND:
+            abort_json(*binding.http_error(result))
+
+        # Unbind user successfully
+        return jsonify({
+            "userId": owner
+        }), HTTPStatus.OK
+
+    @staticmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to quart app automatically
+        :param _app: quart app
+        :return: None
+        """
+        view = BindAPI.as_view('bind_api')
+        # Bind API View
+        _app.add_url_rule('/user', view_func=view, methods=['GET', ])
+        _app.add_url_rule('/user/<action>', view_func=view, methods=['POST', ])
+
+
+class ResourceAPI(API):
+    """
+    ResourceAPI: base API for controlling resources
+    """
+
+    @abstractmethod
+    async def get(self):
+        """
+        get: returns resource's status information
+        :return: [quart HTTP response in JSON] resource's status information
+        """
+
+    @abstractmethod
+    async def post(self, action):
+        """
+        post: controller actions that controls connected resource
+        :param action: command from the user
+        :return: [quart HTTP response in JSON] action acceptance result
+        """
+
+    @staticmethod
+    @abstractmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to quart app automatically
+        :param _app: quart app
+        :return: None
+        """
+
+
+class ServiceAPI(API):
+    """
+    ServiceAPI: base API for controlling services
+    """
+
+    @abstractmethod
+    async def get(self):
+        """
+        get: returns service's status information
+        :return: [quart HTTP response in JSON] service's status information
+        """
+
+    @abstractmethod
+    async def post(self, action):
+        """
+        post: perform service actions by controlling connected resource
+        :param action: command from the user
+        :return: [quart HTTP response in JSON] action acceptance result
+        """
+
+    @staticmethod
+    @abstractmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to quart app automatically
+        :param _app: quart app
+        :return: None
+        """
+
+
+def create_app(settings=None, import_name=__name__, apis=()):
+    """
+    create_app: create the quart app of a controller
+    The description is registered when each worker starts serving, not when the module is imported
+    :param settings: dictionary of settings overriding the environment (see config.py),
+                     e.g. {"APP_STARTUP": False} for tests without Redis or network
+    :param import_name: name of the module of the controller
+    :param apis: API classes served by the app, e.g. BindAPI, DescriptionAPI and the resource API
+    :return: quart app
+    """
+    if settings:
+        config.update(settings)
+
+    app = cors(Quart(import_name))
+    for api in apis:
+        api.add_url_rule(app)
+
+    # Tests: no Redis, no registry, no threads
+    if not config.get_bool('APP_STARTUP'):
+        return app
+
+    @app.before_serving
+    async def register():
+        # Publishing the description calls Redis and the registry synchronously: keep the event loop free
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, register_api)
+        except Exception:
+            log.exception("Registering the description failed")
+
+    return app
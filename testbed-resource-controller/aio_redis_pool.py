@@ -0,0 +1,86 @@
+"""
+    Process-wide asyncio Redis connection pool
+
+    asyncio counterpart of redis_pool.py for controllers built on aio_base.py. The pool is created lazily
+    in the event loop of the worker process (one loop per worker) and re-created after fork.
+"""
+import os
+import time
+
+import redis.asyncio
+
+import config
+import metrics
+
+
+class InstrumentedRedis(redis.asyncio.Redis):
+    """
+    InstrumentedRedis: asyncio Redis client recording the latency of every command
+    """
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            metrics.observe_redis(str(args[0]).upper(), time.perf_counter() - start, failed)
+
+
+_pool = None
+_client = None
+_pid = None
+_scripts = {}
+
+
+def get_redis():
+    """
+    get_redis: get the asyncio Redis client of the current process
+    :return: redis.asyncio.Redis client backed by the shared connection pool
+    """
+    global _pool, _client, _pid
+
+    # Only the event loop thread uses the pool: no lock is needed
+    pid = os.getpid()
+    if _client is None or _pid != pid:
+        _pool = redis.asyncio.ConnectionPool(
+            host=config.get('REDIS_HOST'),
+            port=config.get_int('REDIS_PORT'),
+            db=config.get_int('REDIS_DB'),
+            max_connections=config.get_int('REDIS_MAX_CONNECTIONS'),
+            socket_timeout=config.get_float('REDIS_SOCKET_TIMEOUT'),
+            decode_responses=True
+        )
+        client_class = InstrumentedRedis if metrics.enabled() else redis.asyncio.Redis
+        _client = client_class(connection_pool=_pool)
+        _scripts.clear()
+        _pid = pid
+    return _client
+
+
+def get_script(source):
+    """
+    get_script: get a Lua script registered once per process
+    :param source: Lua source of the script
+    :return: redis AsyncScript, await it with keys, args and client=get_redis()
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = get_redis().register_script(source)
+    return script
+
+
+def pool_stats():
+    """
+    pool_stats: statistics of the connection pool of the current process
+    :return: dictionary of pool statistics
+    """
+    get_redis()
+    return {
+        "pid": _pid,
+        "maxConnections": _pool.max_connections,
+        "createdConnections": _pool._created_connections,
+        "availableConnections": len(_pool._available_connections),
+        "inUseConnections": len(_pool._in_use_connections)
+    }
@@ -0,0 +1,200 @@
+"""
+    asyncio counterparts of the decorators in utils.py
+
+    Controllers built on aio_base.py import their decorators from here instead of utils.py. The decorators
+    describing the API (api_description, add_property, add_action) run once at import: they are imported from
+    utils.py as they are.
+"""
+import asyncio
+import inspect
+import os
+import random
+import string
+
+import aiohttp
+
+from http import HTTPStatus
+from urllib.parse import urljoin
+from functools import wraps
+from quart import abort, request, jsonify
+
+import binding
+import config
+import discovery
+import log_shipper
+
+
+async def _call(f, self, *args, **kwargs):
+    # Decorated methods may be coroutines or plain functions
+    result = f(self, *args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def abort_json(status_code, error_message):
+    response = jsonify({
+        "errorMessage": error_message
+    })
+    response.status_code = status_code
+    abort(response)
+
+
+def authentication_required(f):
+    """
+    authentication_required: a decorator to check authentication of requests
+    :param f: original function to decorate
+    :return: authentication function as a decorator
+    """
+    @wraps(f)
+    async def check_authentication(self, *args, **kwargs):
+        # Every HTTP request should contain 'USER-ID' header
+        user_id = request.headers.get('USER-ID')
+
+        # Raise 401 Unauthorized error if user id is not set
+        if user_id is None:
+            abort_json(HTTPStatus.UNAUTHORIZED, "Authentication Failed.")
+
+        # Finish the remaining process
+        return await _call(f, self, *args, **kwargs)
+    return check_authentication
+
+
+def authorization_required(f):
+    """
+    authorization_required: a decorator to check authorization of requests according to bound status
+    :param f: original function to decorate
+    :return: authorization function as a decorator
+    """
+    @wraps(f)
+    @authentication_required
+    async def check_authorization(self, *args, **kwargs):
+        user_id = request.headers.get('USER-ID')
+
+        # Check the binding and renew its lease in one atomic round trip
+        result, _ = await binding.authorize_async(user_id)
+
+        # Raise 401 error if the resource is not bound,
+        # or 409 Conflict error if the resource is already bound to another user
+        if result != binding.BOUND:
+            abort_json(*binding.http_error(result))
+
+        return await _call(f, self, *args, **kwargs)
+    return check_authorization
+
+
+_session = None
+_pid = None
+
+
+def get_session():
+    """
+    get_session: get the HTTP client session of the current process, used to call other controllers
+    :return: aiohttp.ClientSession
+    """
+    global _session, _pid
+
+    if _session is None or _session.closed or _pid != os.getpid():
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(
+            total=config.get_float('RESOURCE_TIMEOUT')
+        ))
+        _pid = os.getpid()
+    return _session
+
+
+async def _call_resource(url, action, user_id):
+    # HTTP status code of the action, None if the resource is unreachable
+    try:
+        async with get_session().post(urljoin(base=url, url=action), headers={'USER-ID': str(user_id)}) as response:
+            return response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+
+
+async def _call_all(urls, action, user_id):
+    return await asyncio.gather(*(_call_resource(url, action, user_id) for url in urls))
+
+
+def resource_required(*resource_descriptions):
+    """
+    resource_required: a decorator to indicate required resources for the action
+    With one resource, the action receives it as argument 'resource'. With several resources, they are
+    bound concurrently, all or nothing, and the action receives a dictionary of resources by name.
+    Resources are unbound concurrently after the action, even if it fails.
+    Resources described without url are found in the discovery index, like with utils.resource_required.
+    :param resource_descriptions: names and urls, or names and capabilities, of required resources
+    :return: resource binding function as a decorator
+    """
+    def decorator(f):
+        @wraps(f)
+        async def bind_resource(self, *args, **kwargs):
+            # The index is in memory: only wait for the registry in a thread if a resource is not found
+            resolved = discovery.resolve(resource_descriptions, wait=False)
+            if None in resolved:
+                resolved = await asyncio.get_event_loop().run_in_executor(None, discovery.resolve,
+                                                                          resource_descriptions)
+            if None in resolved:
+                abort_json(HTTPStatus.SERVICE_UNAVAILABLE, "Resource not found.")
+            urls = [resource["url"] for resource in resolved]
+
+            # Use the service's user id to control resources
+            user_id = await binding.owner_async()
+
+            # Bind every resource, or roll back the bound ones
+            statuses = await _call_all(urls, 'user/bind', user_id)
+            if any(status != HTTPStatus.OK for status in statuses):
+                await _call_all([url for url, status in zip(urls, statuses) if status == HTTPStatus.OK],
+                                'user/unbind', user_id)
+                if None in statuses and HTTPStatus.CONFLICT not in statuses:
+                    abort_json(HTTPStatus.BAD_GATEWAY, "Resource unavailable.")
+                abort_json(HTTPStatus.CONFLICT, "Resource bound to another user.")
+
+            by_name = {resource["name"]: resource for resource in resolved}
+            resource = by_name if len(resolved) > 1 else resolved[0]
+
+            # Service action, the resources are unbound even if the action fails
+            try:
+                return await _call(f, self, resource, *args, **kwargs)
+            finally:
+                await _call_all(urls, 'user/unbind', user_id)
+        return bind_resource
+    return decorator
+
+
+def logger(f):
+    """
+    logger: a decorator to enable logging to a method
+    :param f: original function to decorate
+    :return: function with logger attached
+    """
+    @wraps(f)
+    async def log(self, *args, **kwargs):
+
+        # Get user ID
+        user_id = request.headers.get('USER-ID')
+
+        # Generate request ID
+        request_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+        # Action
+        result = await _call(f, self, *args, **kwargs)
+
+        data = {
+            "type": type(self).__name__,
+            "id": request_id,
+            "user_id": str(user_id),
+            "bounded_user_id": str(await binding.owner_async()),
+            "request_ip": str(request.remote_addr),
+            "function_name": f.__name__,
+            "function_argument": {
+                "args": str(args),
+                "kwargs": str(kwargs)
+            },
+            "function_result": str(result)
+        }
+
+        # Sent to the data collector (LOG_COLLECTOR_URL) in the background
+        log_shipper.ship(data)
+
+        return result
+    return log
@@ -0,0 +1,290 @@
+"""
+    Asynchronous commands of the Hue controller
+
+    In async command mode (COMMAND_MODE=async, or per request with the header 'Prefer: respond-async' when the
+    executors run with COMMAND_EXECUTOR=1), POST /resource/<action> validates the command, queues it in Redis
+    and answers 202 Accepted with its id at once.
+    The commands are executed by a separate pool of executor threads (python async_commands.py, started by run.sh),
+    so the HTTP workers never wait for the bridge, and GET /resource/commands/<id> reports the command as
+    queued, running, applied or failed with the resulting state of the light.
+
+    Commands of every resource of a multi-resource controller (resources.py) share the queue and the executors.
+
+    Each executor process moves the commands it takes to its own processing list and keeps a heartbeat in Redis:
+    the commands taken by an executor which died are queued again by the others.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+import config
+import resources
+from batch import APPLIED, FAILED, apply_batch
+from command_queue import send
+from hue_bridge import HueBridgeError
+from redis_pool import get_redis, get_script
+from state_cache import STATE_KEY, update_state
+
+
+log = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+
+JOBS_KEY = 'command_jobs'
+COMMAND_KEY = 'command:{id}'
+EXECUTORS_KEY = 'command_executors'
+PROCESSING_KEY = 'command_jobs:processing:{executor}'
+HEARTBEAT_KEY = 'command_executor:{executor}'
+
+# KEYS[1]: command hash, KEYS[2]: job queue, ARGV[1]: command id, ARGV[2]: ttl in seconds, ARGV[3...]: field, value
+_ENQUEUE = """
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('LPUSH', KEYS[2], ARGV[1])
+return 1
+"""
+
+# KEYS[1]: command hash, ARGV[1]: ttl in seconds, ARGV[2...]: field, value
+# An expired command is not created again without expiry
+_UPDATE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def executor_enabled():
+    """
+    executor_enabled: check whether run.sh starts the executors (COMMAND_MODE=async or COMMAND_EXECUTOR)
+    :return: bool
+    """
+    return config.get('COMMAND_MODE') == 'async' or config.get_bool('COMMAND_EXECUTOR')
+
+
+def requested(headers):
+    """
+    requested: check whether the command of the current request is executed asynchronously
+    :param headers: HTTP request headers
+    :return: bool
+    """
+    if config.get('COMMAND_MODE') == 'async':
+        return True
+
+    # Without executors a queued command would never run: 'Prefer' is only a preference, serve it synchronously
+    return executor_enabled() and 'respond-async' in headers.get('Prefer', '')
+
+
+def enqueue(action, body, user_id=None, resource=None):
+    """
+    enqueue: queue a command for the executors
+    :param action: 'on', 'off' or 'batch'
+    :param body: state of the light for on/off, {"lights" or "group", "state"} for batch
+    :param user_id: id of the user who sent the command
+    :param resource: resources.Resource controlled, the only resource of the controller by default
+    :return: command id
+    """
+    command_id = uuid.uuid4().hex
+    fields = {
+        "resource": resource.name if resource is not None and resource.name else '',
+        "action": action,
+        "body": json.dumps(body),
+        "user": user_id or '',
+        "status": QUEUED,
+        "submitted": time.time()
+    }
+    args = [command_id, int(config.get_float('COMMAND_RESULT_TTL'))]
+    for name, value in fields.items():
+        args.extend([name, value])
+    get_script(_ENQUEUE)(keys=[COMMAND_KEY.format(id=command_id), JOBS_KEY], args=args, client=get_redis())
+    return command_id
+
+
+def _update(command_id, fields, client=None):
+    # Change the fields of an existing command and renew its expiry
+    args = [int(config.get_float('COMMAND_RESULT_TTL'))]
+    for name, value in fields.items():
+        args.extend([name, value])
+    return get_script(_UPDATE)(keys=[COMMAND_KEY.format(id=command_id)], args=args, client=client or get_redis())
+
+
+def get_command(command_id):
+    """
+    get_command: read the status of a command
+    :param command_id: id of the command
+    :return: dictionary of the command (id, resource, action, status, submitted, finished, and state, lights or
+             error), None if it does not exist or expired
+    """
+    command = get_redis().hgetall(COMMAND_KEY.format(id=command_id))
+    if not command:
+        return None
+
+    status = {
+        "id": command_id,
+        "resource": command.get('resource') or None,
+        "action": command['action'],
+        "status": command['status'],
+        "submitted": float(command['submitted']),
+        "finished": float(command['finished']) if 'finished' in command else None
+    }
+    if 'result' in command:
+        status.update(json.loads(command['result']))
+    if 'error' in command:
+        status["error"] = command['error']
+    return status
+
+
+def execute(bridge, action, body, key=STATE_KEY):
+    """
+    execute: apply a command to the bridge, like the synchronous actions of the controller
+    :param bridge: HueBridgeClient
+    :param action: 'on', 'off' or 'batch'
+    :param body: body of the command
+    :param key: Redis key of the cached state of the light
+    :return: (APPLIED or FAILED, result dictionary)
+    """
+    if action == 'batch':
+        try:
+            group_id, results = apply_batch(bridge, body['state'], lights=body.get('lights'), group=body.get('group'))
+        except KeyError:
+            return FAILED, {"error": "Group not found."}
+
+        # Keep the cached state of the controlled light up to date
+        result = results.get(bridge.light_id)
+        if result is not None and result['status'] == APPLIED:
+            update_state(result['state'], key)
+        status = APPLIED if any(result['status'] == APPLIED for result in results.values()) else FAILED
+        return status, {"group": group_id, "lights": results}
+
+    applied = send(bridge, body)
+    update_state(applied, key)
+    return APPLIED, {"state": applied}
+
+
+class CommandExecutor(threading.Thread):
+    """
+    CommandExecutor: thread executing the queued commands one by one
+    """
+    def __init__(self, executor_id, stop_event):
+        """
+        :param executor_id: id of the executor process
+        :param stop_event: threading.Event set to stop the executor
+        """
+        super().__init__(name='command-executor', daemon=True)
+        self.processing = PROCESSING_KEY.format(executor=executor_id)
+        self._stop_event = stop_event
+
+    def run(self):
+        db = get_redis()
+        while not self._stop_event.is_set():
+            try:
+                command_id = db.brpoplpush(JOBS_KEY, self.processing, timeout=1)
+                if command_id is None:
+                    continue
+                self.process(command_id)
+                db.lrem(self.processing, 1, command_id)
+            except Exception:
+                log.exception("Command executor failed")
+                self._stop_event.wait(1.0)
+
+    def process(self, command_id):
+        db = get_redis()
+        key = COMMAND_KEY.format(id=command_id)
+        command = db.hmget(key, 'action', 'body', 'resource')
+        if command[0] is None:
+            # Expired before being executed
+            return
+
+        if not _update(command_id, {"status": RUNNING}, db):
+            return
+        resource = resources.get(command[2])
+        try:
+            if resource is None:
+                raise HueBridgeError("Resource {name} not found".format(name=command[2]))
+            status, result = execute(resource.bridge, command[0], json.loads(command[1]), resource.key(STATE_KEY))
+            fields = {"status": status, "result": json.dumps(result)}
+        except HueBridgeError as e:
+            fields = {"status": FAILED, "error": str(e)}
+        except Exception as e:
+            # A command is never left running
+            log.exception("Command %s failed", command_id)
+            fields = {"status": FAILED, "error": "Internal error: {error}".format(error=e)}
+        fields["finished"] = time.time()
+        _update(command_id, fields, db)
+
+
+def requeue_dead(db):
+    """
+    requeue_dead: queue again the commands taken by executor processes which stopped their heartbeat
+    :param db: Redis client
+    :return: number of commands queued again
+    """
+    requeued = 0
+    for executor_id in db.smembers(EXECUTORS_KEY):
+        if db.exists(HEARTBEAT_KEY.format(executor=executor_id)):
+            continue
+        processing = PROCESSING_KEY.format(executor=executor_id)
+        command_id = db.rpoplpush(processing, JOBS_KEY)
+        while command_id is not None:
+            _update(command_id, {"status": QUEUED}, db)
+            requeued += 1
+            command_id = db.rpoplpush(processing, JOBS_KEY)
+        db.srem(EXECUTORS_KEY, executor_id)
+    return requeued
+
+
+def run(workers=None, stop_event=None):
+    """
+    run: execute the queued commands until interrupted
+    :param workers: number of executor threads, COMMAND_WORKERS by default
+    :param stop_event: threading.Event set to stop the executors
+    :return: None
+    """
+    workers = workers or config.get_int('COMMAND_WORKERS')
+    executor_id = '{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+    heartbeat = HEARTBEAT_KEY.format(executor=executor_id)
+    ttl = config.get_float('COMMAND_HEARTBEAT_TTL')
+    db = get_redis()
+    stop_event = stop_event or threading.Event()
+
+    db.set(heartbeat, 1, px=int(ttl * 1000))
+    db.sadd(EXECUTORS_KEY, executor_id)
+    executors = [CommandExecutor(executor_id, stop_event) for _ in range(workers)]
+    for executor in executors:
+        executor.start()
+    log.info("%d command executors started", workers)
+
+    try:
+        while not stop_event.is_set():
+            db.set(heartbeat, 1, px=int(ttl * 1000))
+            requeued = requeue_dead(db)
+            if requeued:
+                log.warning("%d commands of stopped executors queued again", requeued)
+            stop_event.wait(ttl / 3)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Finish the running commands, the others executors queue again what is left
+        stop_event.set()
+        for executor in executors:
+            executor.join(config.get_float('HUE_COMMAND_TIMEOUT'))
+        db.delete(heartbeat)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    run(stop_event=stopped)
@@ -11,16 +11,30 @@
 
     refer https://flask.palletsprojects.com/en/1.1.x/views/
 """
-import redis
-import json
+import logging
+import os
 import requests
+import threading
 
 from http import HTTPStatus
 from abc import abstractmethod
-from flask import request, jsonify, make_response
+from flask import Blueprint, Flask, Response, abort, g, redirect, request, jsonify, make_response, after_this_request
 from flask.views import MethodView
+from flask_cors import CORS
 
-from utils import abort_json, authentication_required, authorization_required, api_description, add_property, add_action, get_description
+import binding
+import cluster
+import config
+import log_shipper
+import metrics
+import profiler
+import redis_pool
+import resources
+from redis_pool import get_redis, pool_stats
+from utils import abort_json, authentication_required, authorization_required, api_description, add_property, add_action, compiled_description, publish_description, register_api
+
+
+log = logging.getLogger(__name__)
 
 
 class API(MethodView):
@@ -28,12 +42,28 @@ class API(MethodView):
     API: basic API
     """
     def __init__(self):
-        self.redis = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+        # Views are created per request: share the connection pool of the worker process
+        self.redis = get_redis()
+
+    def dispatch_request(self, *args, **kwargs):
+        # Profile the request on demand: every API of the controllers is covered
+        if not profiler.requested(request.headers):
+            return super().dispatch_request(*args, **kwargs)
+
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        with profiler.RequestProfile('{method} {rule}'.format(method=request.method, rule=rule)) as profile:
+            @after_this_request
+            def add_profile_id(response):
+                response.headers['PROFILE-ID'] = profile.id
+                return response
+
+            return super().dispatch_request(*args, **kwargs)
 
 
 class DescriptionAPI(API):
     """
     DescriptionAPI: API for return the description of the service or resource
+    The description is serialized once per process and revalidated by clients with ETag / If-None-Match
     """
 
     def get(self):
@@ -41,7 +71,23 @@ class DescriptionAPI(API):
         get: responses description of the service or resource
         :return:
         """
-        return make_response(jsonify(get_description()), HTTPStatus.OK)
+        compiled = compiled_description(resources.current())
+        if compiled is None:
+            return make_response(jsonify(None), HTTPStatus.OK)
+
+        # The client already has this description
+        if request.if_none_match.contains(compiled.etag):
+            response = make_response('', HTTPStatus.NOT_MODIFIED)
+        elif compiled.gzipped is not None and 'gzip' in request.accept_encodings:
+            response = make_response(compiled.gzipped, HTTPStatus.OK)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(compiled.body, HTTPStatus.OK)
+
+        response.set_etag(compiled.etag)
+        response.headers['Content-Type'] = 'application/json'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
 
     @staticmethod
     def add_url_rule(_app):
@@ -55,6 +101,61 @@ class DescriptionAPI(API):
         _app.add_url_rule('/', view_func=view, methods=['GET', ])
 
 
+class StatsAPI(API):
+    """
+    StatsAPI: API for return the runtime statistics of the worker process
+    """
+
+    def get(self):
+        """
+        get: responses the connection pool statistics of the worker which served the request
+        :return:
+        """
+        return make_response(jsonify({
+            "redisPool": pool_stats(),
+            "logShipper": log_shipper.get_shipper().stats()
+        }), HTTPStatus.OK)
+
+    @staticmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to flask app automatically
+        :param _app: flask app
+        :return: None
+        """
+        view = StatsAPI.as_view('stats_api')
+        # Stats API View
+        _app.add_url_rule('/stats', view_func=view, methods=['GET', ])
+
+
+class MetricsAPI(API):
+    """
+    MetricsAPI: API for return the metrics of the controller in Prometheus text format
+    """
+
+    def get(self):
+        """
+        get: responses the metrics, aggregated over the worker processes in multiprocess mode
+        :return:
+        """
+        body, content_type = metrics.render()
+        response = make_response(body, HTTPStatus.OK)
+        response.headers['Content-Type'] = content_type
+        return response
+
+    @staticmethod
+    def add_url_rule(_app):
+        """
+        add_url_rule: add urls to flask app automatically, and time every request of the app
+        :param _app: flask app
+        :return: None
+        """
+        view = MetricsAPI.as_view('metrics_api')
+        # Metrics API View
+        _app.add_url_rule('/metrics', view_func=view, methods=['GET', ])
+        metrics.init_app(_app)
+
+
 class BindAPI(API):
     """
     BindAPI: API for bind/unbind user to the service or resource
@@ -81,9 +182,10 @@ class BindAPI(API):
         get: responses currently bound user's ID
         :return: [flask HTTP response in JSON] bound user's ID
         """
+        user_id = binding.owner(resources.current().key(binding.BINDING_KEY))
         response = make_response(jsonify({
-            "bound": self.redis.exists('user_id'),
-            "userId": self.redis.get('user_id')
+            "bound": int(user_id is not None),
+            "userId": user_id
         }), HTTPStatus.OK)
         return response
 
@@ -114,21 +216,25 @@ class BindAPI(API):
     )
     @authentication_required
     def bind(self):
-        # Read user id from HTTP request header
+        # Read user id and optional lease of the binding in seconds from HTTP request header
         user_id = request.headers.get('USER-ID')
+        ttl = request.headers.get('LEASE-TTL')
+
+        # Bind user atomically: the resource is free or already bound to the user
+        try:
+            result, owner = binding.bind(user_id, ttl, resources.current().key(binding.BINDING_KEY))
+        except ValueError:
+            abort_json(HTTPStatus.BAD_REQUEST, "Invalid lease.")
 
         # Raise 409 Conflict error if the resource is already bound to another user
-        if self.redis.exists('user_id') and self.redis.get('user_id') != user_id:
+        if result != binding.BOUND:
             abort_json(HTTPStatus.CONFLICT, "Resource bound to another user.")
 
         # Bind user successfully
-        else:
-            self.redis.set('user_id', user_id)
-            
-            response = make_response(jsonify({
-                "userId": self.redis.get('user_id')
-            }), HTTPStatus.OK)
-            return response
+        response = make_response(jsonify({
+            "userId": owner
+        }), HTTPStatus.OK)
+        return response
 
     @add_action(
         name="unbind",
@@ -137,24 +243,24 @@ class BindAPI(API):
         output={"userId": {"type": "string"}},
         path="/user/unbind"
     )
-    @authorization_required
+    @authentication_required
     def unbind(self):
         # Read user id from HTTP request header
         user_id = request.headers.get('USER-ID')
 
-        # Raise 401 error if the resource is not bound
-        if not self.redis.exists('user_id'):
-            abort_json(HTTPStatus.UNAUTHORIZED, "Resource not bound.")
+        # Check the owner and unbind in one atomic round trip
+        result, owner = binding.unbind(user_id, resources.current().key(binding.BINDING_KEY))
 
-        # Unbind user successfully
-        else:
-            user_id = self.redis.get('user_id')
-            self.redis.delete('user_id')
+        # Raise 401 error if the resource is not bound,
+        # or 409 Conflict error if the resource is already bound to another user
+        if result != binding.BOUND:
+            abort_json(*binding.http_error(result))
 
-            response = make_response(jsonify({
-                "userId": user_id
-            }), HTTPStatus.OK)
-            return response
+        # Unbind user successfully
+        response = make_response(jsonify({
+            "userId": owner
+        }), HTTPStatus.OK)
+        return response
 
     @staticmethod
     def add_url_rule(_app):
@@ -199,6 +305,60 @@ class ResourceAPI(API):
         """
 
 
+def route_to(membership, node):
+    """
+    route_to: answer the current request with the response of another node (CLUSTER_ROUTING=forward),
+    or redirect the client to it (CLUSTER_ROUTING=redirect)
+    :param membership: cluster.Membership of the process
+    :param node: url of the node owning the resource of the request
+    :return: None if the node is unreachable: the request is served locally, as the state is shared in Redis
+    """
+    if config.get('CLUSTER_ROUTING') == 'redirect':
+        abort(redirect(node + request.full_path.rstrip('?'), HTTPStatus.TEMPORARY_REDIRECT))
+
+    try:
+        status, headers, body = membership.forward(node, request)
+    except requests.RequestException as e:
+        log.warning("Forwarding to %s failed, serving locally: %s", node, e)
+        return
+    abort(Response(body, status, headers))
+
+
+def add_resource_rules(_app, *apis):
+    """
+    add_resource_rules: add the urls of the APIs of every resource to flask app
+    With RESOURCES, the APIs of each resource are served under /<name> of the resource, otherwise at the root
+    :param _app: flask app
+    :param apis: API classes served per resource, e.g. BindAPI, DescriptionAPI and the resource API
+    :return: None
+    """
+    if not resources.enabled():
+        for api in apis:
+            api.add_url_rule(_app)
+        return
+
+    blueprint = Blueprint('resources', __name__, url_prefix='/<resource>')
+
+    @blueprint.url_value_preprocessor
+    def select_resource(endpoint, values):
+        # The views of every resource are shared: they read the resource of the request with resources.current()
+        resource = resources.get(values.pop('resource'))
+        if resource is None:
+            abort_json(HTTPStatus.NOT_FOUND, "Resource not found.")
+
+        # With CLUSTER, the resources of the other nodes are served by them
+        if cluster.enabled() and cluster.FORWARDED_HEADER not in request.headers:
+            membership = cluster.get_membership()
+            node = membership.owner(resource.name)
+            if node != membership.node:
+                route_to(membership, node)
+        g.resource = resource
+
+    for api in apis:
+        api.add_url_rule(blueprint)
+    _app.register_blueprint(blueprint)
+
+
 class ServiceAPI(API):
     """
     ServiceAPI: base API for controlling services
@@ -226,4 +386,93 @@ class ServiceAPI(API):
         add_url_rule: add urls to flask app automatically
         :param _app: flask app
         :return: None
-        """
\ No newline at end of file
+        """
+
+
+# Functions run once in each worker process, added by create_app
+_worker_hooks = []
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def _run_hooks(hooks):
+    for hook in hooks:
+        try:
+            hook()
+        except Exception:
+            # Redis or the network is down: the threads started lazily retry later
+            log.exception("Worker startup failed")
+
+
+def start_worker():
+    """
+    start_worker: start the threads and connections of the current worker process, once per process
+    Called by gunicorn after the fork (gunicorn.conf.py), otherwise before the first request
+    :return: None
+    """
+    global _worker_pid
+
+    if _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        hooks = list(_worker_hooks)
+    _run_hooks(hooks)
+
+
+def _join_cluster():
+    # Join the cluster when the worker starts, not at its first request
+    if cluster.enabled():
+        cluster.get_membership()
+
+
+def create_app(settings=None, import_name=__name__, apis=(), resource_apis=(), startup_hooks=(), worker_hooks=()):
+    """
+    create_app: create the flask app of a controller
+    One-time work (reading the configuration files, publishing the description to Redis) runs here, once in the
+    gunicorn master with --preload. Threads and connections are created in each worker after the fork instead,
+    by the worker hooks, registration of the description included
+    :param settings: dictionary of settings overriding the environment (see config.py),
+                     e.g. {"APP_STARTUP": False} for tests without Redis or network
+    :param import_name: name of the module of the controller
+    :param apis: API classes served once at the root, e.g. StatsAPI and MetricsAPI
+    :param resource_apis: API classes served per resource (add_resource_rules), e.g. BindAPI, DescriptionAPI
+    :param startup_hooks: functions run once when the app is created, e.g. reading a configuration file
+    :param worker_hooks: functions run once in each worker process, e.g. starting a poller
+    :return: flask app
+    """
+    if settings:
+        config.update(settings)
+
+    app = Flask(import_name)
+    CORS(app)
+    for api in apis:
+        api.add_url_rule(app)
+    add_resource_rules(app, *resource_apis)
+
+    # Tests: no Redis, no registry, no threads
+    if not config.get_bool('APP_STARTUP'):
+        return app
+
+    try:
+        _run_hooks(startup_hooks)
+        publish_description()
+    except Exception:
+        log.exception("Publishing the description failed")
+    finally:
+        # Connections of the master are not shared with the workers
+        redis_pool.reset()
+
+    hooks = [register_api, _join_cluster] + list(worker_hooks)
+    with _worker_lock:
+        _worker_hooks.extend(hooks)
+        started = _worker_pid == os.getpid()
+
+    # Created in a worker which already started (no --preload): run the hooks of this app at once
+    if started:
+        _run_hooks(hooks)
+    else:
+        app.before_request(start_worker)
+    return app
@@ -0,0 +1,66 @@
+"""
+    Batch control of many lights
+
+    A batch is sent as one group action when a group of the bridge covers exactly the requested lights,
+    otherwise it fans out to the command queue of each light with bounded parallelism.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from command_queue import send, take_token
+from hue_bridge import HueBridgeError
+
+
+APPLIED = "applied"
+FAILED = "failed"
+
+
+def _send_each(bridge, state, lights):
+    def apply(light_id):
+        try:
+            return light_id, {"status": APPLIED, "state": send(bridge, state, light_id)}
+        except HueBridgeError as e:
+            return light_id, {"status": FAILED, "error": str(e)}
+
+    parallelism = max(min(config.get_int('HUE_BATCH_PARALLELISM'), len(lights)), 1)
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        return dict(executor.map(apply, lights))
+
+
+def apply_batch(bridge, state, lights=None, group=None):
+    """
+    apply_batch: change the state of many lights
+    :param bridge: HueBridgeClient
+    :param state: attributes of the state to change
+    :param lights: ids of the lights
+    :param group: id or name of a group of the bridge, used instead of lights
+    :return: (id of the group used or None, {light id: {"status": ..., "state" or "error": ...}})
+    :raise KeyError: the group does not exist
+    """
+    max_age = config.get_float('HUE_GROUPS_TTL')
+    if lights is not None:
+        lights = [str(light) for light in lights]
+
+    # One group action covers the set
+    if group is not None:
+        group_id, lights = bridge.find_group(name=group, max_age=max_age)
+        if group_id is None:
+            raise KeyError(group)
+    elif len(lights) > 1:
+        try:
+            group_id, _ = bridge.find_group(lights=lights, max_age=max_age)
+        except HueBridgeError:
+            group_id = None
+    else:
+        group_id = None
+
+    if group_id is None:
+        return None, _send_each(bridge, state, lights)
+
+    take_token(bridge)
+    try:
+        bridge.set_group_action(group_id, state)
+        result = {"status": APPLIED, "state": state}
+    except HueBridgeError as e:
+        result = {"status": FAILED, "error": str(e)}
+    return group_id, {light: dict(result) for light in lights}
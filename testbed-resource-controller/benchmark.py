@@ -0,0 +1,284 @@
+"""
+    Load test of a resource controller against a local fake Hue bridge
+
+    It starts a local Redis (redis-server), the fake bridge (fake_bridge.py) and the controller under gunicorn,
+    drives each scenario with a fixed number of concurrent clients (closed loop) or at a fixed rate (open loop,
+    latency measured from the scheduled time), and writes a JSON report of the requests/s and p50/p95/p99 latency
+    of each scenario, with the settings of the run so that runs can be compared. For example
+        python benchmark.py --workers 4 --concurrency 32 --duration 10 --output report-w4.json
+        python benchmark.py --workers 2 --threads 8 --worker-class gthread --rate 500 --output report-g2x8.json
+
+    Scenarios:
+        get_resource    GET /resource
+        bind            POST /user/bind (same user again)
+        on_off          POST /resource/on and /resource/off alternately
+        description     GET /
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+USER_ID = 'benchmark'
+
+SCENARIOS = {
+    "get_resource": lambda i: ('GET', '/resource'),
+    "bind": lambda i: ('POST', '/user/bind'),
+    "on_off": lambda i: ('POST', '/resource/on' if i % 2 == 0 else '/resource/off'),
+    "description": lambda i: ('GET', '/')
+}
+
+
+def percentile(latencies, fraction):
+    """
+    percentile: nearest-rank percentile
+    :param latencies: sorted latencies
+    :param fraction: e.g. 0.99
+    :return: latency, None if there is no latency
+    """
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, max(0, int(round(fraction * len(latencies))) - 1))]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    summarize: statistics of a scenario
+    :param latencies: latencies of the requests in seconds
+    :param errors: number of failed requests (error status or no response)
+    :param elapsed: duration of the scenario in seconds
+    :return: dictionary of the statistics, latencies in milliseconds
+    """
+    latencies = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50": ms(percentile(latencies, 0.50)),
+        "p95": ms(percentile(latencies, 0.95)),
+        "p99": ms(percentile(latencies, 0.99)),
+        "max": ms(latencies[-1] if latencies else None)
+    }
+
+
+class LoadGenerator:
+    """
+    LoadGenerator: drive one scenario against the controller
+    """
+    def __init__(self, base_url, scenario, concurrency, rate=0.0, timeout=10.0):
+        """
+        :param base_url: url of the controller
+        :param scenario: name of the scenario
+        :param concurrency: number of concurrent clients
+        :param rate: requests per second (0: closed loop, each client sends its next request once answered)
+        :param timeout: timeout of a request in seconds
+        """
+        self.base_url = base_url.rstrip('/')
+        self.request = SCENARIOS[scenario]
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.latencies = []
+        self.errors = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _session(self):
+        # One keep-alive session per client thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _send(self, i, scheduled):
+        method, path = self.request(i)
+        try:
+            response = self._session().request(method, self.base_url + path, headers={'USER-ID': USER_ID},
+                                               timeout=self.timeout)
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            failed = True
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            self.latencies.append(latency)
+            self.errors += failed
+
+    def run(self, duration):
+        """
+        run: send requests for a while
+        :param duration: seconds
+        :return: statistics of the scenario
+        """
+        started = time.perf_counter()
+        deadline = started + duration
+        if self.rate > 0:
+            # Open loop: requests are sent on schedule, even if the controller falls behind
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                i = 0
+                while True:
+                    scheduled = started + i / self.rate
+                    if scheduled >= deadline:
+                        break
+                    time.sleep(max(0.0, scheduled - time.perf_counter()))
+                    executor.submit(self._send, i, scheduled)
+                    i += 1
+        else:
+            def client(offset):
+                i = offset
+                while time.perf_counter() < deadline:
+                    self._send(i, time.perf_counter())
+                    i += self.concurrency
+
+            clients = [threading.Thread(target=client, args=(offset,)) for offset in range(self.concurrency)]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+        return summarize(self.latencies, self.errors, time.perf_counter() - started)
+
+
+def wait_ready(url, timeout=30.0):
+    # The controller is ready once it serves its description
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1.0).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("{url} is not ready after {timeout}s".format(url=url, timeout=timeout))
+
+
+def start_stack(args, workdir):
+    """
+    start_stack: start Redis, the fake bridge and the controller
+    :param args: parsed arguments
+    :param workdir: temporary directory of the run
+    :return: list of the started processes
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    log = open(os.path.join(workdir, 'stack.log'), 'w')
+    processes = []
+
+    def start(command, env=None):
+        processes.append(subprocess.Popen(command, cwd=here, env=dict(os.environ, **(env or {})),
+                                          stdout=log, stderr=subprocess.STDOUT))
+
+    if not args.no_redis:
+        start(['redis-server', '--port', str(args.redis_port), '--save', '', '--appendonly', 'no'])
+
+    bridge_url = 'http://127.0.0.1:{port}'.format(port=args.bridge_port)
+    start(['gunicorn', 'fake_bridge:app', '-b', '127.0.0.1:{port}'.format(port=args.bridge_port),
+           '-k', 'gthread', '--threads', '64'], {
+        'FAKE_BRIDGE_LATENCY': str(args.bridge_latency),
+        'FAKE_BRIDGE_ERROR_RATE': str(args.bridge_error_rate),
+        'FAKE_BRIDGE_RATE_LIMIT': str(args.bridge_rate_limit)
+    })
+
+    url_set = os.path.join(workdir, 'hue_url_set.json')
+    with open(url_set, 'w') as f:
+        json.dump({"bridge": bridge_url + '/api/benchmark', "light": "1"}, f)
+
+    metrics_dir = os.path.join(workdir, 'metrics')
+    os.makedirs(metrics_dir)
+    command = ['gunicorn', '{controller}:create_app()'.format(controller=args.controller),
+               '-b', '127.0.0.1:{port}'.format(port=args.port),
+               '-w', str(args.workers), '-k', args.worker_class]
+    if args.worker_class == 'gthread':
+        command += ['--threads', str(args.threads)]
+    start(command, dict({
+        'NAME': args.controller.split('_')[0],
+        'ID': '1',
+        'URL': 'http://127.0.0.1:{port}'.format(port=args.port),
+        'REDIS_PORT': str(args.redis_port),
+        'HUE_URL_SET': url_set,
+        'LOG_COLLECTOR_URL': bridge_url + '/collector',
+        'LOG_SPOOL_DIR': '',
+        # The fake bridge also accepts the registration: the run calls no external service
+        'REGISTRY_URL': bridge_url + '/collector',
+        'PROMETHEUS_MULTIPROC_DIR': metrics_dir,
+        'prometheus_multiproc_dir': metrics_dir
+    }, **dict(setting.split('=', 1) for setting in args.set)))
+    return processes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of a resource controller against a fake Hue bridge")
+    parser.add_argument('--controller', default='hue_controller', help="module of the controller app")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated scenarios")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument('--warmup', type=float, default=1.0, help="seconds of warm-up per scenario, not reported")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent clients")
+    parser.add_argument('--rate', type=float, default=0.0, help="requests per second (0: closed loop)")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1, help="threads per worker (gthread)")
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--port', type=int, default=18000)
+    parser.add_argument('--bridge-port', type=int, default=18088)
+    parser.add_argument('--bridge-latency', type=float, default=0.02, help="seconds per bridge call")
+    parser.add_argument('--bridge-error-rate', type=float, default=0.0)
+    parser.add_argument('--bridge-rate-limit', type=float, default=0.0, help="bridge calls per second (0: none)")
+    parser.add_argument('--redis-port', type=int, default=16379)
+    parser.add_argument('--no-redis', action='store_true', help="use the Redis already running on --redis-port")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="setting of the controller, e.g. --set STATE_CACHE_TTL=0")
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    processes = start_stack(args, workdir)
+    base_url = 'http://127.0.0.1:{port}'.format(port=args.port)
+    try:
+        wait_ready(base_url + '/')
+        requests.post(base_url + '/user/bind', headers={'USER-ID': USER_ID}, timeout=10.0).raise_for_status()
+
+        results = {}
+        for scenario in args.scenarios.split(','):
+            if args.warmup > 0:
+                LoadGenerator(base_url, scenario, args.concurrency, args.rate).run(args.warmup)
+            results[scenario] = LoadGenerator(base_url, scenario, args.concurrency, args.rate).run(args.duration)
+            print("{scenario:>14}: {rps} req/s, p50 {p50} ms, p95 {p95} ms, p99 {p99} ms, {errors} errors".format(
+                scenario=scenario, **results[scenario]))
+
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        report = {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "commit": commit,
+            "python": platform.python_version(),
+            "settings": vars(args),
+            "results": results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Report written to {output}".format(output=args.output))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+    Atomic binding engine
+
+    The bind/unbind/authorize state machine runs as Lua scripts on the Redis server, so every check
+    or transition is a single atomic round trip and two users binding at once can never both win.
+    A binding may carry a lease: it expires by itself unless the owner keeps using the resource.
+
+    Each worker keeps the owner in its L1 cache (see l1_cache.py): bind and unbind publish the change of the
+    binding, so steady-state authorization needs no round trip. The lease of the owner is still renewed in
+    Redis once a third of it has elapsed.
+"""
+import math
+import time
+
+from http import HTTPStatus
+
+import config
+import l1_cache
+import metrics
+from redis_pool import get_redis, get_script
+
+
+BINDING_KEY = 'user_id'
+
+# Results of the scripts
+BOUND = 1
+CONFLICT = 0
+NOT_BOUND = -1
+
+# KEYS[1]: binding key, KEYS[2]: lease key, KEYS[3]: invalidation channel, ARGV[1]: user id,
+# ARGV[2]: lease in milliseconds (0: no lease)
+# return: {result, owner, lease}
+_BIND = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return {0, owner, false}
+end
+local lease = tonumber(ARGV[2])
+if lease > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', lease)
+    redis.call('SET', KEYS[2], lease, 'PX', lease)
+else
+    redis.call('SET', KEYS[1], ARGV[1])
+    redis.call('DEL', KEYS[2])
+end
+redis.call('PUBLISH', KEYS[3], KEYS[1])
+return {1, ARGV[1], lease}
+"""
+
+# KEYS[1]: binding key, KEYS[2]: lease key, KEYS[3]: invalidation channel, ARGV[1]: user id
+# return: {result, owner, lease}
+_UNBIND = """
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    return {-1, false, false}
+end
+if owner ~= ARGV[1] then
+    return {0, owner, false}
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('PUBLISH', KEYS[3], KEYS[1])
+return {1, owner, false}
+"""
+
+# KEYS[1]: binding key, KEYS[2]: lease key, KEYS[3]: invalidation channel, ARGV[1]: user id
+# return: {result, owner, lease or remaining time of the binding of another user}, the lease of the owner is renewed
+_AUTHORIZE = """
+local owner = redis.call('GET', KEYS[1])
+if not owner then
+    return {-1, false, false}
+end
+if owner ~= ARGV[1] then
+    return {0, owner, redis.call('PTTL', KEYS[1])}
+end
+local lease = redis.call('GET', KEYS[2])
+if lease then
+    redis.call('PEXPIRE', KEYS[1], lease)
+    redis.call('PEXPIRE', KEYS[2], lease)
+end
+return {1, owner, lease}
+"""
+
+
+_OPERATIONS = {_BIND: 'bind', _UNBIND: 'unbind', _AUTHORIZE: 'authorize'}
+
+
+def _keys(key):
+    return [key, key + ':lease', l1_cache.CHANNEL]
+
+
+def _reply(source, reply):
+    result, owner, lease = int(reply[0]), reply[1], int(reply[2] or 0)
+    if result == CONFLICT:
+        metrics.binding_conflict(_OPERATIONS[source])
+    return result, owner, max(lease, 0)
+
+
+def _run(source, key, *args):
+    return _reply(source, get_script(source)(keys=_keys(key), args=list(args), client=get_redis()))
+
+
+def _cached(cache, key, user_id):
+    # Result of an authorization from the L1 cache, None if Redis must be asked
+    entry = cache.get(key) if cache is not None else None
+    if entry is None:
+        return None
+    owner, lease, renewed = entry
+    if owner is None:
+        return NOT_BOUND, None
+    if owner != user_id:
+        metrics.binding_conflict('authorize')
+        return CONFLICT, owner
+
+    # Renew the lease in Redis long before it expires
+    if lease and time.monotonic() - renewed > lease / 3000:
+        return None
+    return BOUND, owner
+
+
+def _changed(result, key):
+    # The other workers are notified by the script, this one must not wait for the message
+    cache = l1_cache.get_cache()
+    if result == BOUND and cache is not None:
+        cache.invalidate(key)
+
+
+def _remember(cache, generation, key, owner, lease):
+    # A binding with a lease (or another user's expiring binding) is cached until it would expire
+    if cache is not None:
+        cache.set(key, (owner, lease, time.monotonic()), generation, lease / 1000 if lease else None)
+
+
+def lease_ttl(value=None):
+    """
+    lease_ttl: resolve the lease of a binding
+    :param value: requested lease in seconds, or None to use BIND_LEASE_TTL
+    :return: lease in milliseconds, 0 if the binding never expires
+    :raise ValueError: the requested lease is not a positive number of seconds
+    """
+    if value is None or value == '':
+        return max(int(config.get_float('BIND_LEASE_TTL', 0) * 1000), 0)
+
+    # A requested lease always expires: inf, nan or <= 0 would make the binding permanent
+    seconds = float(value)
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError("Invalid lease {value!r}".format(value=value))
+    return max(int(seconds * 1000), 1)
+
+
+def bind(user_id, ttl=None, key=BINDING_KEY):
+    """
+    bind: bind the user to the resource if it is free or already bound to the same user
+    :param user_id: id of the user
+    :param ttl: lease of the binding in seconds, None to use BIND_LEASE_TTL
+    :param key: Redis key of the binding
+    :return: (BOUND or CONFLICT, current owner)
+    """
+    result, owner, _ = _run(_BIND, key, user_id, lease_ttl(ttl))
+    _changed(result, key)
+    return result, owner
+
+
+def unbind(user_id, key=BINDING_KEY):
+    """
+    unbind: unbind the user from the resource
+    :param user_id: id of the user
+    :param key: Redis key of the binding
+    :return: (BOUND if unbound successfully, CONFLICT or NOT_BOUND, previous owner)
+    """
+    result, owner, _ = _run(_UNBIND, key, user_id)
+    _changed(result, key)
+    return result, owner
+
+
+def authorize(user_id, key=BINDING_KEY):
+    """
+    authorize: check the user is the owner of the resource, and renew the lease of the binding
+    :param user_id: id of the user
+    :param key: Redis key of the binding
+    :return: (BOUND, CONFLICT or NOT_BOUND, current owner)
+    """
+    cache = l1_cache.get_cache()
+    cached = _cached(cache, key, user_id)
+    if cached is not None:
+        return cached
+
+    generation = cache.generation if cache is not None else None
+    result, owner, lease = _run(_AUTHORIZE, key, user_id)
+    _remember(cache, generation, key, owner, lease)
+    return result, owner
+
+
+def owner(key=BINDING_KEY):
+    """
+    owner: read the currently bound user
+    :param key: Redis key of the binding
+    :return: user id, None if not bound
+    """
+    cache = l1_cache.get_cache()
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None:
+        return entry[0]
+
+    generation = cache.generation if cache is not None else None
+    user_id, ttl = get_redis().pipeline(transaction=False).get(key).pttl(key).execute()
+    _remember(cache, generation, key, user_id, max(ttl, 0))
+    return user_id
+
+
+def http_error(result):
+    """
+    http_error: HTTP error of a failed binding check
+    :param result: NOT_BOUND or CONFLICT
+    :return: (status code, error message)
+    """
+    if result == NOT_BOUND:
+        return HTTPStatus.UNAUTHORIZED, "Resource not bound."
+    return HTTPStatus.CONFLICT, "Resource bound to another user."
+
+
+async def _run_async(source, key, *args):
+    # redis.asyncio is only required by the asyncio controllers
+    import aio_redis_pool
+
+    db = aio_redis_pool.get_redis()
+    return _reply(source, await aio_redis_pool.get_script(source)(keys=_keys(key), args=list(args), client=db))
+
+
+async def bind_async(user_id, ttl=None, key=BINDING_KEY):
+    """
+    bind_async: asyncio counterpart of bind
+    """
+    result, owner, _ = await _run_async(_BIND, key, user_id, lease_ttl(ttl))
+    _changed(result, key)
+    return result, owner
+
+
+async def unbind_async(user_id, key=BINDING_KEY):
+    """
+    unbind_async: asyncio counterpart of unbind
+    """
+    result, owner, _ = await _run_async(_UNBIND, key, user_id)
+    _changed(result, key)
+    return result, owner
+
+
+async def authorize_async(user_id, key=BINDING_KEY):
+    """
+    authorize_async: asyncio counterpart of authorize
+    """
+    cache = l1_cache.get_cache()
+    cached = _cached(cache, key, user_id)
+    if cached is not None:
+        return cached
+
+    generation = cache.generation if cache is not None else None
+    result, owner, lease = await _run_async(_AUTHORIZE, key, user_id)
+    _remember(cache, generation, key, owner, lease)
+    return result, owner
+
+
+async def owner_async(key=BINDING_KEY):
+    """
+    owner_async: asyncio counterpart of owner
+    """
+    import aio_redis_pool
+
+    cache = l1_cache.get_cache()
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None:
+        return entry[0]
+
+    generation = cache.generation if cache is not None else None
+    user_id, ttl = await aio_redis_pool.get_redis().pipeline(transaction=False).get(key).pttl(key).execute()
+    _remember(cache, generation, key, user_id, max(ttl, 0))
+    return user_id
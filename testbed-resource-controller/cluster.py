@@ -0,0 +1,192 @@
+"""
+    Sharding of the resources of a multi-resource controller over several nodes
+
+    Every node (CLUSTER_NODE_URL, the URL of the controller by default) keeps a heartbeat key in Redis,
+    expiring after CLUSTER_NODE_TTL seconds, and lists itself in the member set. Each worker reads the live
+    members every CLUSTER_HEARTBEAT seconds and places them on a consistent-hash ring with CLUSTER_VNODES
+    points per node: a resource belongs to the first node after the hash of its name, so a node joining
+    or leaving moves only about 1/N of the resources.
+
+    A node receiving a request for a resource of another node forwards it over a pooled keep-alive session
+    (CLUSTER_ROUTING=forward) or redirects the client (CLUSTER_ROUTING=redirect). A forwarded request is always
+    served by the node receiving it, so nodes whose views of the membership differ for a moment never loop.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+from redis_pool import get_redis
+
+
+log = logging.getLogger(__name__)
+
+NODES_KEY = 'cluster_nodes'
+NODE_KEY = 'cluster_node:{node}'
+
+# Header of the requests forwarded by a node
+FORWARDED_HEADER = 'X-Forwarded-By'
+
+# Headers of a single connection, not forwarded
+_HOP_BY_HOP = frozenset(['connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+                         'transfer-encoding', 'upgrade', 'host', 'content-length'])
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    HashRing: consistent-hash ring of the nodes
+    """
+    def __init__(self, nodes, vnodes=128):
+        """
+        :param nodes: ids of the nodes
+        :param vnodes: points of each node on the ring, spreading the resources evenly
+        """
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash('{node}#{i}'.format(node=node, i=i)), node) for node in self.nodes
+                        for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        """
+        node: node owning a key
+        :param key: e.g. name of a resource
+        :return: id of the node, None if the ring is empty
+        """
+        if not self._nodes:
+            return None
+        return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+def enabled():
+    return config.get_bool('CLUSTER')
+
+
+def node_url():
+    """
+    node_url: url of this node, reachable by the other nodes
+    :return: url
+    """
+    return (config.get('CLUSTER_NODE_URL') or os.environ.get('URL') or '').rstrip('/')
+
+
+class Membership:
+    """
+    Membership: heartbeat of this node and ring of the live nodes, refreshed by a daemon thread
+    """
+    def __init__(self, node=None):
+        """
+        :param node: url of this node, CLUSTER_NODE_URL by default
+        """
+        self.node = node or node_url()
+        self.interval = config.get_float('CLUSTER_HEARTBEAT')
+        self.ttl = config.get_float('CLUSTER_NODE_TTL') or 3 * self.interval
+        self.vnodes = config.get_int('CLUSTER_VNODES')
+        self.ring = HashRing([self.node], self.vnodes)
+        self.pid = os.getpid()
+
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=config.get_int('CLUSTER_POOL_SIZE'))
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        metrics.instrument_session(self.session)
+
+        self._stop_event = threading.Event()
+        try:
+            self.refresh()
+        except Exception:
+            log.exception("Cluster membership refresh failed")
+        self._thread = threading.Thread(target=self._run, name='cluster-membership', daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """
+        refresh: renew the heartbeat of this node and read the live nodes
+        :return: HashRing
+        """
+        db = get_redis()
+        pipeline = db.pipeline(transaction=False)
+        pipeline.set(NODE_KEY.format(node=self.node), 1, px=int(self.ttl * 1000))
+        pipeline.sadd(NODES_KEY, self.node)
+        pipeline.smembers(NODES_KEY)
+        members = sorted(pipeline.execute()[2])
+
+        alive = db.mget([NODE_KEY.format(node=member) for member in members])
+        nodes = [member for member, heartbeat in zip(members, alive) if heartbeat is not None]
+        dead = [member for member, heartbeat in zip(members, alive) if heartbeat is None]
+        if dead:
+            db.srem(NODES_KEY, *dead)
+
+        if frozenset(nodes) != self.ring.nodes:
+            log.info("Cluster nodes: %s", ', '.join(nodes))
+            self.ring = HashRing(nodes, self.vnodes)
+        return self.ring
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                # Redis failure: keep the last ring, the heartbeat expires if it lasts
+                log.exception("Cluster membership refresh failed")
+
+    def owner(self, key):
+        """
+        owner: node owning a resource
+        :param key: name of the resource
+        :return: url of the node
+        """
+        return self.ring.node(key) or self.node
+
+    def forward(self, node, request):
+        """
+        forward: send a request to its node
+        :param node: url of the node
+        :param request: flask request
+        :return: (status code, list of headers, iterator of the body)
+        :raise requests.RequestException: the node is unreachable
+        """
+        headers = [(name, value) for name, value in request.headers.items() if name.lower() not in _HOP_BY_HOP]
+        headers.append((FORWARDED_HEADER, self.node))
+        response = self.session.request(
+            request.method, node + request.full_path.rstrip('?'), headers=dict(headers), data=request.get_data(),
+            stream=True, allow_redirects=False, timeout=config.get_float('CLUSTER_FORWARD_TIMEOUT')
+        )
+
+        # Streamed as received, e.g. Server-Sent Events, without decoding the content
+        headers = [(name, value) for name, value in response.raw.headers.items() if name.lower() not in _HOP_BY_HOP]
+        return response.status_code, headers, response.raw.stream(8192, decode_content=False)
+
+    def close(self):
+        self._stop_event.set()
+        self.session.close()
+
+
+_membership = None
+_lock = threading.Lock()
+
+
+def get_membership():
+    """
+    get_membership: get the cluster membership of the current process
+    :return: Membership
+    """
+    global _membership
+
+    # Threads do not survive fork: start a new heartbeat in each worker process
+    pid = os.getpid()
+    if _membership is None or _membership.pid != pid:
+        with _lock:
+            if _membership is None or _membership.pid != pid:
+                _membership = Membership()
+    return _membership
@@ -0,0 +1,205 @@
+"""
+    Coalescing command queue of the Hue bridge
+
+    Hue bridges handle roughly 10 light commands per second. Commands of every worker are queued per light
+    in Redis and merged last-write-wins, so a rapid on/off/on sequence becomes a single state PUT.
+    One worker at a time dispatches the queue of a light, pacing the PUTs with a token bucket shared by
+    all workers. Every caller gets back the state applied with its command, merged with the ones coalesced into it.
+"""
+import json
+import time
+
+import config
+import locks
+from hue_bridge import HueBridgeError
+from redis_pool import get_redis, get_script
+
+
+QUEUE_KEY = 'light_command:{light}'
+BUCKET_KEY = 'bridge_bucket'
+
+# KEYS[1]: pending command hash, KEYS[2]: sequence counter, ARGV[1]: 1 to replace the pending command,
+# ARGV[2...]: attribute, value in JSON, ...
+# return: sequence number of the command
+_SUBMIT = """
+if ARGV[1] == '1' then
+    redis.call('DEL', KEYS[1])
+end
+for i = 2, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+local seq = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], '__seq', seq)
+return seq
+"""
+
+# KEYS[1]: pending command hash, KEYS[2]: sequence number of the last command taken
+# return: sequence number of the previous command taken, then attribute, value, ... of the pending command,
+#         which is removed from the queue; empty if nothing is pending
+_TAKE = """
+local seq = tonumber(redis.call('HGET', KEYS[1], '__seq'))
+if not seq then
+    return {}
+end
+local command = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+local previous = tonumber(redis.call('GET', KEYS[2]) or 0)
+redis.call('SET', KEYS[2], seq)
+-- The counter restarted, e.g. Redis was flushed
+if previous >= seq then
+    previous = seq - 1
+end
+table.insert(command, 1, previous)
+return command
+"""
+
+# KEYS[1]: bucket hash, ARGV[1]: tokens per second, ARGV[2]: size of the bucket, ARGV[3]: now in milliseconds
+# return: 0 if a token was taken, otherwise milliseconds to wait for the next token
+_TAKE_TOKEN = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or burst)
+local last = tonumber(redis.call('HGET', KEYS[1], 'last') or now)
+tokens = math.min(burst, tokens + math.max(now - last, 0) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class CommandTimeout(HueBridgeError):
+    """
+    CommandTimeout: the command was not applied in time
+    """
+
+
+def _key(bridge, key):
+    # Lights of different bridges have the same ids
+    return (bridge.namespace if bridge is not None else '') + key
+
+
+def take_token(bridge=None):
+    """
+    take_token: wait for a token of the bucket of the bridge, shared by every worker
+    :param bridge: HueBridgeClient, None for the bucket of the only bridge of the controller
+    :return: None
+    """
+    key = _key(bridge, BUCKET_KEY)
+    db = get_redis()
+    rate = config.get_float('HUE_COMMAND_RATE')
+    burst = config.get_float('HUE_COMMAND_BURST')
+    while True:
+        wait = get_script(_TAKE_TOKEN)(keys=[key], args=[rate, burst, int(time.time() * 1000)], client=db)
+        if not wait:
+            return
+        time.sleep(int(wait) / 1000)
+
+
+def submit(light_id, body, bridge=None):
+    """
+    submit: queue a command, merged with the pending command of the light
+    :param light_id: id of the light
+    :param body: attributes of the state to change
+    :param bridge: HueBridgeClient of the light, None for the only bridge of the controller
+    :return: sequence number of the command
+    """
+    queue = _key(bridge, QUEUE_KEY.format(light=light_id))
+    args = []
+    for name, value in body.items():
+        args.extend([name, json.dumps(value)])
+
+    # Turning a light off supersedes pending attributes, which the bridge rejects while the light is off
+    replace = '1' if body.get('on') is False else '0'
+    return int(get_script(_SUBMIT)(keys=[queue, queue + ':seq'], args=[replace] + args, client=get_redis()))
+
+
+def _take(queue):
+    # Commands previous + 1 ... seq were merged into the command taken
+    command = get_script(_TAKE)(keys=[queue, queue + ':taken'], client=get_redis())
+    if not command:
+        return None, None, None
+    fields = dict(zip(command[1::2], command[2::2]))
+    seq = int(fields.pop('__seq'))
+    return int(command[0]) + 1, seq, {name: json.loads(value) for name, value in fields.items()}
+
+
+def _applied_key(queue, seq):
+    return '{queue}:applied:{seq}'.format(queue=queue, seq=seq)
+
+
+def dispatch(bridge, light_id, token):
+    """
+    dispatch: send the pending commands of the light until the queue is empty
+    :param bridge: HueBridgeClient
+    :param light_id: id of the light
+    :param token: token of the dispatcher lock
+    :return: None
+    """
+    queue = _key(bridge, QUEUE_KEY.format(light=light_id))
+    timeout = config.get_float('HUE_COMMAND_TIMEOUT')
+    db = get_redis()
+
+    while locks.renew(queue + ':dispatcher', token, timeout):
+        first, seq, body = _take(queue)
+        if seq is None:
+            return
+
+        # Any other error still answers the callers waiting for the taken commands, then propagates
+        applied = {"seq": seq, "error": "Internal error."}
+        try:
+            take_token(bridge)
+            bridge.set_state(body, light_id)
+            applied = {"seq": seq, "state": body}
+        except HueBridgeError as e:
+            applied = {"seq": seq, "error": str(e)}
+        finally:
+            # One result per command merged into this one, so each caller reads the result of its own command
+            pipeline = db.pipeline(transaction=False)
+            for merged in range(first, seq + 1):
+                pipeline.set(_applied_key(queue, merged), json.dumps(applied), px=int(timeout * 1000))
+            pipeline.execute()
+
+
+def send(bridge, body, light_id=None):
+    """
+    send: queue a command and wait until it is applied by the bridge, dispatching the queue if nobody does
+    :param bridge: HueBridgeClient
+    :param body: attributes of the state to change
+    :param light_id: id of the light, the configured light of the bridge by default
+    :return: state applied to the light with the command, which may include commands of other callers merged into it
+    """
+    light_id = str(light_id or bridge.light_id)
+    queue = _key(bridge, QUEUE_KEY.format(light=light_id))
+    timeout = config.get_float('HUE_COMMAND_TIMEOUT')
+    db = get_redis()
+    token = locks.new_token()
+
+    seq = submit(light_id, body, bridge)
+    deadline = time.time() + timeout
+    while True:
+        # The command was applied, or coalesced into a later one
+        applied = db.get(_applied_key(queue, seq))
+        if applied:
+            applied = json.loads(applied)
+            if 'error' in applied:
+                raise HueBridgeError(applied['error'])
+            return applied['state']
+
+        # Become the dispatcher of the light if nobody is
+        if locks.acquire(queue + ':dispatcher', token, timeout):
+            try:
+                dispatch(bridge, light_id, token)
+            finally:
+                locks.release(queue + ':dispatcher', token)
+            continue
+
+        if time.time() >= deadline:
+            raise CommandTimeout("Command {seq} of light {light} not applied".format(seq=seq, light=light_id))
+        time.sleep(0.01)
@@ -0,0 +1,163 @@
+"""
+    Configuration of resource controllers and services
+
+    Every setting is resolved in the following order:
+        1. values set explicitly by update() (e.g. by an app factory)
+        2. environment variables
+        3. DEFAULTS below
+"""
+import os
+
+
+DEFAULTS = {
+    # Redis connection pool shared by every API view of a worker process
+    "REDIS_HOST": "localhost",
+    "REDIS_PORT": 6379,
+    "REDIS_DB": 0,
+    "REDIS_MAX_CONNECTIONS": 32,
+    "REDIS_SOCKET_TIMEOUT": 5.0,
+    # Lease of a binding in seconds, renewed on every authorized call (0: never expires)
+    "BIND_LEASE_TTL": 0,
+    # Seconds the owner of the binding and the description are cached per worker, invalidated through
+    # Redis pub/sub (0: always read Redis)
+    "L1_CACHE_TTL": 5.0,
+    # Serve the Thing Description pre-gzipped to clients accepting it
+    "DESCRIPTION_GZIP": True,
+    # Registry of the descriptions: registration runs in the background with exponential backoff
+    "REGISTRY_URL": "http://143.248.47.96:8000/api/services/",
+    "REGISTRY_TIMEOUT": 5.0,
+    "REGISTRY_LOCK_TTL": 30.0,
+    "REGISTRY_BACKOFF_INITIAL": 1.0,
+    "REGISTRY_BACKOFF_MAX": 60.0,
+    "REGISTRY_MAX_ATTEMPTS": 0,
+    # Discovery index of the resources (empty url: REGISTRY_URL), refreshed every DISCOVERY_TTL seconds
+    "DISCOVERY_URL": "",
+    "DISCOVERY_TTL": 30.0,
+    "DISCOVERY_NEGATIVE_TTL": 5.0,
+    # One-time work of create_app: publish the description, register it and start the threads of the workers
+    # (off: the app needs neither Redis nor the network, e.g. in tests)
+    "APP_STARTUP": True,
+    # Resources of a multi-resource controller, served under /<name> (empty: one resource, HUE_URL_SET)
+    "RESOURCES": "",
+    # Sharding of the resources over the nodes of a cluster: heartbeat of the nodes in Redis (ttl 0: 3 heartbeats),
+    # points per node on the hash ring, and forward or redirect the requests of the resources of other nodes
+    "CLUSTER": False,
+    "CLUSTER_NODE_URL": "",
+    "CLUSTER_HEARTBEAT": 2.0,
+    "CLUSTER_NODE_TTL": 0,
+    "CLUSTER_VNODES": 128,
+    "CLUSTER_ROUTING": "forward",
+    "CLUSTER_FORWARD_TIMEOUT": 30.0,
+    "CLUSTER_POOL_SIZE": 32,
+    # Hue bridge client
+    "HUE_URL_SET": "hue_url_set.json",
+    "HUE_CONNECT_TIMEOUT": 3.05,
+    "HUE_READ_TIMEOUT": 5.0,
+    "HUE_RETRIES": 2,
+    "HUE_POOL_SIZE": 10,
+    # Command queue of the bridge: token bucket shared by the workers, and time to wait for a command
+    "HUE_COMMAND_RATE": 10.0,
+    "HUE_COMMAND_BURST": 10,
+    "HUE_COMMAND_TIMEOUT": 10.0,
+    # Asynchronous commands (sync or async): executor threads of async_commands.py, retention of the results
+    "COMMAND_MODE": "sync",
+    # Executors started in sync mode too, for the requests with 'Prefer: respond-async'
+    "COMMAND_EXECUTOR": False,
+    "COMMAND_WORKERS": 4,
+    "COMMAND_RESULT_TTL": 3600.0,
+    "COMMAND_HEARTBEAT_TTL": 10.0,
+    # Batch control: lights controlled concurrently, and seconds the groups of the bridge are cached
+    "HUE_BATCH_PARALLELISM": 8,
+    "HUE_GROUPS_TTL": 60.0,
+    # Shipping of action logs to the data collector
+    "LOG_COLLECTOR_URL": "http://143.248.47.96:8000/api/data/",
+    "LOG_COLLECTOR_TIMEOUT": 5.0,
+    "LOG_BATCH_SIZE": 50,
+    "LOG_BATCH_MODE": "each",
+    "LOG_FLUSH_INTERVAL": 1.0,
+    "LOG_QUEUE_SIZE": 10000,
+    "LOG_QUEUE_POLICY": "drop_newest",
+    "LOG_BLOCK_TIMEOUT": 0.1,
+    "LOG_DRAIN_TIMEOUT": 5.0,
+    # On-disk spool of the records which could not be delivered, e.g. /var/lib/controller/spool
+    # (empty: drop them)
+    "LOG_SPOOL_DIR": "",
+    "LOG_SPOOL_SEGMENT_SIZE": 1 << 20,
+    "LOG_SPOOL_MAX_SIZE": 64 << 20,
+    "LOG_SPOOL_FSYNC": "batch",
+    "LOG_SPOOL_REPLAY_INTERVAL": 10.0,
+    # Calls of services to the resources they require
+    "RESOURCE_TIMEOUT": 10.0,
+    "RESOURCE_PARALLELISM": 8,
+    # Idle timeout in seconds of the bindings kept by resource_required between actions (0: unbind after each action)
+    "RESOURCE_LEASE_IDLE": 0,
+    # Shared cache of the light state: freshness window, retention in Redis, and time to wait for a refresh
+    "STATE_CACHE_TTL": 1.0,
+    "STATE_CACHE_RETENTION": 60.0,
+    "STATE_REFRESH_TIMEOUT": 10.0,
+    # Events of the state changes: backlog kept in Redis for clients resuming with Last-Event-ID
+    "STATE_EVENT_BACKLOG": 100,
+    # Server-Sent Events of GET /resource/stream: heartbeat, reconnection delay, events buffered per client
+    "STREAM_HEARTBEAT": 15.0,
+    "STREAM_RETRY": 3.0,
+    "STREAM_QUEUE_SIZE": 100,
+    # Streams served at once by a worker, each holding one of its threads (empty: half of THREADS, at least 1),
+    # 503 Service Unavailable beyond
+    "STREAM_MAX_CLIENTS": "",
+    # Threads of each gunicorn worker (run.sh)
+    "THREADS": 1,
+    # Background poller publishing the light state, elected among the workers (lock ttl 0: 3 intervals)
+    "STATE_POLLER": False,
+    "STATE_POLL_INTERVAL": 1.0,
+    "STATE_POLL_LOCK_TTL": 0,
+    # On-demand profiling: fraction of the requests sampled, users allowed to send the PROFILE header
+    "PROFILE_SAMPLE_RATE": 0.0,
+    "PROFILE_USERS": "",
+    "PROFILE_DIR": "profiles",
+    "PROFILE_INTERVAL": 0.001,
+    "PROFILE_MAX_FILES": 200,
+    # Prometheus metrics of the routes, Redis commands and outbound calls (GET /metrics)
+    "METRICS": True,
+}
+
+_overrides = {}
+
+
+def get(key, default=None):
+    """
+    get: read a setting
+    :param key: name of the setting
+    :param default: value returned when the setting is not defined anywhere
+    :return: value of the setting
+    """
+    if key in _overrides:
+        return _overrides[key]
+    if key in os.environ:
+        return os.environ[key]
+    return DEFAULTS.get(key, default)
+
+
+def get_int(key, default=None):
+    value = get(key, default)
+    return None if value is None else int(value)
+
+
+def get_float(key, default=None):
+    value = get(key, default)
+    return None if value is None else float(value)
+
+
+def get_bool(key, default=False):
+    value = get(key, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def update(values):
+    """
+    update: override settings, e.g. from a config dictionary of the app factory
+    :param values: dictionary of settings
+    :return: None
+    """
+    _overrides.update(values)
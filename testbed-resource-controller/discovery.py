@@ -0,0 +1,217 @@
+"""
+    Discovery of the resources required by services
+
+    The Thing Descriptions of the registry are loaded into an in-memory index of each process, keyed by
+    name (e.g. 'hue' for id 'webeng:hue:1', 'hall-1' for the light 'webeng:hue:1:hall-1' of a multi-resource
+    controller), type ('@type') and action, so resolving a resource is a dictionary lookup. A daemon thread
+    refreshes the index every DISCOVERY_TTL seconds, only rebuilding the entries whose description changed,
+    and the index keeps serving the last known descriptions while the registry is down.
+    A lookup which finds nothing refreshes the index at most once per DISCOVERY_NEGATIVE_TTL seconds.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import config
+
+
+log = logging.getLogger(__name__)
+
+# Keys of a resource description used to find it, the other keys (e.g. 'url') are kept as they are
+LOOKUP_KEYS = ('resource', 'type', 'action')
+
+
+def _entry(api_dict):
+    # Resource of the index, as received by the actions decorated by resource_required
+    # id 'webeng:{controller}:{id}', followed by ':{name}' for a resource of a multi-resource controller
+    parts = str(api_dict.get('id', '')).split(':')
+    if len(parts) > 3:
+        name = parts[3]
+    elif len(parts) > 2:
+        name = parts[1]
+    else:
+        name = api_dict.get('title')
+    types = api_dict.get('@type', [])
+    return {
+        "id": api_dict.get('id'),
+        "name": name,
+        "url": api_dict.get('url'),
+        "types": [types] if isinstance(types, str) else list(types),
+        "actions": sorted(api_dict.get('actions') or {})
+    }
+
+
+class DiscoveryIndex:
+    """
+    DiscoveryIndex: in-memory index of the resources of the registry, refreshed in the background
+    """
+    def __init__(self, url, ttl, negative_ttl, timeout):
+        """
+        :param url: url listing the descriptions of the registry
+        :param ttl: seconds between two refreshes of the index
+        :param negative_ttl: seconds a lookup which found nothing is answered without refreshing the index
+        :param timeout: timeout of the requests to the registry in seconds
+        """
+        self.url = url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.refreshes = 0
+        self.loaded = threading.Event()
+        self._entries = {}
+        self._indexes = {key: {} for key in LOOKUP_KEYS}
+        self._misses = {}
+        self._etag = None
+        self._last_refresh = 0
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='discovery', daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """
+        refresh: load the descriptions of the registry, rebuilding only the entries which changed
+        :return: True if the index changed
+        :raise requests.RequestException: the registry is unreachable
+        """
+        with self._refresh_lock:
+            self._last_refresh = time.time()
+            headers = {'If-None-Match': self._etag} if self._etag else {}
+            response = requests.get(url=self.url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                self.loaded.set()
+                return False
+            response.raise_for_status()
+
+            entries = {}
+            changed = False
+            for api_dict in response.json():
+                digest = hashlib.sha256(json.dumps(api_dict, sort_keys=True).encode('utf-8')).hexdigest()
+                previous = self._entries.get(api_dict.get('id'))
+                if previous is not None and previous[0] == digest:
+                    entries[api_dict.get('id')] = previous
+                else:
+                    entries[api_dict.get('id')] = (digest, _entry(api_dict))
+                    changed = True
+            changed = changed or entries.keys() != self._entries.keys()
+
+            if changed:
+                indexes = {key: {} for key in LOOKUP_KEYS}
+                for entry_id in sorted(entries):
+                    entry = entries[entry_id][1]
+                    indexes['resource'].setdefault(entry['name'], []).append(entry)
+                    for thing_type in entry['types']:
+                        indexes['type'].setdefault(thing_type, []).append(entry)
+                    for action in entry['actions']:
+                        indexes['action'].setdefault(action, []).append(entry)
+
+                # Swap the index at once: lookups never lock
+                self._entries, self._indexes, self._misses = entries, indexes, {}
+
+            self._etag = response.headers.get('ETag')
+            self.refreshes += 1
+            self.loaded.set()
+            return changed
+
+    def _find(self, criteria):
+        indexes = self._indexes
+        candidates = None
+        for key, value in criteria:
+            matches = indexes[key].get(value, [])
+            candidates = matches if candidates is None else [entry for entry in candidates if entry in matches]
+        return candidates[0] if candidates else None
+
+    def lookup(self, wait=True, **criteria):
+        """
+        lookup: find a resource by name, type and/or action
+        :param wait: refresh the index if nothing is found (at most once per DISCOVERY_NEGATIVE_TTL)
+        :param criteria: resource (name of the resource controller), type and action
+        :return: resource entry (id, name, url, types, actions), None if not found
+        """
+        criteria = tuple(sorted((key, value) for key, value in criteria.items() if value is not None))
+        entry = self._find(criteria)
+        if entry is not None or not wait:
+            return entry
+
+        # The first load may still be in progress
+        if not self.loaded.is_set():
+            self.loaded.wait(self.timeout)
+            entry = self._find(criteria)
+            if entry is not None:
+                return entry
+
+        # Negative caching: a missing resource does not hit the registry on every call
+        if time.time() - self._misses.get(criteria, 0) < self.negative_ttl:
+            return None
+        if time.time() - self._last_refresh >= self.negative_ttl:
+            try:
+                self.refresh()
+            except requests.RequestException as e:
+                log.warning("Discovery from %s failed: %s", self.url, e)
+        entry = self._find(criteria)
+        if entry is None:
+            self._misses[criteria] = time.time()
+        return entry
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("Discovery from %s failed: %s", self.url, e)
+            self._stop_event.wait(self.ttl)
+
+    def close(self):
+        self._stop_event.set()
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """
+    get_index: get the discovery index of the current process
+    :return: DiscoveryIndex
+    """
+    global _index
+
+    # Threads do not survive fork: start a new refresh thread in each worker process
+    pid = os.getpid()
+    if _index is None or _index.pid != pid:
+        with _lock:
+            if _index is None or _index.pid != pid:
+                _index = DiscoveryIndex(config.get('DISCOVERY_URL') or config.get('REGISTRY_URL'),
+                                        config.get_float('DISCOVERY_TTL'),
+                                        config.get_float('DISCOVERY_NEGATIVE_TTL'),
+                                        config.get_float('REGISTRY_TIMEOUT'))
+    return _index
+
+
+def resolve(resource_descriptions, wait=True):
+    """
+    resolve: complete the resource descriptions given without url from the discovery index
+    :param resource_descriptions: descriptions of resources, with a 'name' and either an 'url', or any of
+                                  'resource', 'type' and 'action' to find it (by default, the resource
+                                  controller of the same name)
+    :param wait: refresh the index if a resource is not found
+    :return: list of (name, url) dictionaries, None for the resources not found
+    """
+    resources = []
+    for description in resource_descriptions:
+        if description.get('url'):
+            resources.append({"name": description["name"], "url": description["url"]})
+            continue
+
+        criteria = {key: description[key] for key in LOOKUP_KEYS if key in description}
+        if not criteria:
+            criteria = {'resource': description['name']}
+        entry = get_index().lookup(wait=wait, **criteria)
+        resources.append({"name": description["name"], "url": entry["url"]} if entry is not None else None)
+    return resources
@@ -0,0 +1,63 @@
+from http import HTTPStatus
+from quart import jsonify
+
+import aio_base
+from aio_base import BindAPI, DescriptionAPI, ResourceAPI, StatsAPI, MetricsAPI
+from aio_utils import authorization_required, logger
+from utils import api_description, add_property, add_action
+
+
+@api_description(
+    description="Dummy asyncio resource api"
+)
+class DummyAsyncResourceAPI(ResourceAPI):
+    @add_property(
+        name="resource",
+        title="Show resource status",
+        description="Example of property method",
+        properties={"status": {"type": "string"}},
+        path="/resource",
+        security="basic_sc"
+    )
+    async def get(self):
+        pass
+
+    @authorization_required
+    async def post(self, action):
+        if action == "example":
+            return await self.example()
+
+    @logger
+    @add_action(
+        name="example",
+        title="Example method of action",
+        description="Example method of action",
+        output={"status": {"type": "string"}},
+        path="/resource/example",
+        security="basic_sc"
+    )
+    async def example(self):
+        return jsonify({
+            "result": "success"
+        }), HTTPStatus.OK
+
+    @staticmethod
+    def add_url_rule(_app):
+        view = DummyAsyncResourceAPI.as_view('resource_api')
+        # Dummy resource API View
+        _app.add_url_rule('/resource', view_func=view, methods=['GET', ])
+        _app.add_url_rule('/resource/<action>', view_func=view, methods=['POST', ])
+
+
+def create_app(settings=None):
+    """
+    create_app: create the app of the dummy asyncio resource
+    :param settings: dictionary of settings overriding the environment, e.g. {"APP_STARTUP": False} for tests
+    :return: quart app
+    """
+    return aio_base.create_app(settings, __name__,
+                               apis=[BindAPI, DescriptionAPI, StatsAPI, MetricsAPI, DummyAsyncResourceAPI])
+
+
+# Run server on an ASGI worker: the app is created by gunicorn (run.sh),
+# e.g. gunicorn "dummy_async_resource:create_app()" -k uvicorn.workers.UvicornWorker
@@ -1,8 +1,8 @@
 from http import HTTPStatus
-from flask import Flask, make_response, jsonify
-from base import BindAPI, DescriptionAPI, ResourceAPI
-from utils import authorization_required, api_description, add_property, add_action, logger, register_api
-from flask_cors import CORS
+from flask import make_response, jsonify
+import base
+from base import BindAPI, DescriptionAPI, ResourceAPI, StatsAPI, MetricsAPI
+from utils import authorization_required, api_description, add_property, add_action, logger
 
 
 @api_description(
@@ -48,12 +48,16 @@ class DummyResourceAPI(ResourceAPI):
         _app.add_url_rule('/resource/<action>', view_func=view, methods=['POST', ])
 
 
-# Run server
-app = Flask(__name__)
-CORS(app)
-BindAPI.add_url_rule(app)
-DescriptionAPI.add_url_rule(app)
-DummyResourceAPI.add_url_rule(app)
-register_api()
+def create_app(settings=None):
+    """
+    create_app: create the app of the dummy resource
+    :param settings: dictionary of settings overriding the environment, e.g. {"APP_STARTUP": False} for tests
+    :return: flask app
+    """
+    return base.create_app(settings, __name__, apis=[StatsAPI, MetricsAPI],
+                           resource_apis=[BindAPI, DescriptionAPI, DummyResourceAPI])
 
-# app.run(host='0.0.0.0', port=8000)
+
+# Run server: the app is created by gunicorn, e.g. gunicorn "dummy_resource:create_app()" (run.sh)
+
+# create_app().run(host='0.0.0.0', port=8000)
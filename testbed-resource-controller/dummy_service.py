@@ -1,6 +1,6 @@
 from http import HTTPStatus
 from flask import Flask, jsonify, make_response
-from base import BindAPI, ServiceAPI
+from base import BindAPI, ServiceAPI, StatsAPI, MetricsAPI
 from utils import abort_json, authorization_required, resource_required
 
 
@@ -40,6 +40,8 @@ class DummyServiceAPI(ServiceAPI):
 # Run server
 app = Flask(__name__)
 BindAPI.add_url_rule(app)
+StatsAPI.add_url_rule(app)
+MetricsAPI.add_url_rule(app)
 DummyServiceAPI.add_url_rule(app)
 
 # app.run(host='0.0.0.0', port=8000)
@@ -0,0 +1,109 @@
+"""
+    Local stand-in of a Hue bridge for benchmarks and development
+
+    It serves the part of the bridge API used by hue_controller.py (lights, their state, groups) from memory,
+    with an artificial latency, a fraction of the calls answered with a bridge error, and a rate limit
+    (429 Too Many Requests above N calls per second). It also accepts the records of the log collector
+    on POST /collector. For example
+        FAKE_BRIDGE_LATENCY=0.05 gunicorn fake_bridge:app -b 0.0.0.0:8088 -k gthread --threads 32
+    with the url set {"bridge": "http://localhost:8088/api/bench", "light": "1"} (HUE_URL_SET).
+"""
+import os
+import random
+import threading
+import time
+
+from http import HTTPStatus
+from flask import Flask, request, jsonify, make_response
+
+
+def create_bridge(latency=0.0, error_rate=0.0, rate_limit=0.0, lights=3):
+    """
+    create_bridge: create a stand-in bridge app
+    :param latency: seconds to wait before answering a call
+    :param error_rate: fraction of the calls answered with a bridge error
+    :param rate_limit: calls per second accepted before answering 429 (0: no limit)
+    :param lights: number of lights, with ids '1'..'N' in one group '1'
+    :return: flask app, whose `calls` attribute counts the calls by method
+    """
+    bridge = Flask(__name__)
+    bridge.lights = {
+        str(light_id): {"name": "light {id}".format(id=light_id), "state": {"on": False, "bri": 254}}
+        for light_id in range(1, lights + 1)
+    }
+    bridge.groups = {"1": {"name": "all", "lights": sorted(bridge.lights)}}
+    bridge.calls = {"GET": 0, "PUT": 0, "POST": 0}
+    lock = threading.Lock()
+    bucket = {"tokens": rate_limit, "at": time.monotonic()}
+
+    def error(path, description):
+        # The bridge answers errors with 200 and a list of {"error": ...}
+        return jsonify([{"error": {"type": 901, "address": path, "description": description}}])
+
+    @bridge.before_request
+    def simulate():
+        with lock:
+            bridge.calls[request.method] = bridge.calls.get(request.method, 0) + 1
+
+            # Token bucket of rate_limit calls per second, with a burst of one second
+            if rate_limit > 0:
+                now = time.monotonic()
+                bucket["tokens"] = min(rate_limit, bucket["tokens"] + (now - bucket["at"]) * rate_limit)
+                bucket["at"] = now
+                if bucket["tokens"] < 1:
+                    return make_response(jsonify({"errorMessage": "Too many requests."}),
+                                         HTTPStatus.TOO_MANY_REQUESTS)
+                bucket["tokens"] -= 1
+
+        if latency > 0:
+            time.sleep(latency)
+        if request.path != '/collector' and error_rate > 0 and random.random() < error_rate:
+            return error(request.path, "Internal error.")
+
+    @bridge.route('/api/<username>/lights', methods=['GET'])
+    def get_lights(username):
+        with lock:
+            return jsonify(bridge.lights)
+
+    @bridge.route('/api/<username>/lights/<light_id>', methods=['GET'])
+    def get_light(username, light_id):
+        with lock:
+            if light_id not in bridge.lights:
+                return error(request.path, "resource, {path}, not available".format(path=request.path))
+            return jsonify(bridge.lights[light_id])
+
+    @bridge.route('/api/<username>/lights/<light_id>/state', methods=['PUT'])
+    def set_state(username, light_id):
+        body = request.get_json(force=True)
+        with lock:
+            if light_id not in bridge.lights:
+                return error(request.path, "resource, {path}, not available".format(path=request.path))
+            bridge.lights[light_id]["state"].update(body)
+        return jsonify([{"success": {"/lights/{id}/state/{key}".format(id=light_id, key=key): value}}
+                        for key, value in body.items()])
+
+    @bridge.route('/api/<username>/groups', methods=['GET'])
+    def get_groups(username):
+        return jsonify(bridge.groups)
+
+    @bridge.route('/api/<username>/groups/<group_id>/action', methods=['PUT'])
+    def set_group_action(username, group_id):
+        body = request.get_json(force=True)
+        with lock:
+            if group_id not in bridge.groups:
+                return error(request.path, "resource, {path}, not available".format(path=request.path))
+            for light_id in bridge.groups[group_id]["lights"]:
+                bridge.lights[light_id]["state"].update(body)
+        return jsonify([{"success": {"/groups/{id}/action/{key}".format(id=group_id, key=key): value}}
+                        for key, value in body.items()])
+
+    @bridge.route('/collector', methods=['POST'])
+    def collect():
+        return make_response(jsonify({}), HTTPStatus.OK)
+
+    return bridge
+
+
+app = create_bridge(float(os.environ.get('FAKE_BRIDGE_LATENCY', 0)),
+                    float(os.environ.get('FAKE_BRIDGE_ERROR_RATE', 0)),
+                    float(os.environ.get('FAKE_BRIDGE_RATE_LIMIT', 0)))
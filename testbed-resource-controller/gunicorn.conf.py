@@ -0,0 +1,18 @@
+"""
+    Gunicorn settings of the controllers, read from the working directory of run.sh
+
+    The app is loaded once in the master (PRELOAD=0 to load it in each worker instead): the workers share its
+    modules and configuration copy-on-write, and each of them starts its own threads and connections after
+    the fork (base.start_worker).
+"""
+import os
+
+
+preload_app = os.environ.get('PRELOAD', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def post_fork(server, worker):
+    # Threads and connections of the master are not inherited by the workers
+    import base
+
+    base.start_worker()
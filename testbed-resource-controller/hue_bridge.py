@@ -0,0 +1,213 @@
+"""
+    Client of the Philips Hue bridge REST API
+
+    One client is created lazily per worker process. It keeps a pooled keep-alive session to the bridge,
+    applies connect/read timeouts to every call and retries idempotent calls a bounded number of times.
+    refer https://developers.meethue.com/develop/hue-api/lights-api/
+"""
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+import metrics
+
+
+class HueBridgeError(Exception):
+    """
+    HueBridgeError: the bridge is unreachable or rejected the request
+    """
+
+
+def _retry(total, methods):
+    # urllib3 renamed method_whitelist to allowed_methods
+    try:
+        return Retry(total=total, connect=total, read=total, backoff_factor=0.1,
+                     status_forcelist=(500, 502, 503, 504), allowed_methods=methods, raise_on_status=False)
+    except TypeError:
+        return Retry(total=total, connect=total, read=total, backoff_factor=0.1,
+                     status_forcelist=(500, 502, 503, 504), method_whitelist=methods, raise_on_status=False)
+
+
+class HueBridgeClient:
+    """
+    HueBridgeClient: keep-alive client of a Hue bridge, bound to the user name of the bridge
+    """
+    def __init__(self, base_url, light_id, connect_timeout=3.05, read_timeout=5.0, retries=2, pool_size=10,
+                 namespace=''):
+        """
+        :param base_url: url of the bridge API including the user name, e.g. http://{bridge}/api/{username}
+        :param light_id: id of the light controlled by default
+        :param connect_timeout: seconds to wait for a connection to the bridge
+        :param read_timeout: seconds to wait for a response of the bridge
+        :param retries: number of retries of idempotent calls
+        :param pool_size: number of keep-alive connections to the bridge
+        :param namespace: prefix of the Redis keys of the command queue of the bridge, when a controller has many
+        """
+        self.base_url = base_url.rstrip('/')
+        self.namespace = namespace
+        self.light_id = str(light_id)
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Reading and setting a state are both idempotent on the bridge
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=_retry(retries, frozenset(['GET', 'PUT'])))
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        metrics.instrument_session(self.session)
+
+        self._groups = None
+        self._groups_at = 0.0
+
+    @classmethod
+    def from_url_set(cls, url_set, **kwargs):
+        """
+        from_url_set: create a client from the contents of hue_url_set.json
+        :param url_set: dictionary with "bridge" and "light", or the legacy "action" url of a light state
+        :return: HueBridgeClient
+        """
+        if 'bridge' in url_set:
+            return cls(url_set['bridge'], url_set.get('light', '1'), **kwargs)
+
+        match = re.match(r'(?P<bridge>.+)/lights/(?P<light>[^/]+)/state/?$', url_set['action'])
+        if match is None:
+            raise ValueError("Cannot find the light in {url}".format(url=url_set['action']))
+        return cls(match.group('bridge'), match.group('light'), **kwargs)
+
+    def url(self, path):
+        return '{base}/{path}'.format(base=self.base_url, path=path.lstrip('/'))
+
+    def _request(self, method, path, body=None):
+        try:
+            res = self.session.request(method, self.url(path), timeout=self.timeout,
+                                       data=None if body is None else json.dumps(body))
+        except requests.RequestException as e:
+            raise HueBridgeError("{method} {path} failed: {error}".format(method=method, path=path, error=e))
+
+        if res.status_code != 200:
+            raise HueBridgeError("{method} {path} returned {status}".format(method=method, path=path,
+                                                                              status=res.status_code))
+        try:
+            result = res.json()
+        except ValueError as e:
+            raise HueBridgeError("{method} {path} returned an invalid body: {error}".format(method=method, path=path,
+                                                                                         error=e))
+
+        # The bridge answers errors with 200 and a list of {"error": ...}
+        if isinstance(result, list) and result and all('error' in item for item in result):
+            raise HueBridgeError("{method} {path} rejected: {error}".format(method=method, path=path,
+                                                                           error=result[0]['error']))
+        return result
+
+    def light(self, light_id=None):
+        """
+        light: read the attributes and state of a single light
+        :param light_id: id of the light, the configured light by default
+        :return: dictionary of the light
+        """
+        return self._request('GET', 'lights/{id}'.format(id=light_id or self.light_id))
+
+    def light_state(self, light_id=None):
+        """
+        light_state: read the state of a single light
+        :param light_id: id of the light, the configured light by default
+        :return: state dictionary of the light, e.g. {"on": true, "bri": 254, ...}
+        """
+        return self.light(light_id)['state']
+
+    def set_state(self, body, light_id=None):
+        """
+        set_state: change the state of a single light
+        :param body: attributes of the state to change, e.g. {"on": false}
+        :param light_id: id of the light, the configured light by default
+        :return: list of results of the bridge
+        """
+        return self._request('PUT', 'lights/{id}/state'.format(id=light_id or self.light_id), body)
+
+    def groups(self, max_age=60.0):
+        """
+        groups: read the groups of the bridge, cached in the client
+        :param max_age: seconds the cached groups are used
+        :return: dictionary of groups by group id
+        """
+        if self._groups is None or time.time() - self._groups_at > max_age:
+            self._groups = self._request('GET', 'groups')
+            self._groups_at = time.time()
+        return self._groups
+
+    def find_group(self, name=None, lights=None, max_age=60.0):
+        """
+        find_group: find a group by its id or name, or the group of exactly the given lights
+        :param name: id or name of the group
+        :param lights: ids of the lights
+        :param max_age: seconds the cached groups are used
+        :return: (group id, ids of the lights in the group), (None, None) if not found
+        """
+        for group_id, group in self.groups(max_age).items():
+            if name is not None and str(name) in (group_id, group.get('name')):
+                return group_id, [str(light) for light in group.get('lights', [])]
+            if lights is not None and set(group.get('lights', [])) == set(str(light) for light in lights):
+                return group_id, [str(light) for light in group['lights']]
+        return None, None
+
+    def set_group_action(self, group_id, body):
+        """
+        set_group_action: change the state of every light in a group with one call
+        :param group_id: id of the group, "0" for every light of the bridge
+        :param body: attributes of the state to change
+        :return: list of results of the bridge
+        """
+        return self._request('PUT', 'groups/{id}/action'.format(id=group_id), body)
+
+    def close(self):
+        self.session.close()
+
+
+_lock = threading.Lock()
+_bridge = None
+_pid = None
+
+# Url sets by path, read once: the workers forked by gunicorn --preload inherit them
+_url_sets = {}
+
+
+def load_url_set(path=None):
+    """
+    load_url_set: read the bridge urls of the controller, once per path
+    :param path: path of the url set, HUE_URL_SET by default
+    :return: dictionary of the url set
+    """
+    path = path or config.get('HUE_URL_SET')
+    if path not in _url_sets:
+        with open(path) as urls:
+            _url_sets[path] = json.load(urls)
+    return _url_sets[path]
+
+
+def get_bridge():
+    """
+    get_bridge: get the bridge client of the current process, hue_url_set.json is read only once
+    :return: HueBridgeClient
+    """
+    global _bridge, _pid
+
+    pid = os.getpid()
+    if _bridge is None or _pid != pid:
+        with _lock:
+            if _bridge is None or _pid != pid:
+                _bridge = HueBridgeClient.from_url_set(
+                    load_url_set(),
+                    connect_timeout=config.get_float('HUE_CONNECT_TIMEOUT'),
+                    read_timeout=config.get_float('HUE_READ_TIMEOUT'),
+                    retries=config.get_int('HUE_RETRIES'),
+                    pool_size=config.get_int('HUE_POOL_SIZE')
+                )
+                _pid = pid
+    return _bridge
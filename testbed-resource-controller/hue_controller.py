@@ -2,14 +2,20 @@
 #from base import BindAPI, ResourceAPI, authorization_required ,authentication_required, abort_json
 
 from http import HTTPStatus
-from flask import Flask, jsonify, make_response
-from base import BindAPI, ResourceAPI, DescriptionAPI
-from utils import authorization_required, register_api, add_property, add_action, abort_json, api_description, logger
+from flask import Response, jsonify, make_response, request, stream_with_context
+import base
+from base import BindAPI, ResourceAPI, DescriptionAPI, StatsAPI, MetricsAPI
+from utils import authorization_required, add_property, add_action, abort_json, api_description, logger
 
-from flask_cors import CORS
-import redis
-import requests
-import json
+from hue_bridge import HueBridgeError, load_url_set
+from state_cache import STATE_KEY, get_state, read_state, update_state, max_age_of
+from poller import ensure_poller
+from command_queue import send
+from batch import APPLIED, apply_batch
+import config
+import resources
+import state_stream
+from async_commands import QUEUED, enqueue, get_command, requested as async_requested
 
 @api_description( # mistake for api_description vs register_api
     description="hue resource api"
@@ -18,11 +24,16 @@ class hueAPI(ResourceAPI):
     
     def __init__(self):
         super().__init__()
-    
-        self.hue_urls = None
 
-        with open('hue_url_set.json') as urls:
-            self.hue_urls = json.load(urls)
+        # Resource of the request, served under its prefix by a multi-resource controller
+        self.resource = resources.current()
+        self.state_key = self.resource.key(STATE_KEY)
+
+        # Keep-alive client of the worker process, hue_url_set.json is read only once
+        self.bridge = self.resource.bridge
+
+        # Opt-in poller publishing the state of the light into Redis
+        self.poller = ensure_poller(self.bridge.light_state, self.state_key)
 
     @authorization_required
     @add_property(
@@ -33,7 +44,15 @@ class hueAPI(ResourceAPI):
         path="/resource",
         security="basic_sc"
     )
-    def get(self):
+    def get(self, command_id=None, action=None):
+        # Status of an asynchronous command
+        if command_id is not None:
+            return self.command(command_id)
+
+        # Push of the state changes instead of polling
+        if action == "stream":
+            return self.stream()
+
         #url = 'http://143.248.49.87:88/api/XAI8Yvp26NTLSxP0uGurWuI091Qxj65C2VFjSsr2/lights'
         try: 
             #return self.status()
@@ -45,29 +64,68 @@ class hueAPI(ResourceAPI):
         #return status
 
     def status_newV(self):
-        res = requests.get(self.hue_urls['status'])
-        if res.status_code == 200:
-            #res_dict = json.loads(res) # error
-            content = res.content
-            content.decode('utf-8')
-            res_dict = json.loads(content)
-
-            hueState = res_dict['2']
-            state = hueState['state']
-            if state['on'] == True:
-                self.redis.set('status', "On")
-                return make_response(jsonify({"status": self.redis.get('status')}), 200)
+        # Poller mode: serve the state published by the poller, the bridge is read only before the first poll
+        cached = read_state(self.state_key) if self.poller is not None else None
+
+        # Serve the shared cached state, the client may ask for a fresher one with Cache-Control
+        try:
+            if cached is not None:
+                state, age = cached
             else:
-                self.redis.set('status', "Off")
-                return make_response(jsonify({"status": self.redis.get('status')}), 200)
-        else:
+                state, age = get_state(self.bridge.light_state, max_age_of(request.cache_control), self.state_key)
+        except HueBridgeError:
             abort_json(HTTPStatus.BAD_REQUEST, "abort in status()")
 
+        if state['on'] == True:
+            response = make_response(jsonify({"status": "On"}), 200)
+        else:
+            response = make_response(jsonify({"status": "Off"}), 200)
+        response.headers['Age'] = int(age)
+        return response
+
+    @add_property(
+        name="command",
+        title="Show command status",
+        description="It shows whether an asynchronous command is queued, running, applied or failed",
+        properties={"status": {"type": "string"}, "state": {"type": "object"}},
+        path="/resource/commands/{id}",
+        security="basic_sc"
+    )
+    def command(self, command_id):
+        command = get_command(command_id)
+        if command is None or command['resource'] != self.resource.name:
+            abort_json(HTTPStatus.NOT_FOUND, "Command not found.")
+        return make_response(jsonify(command), HTTPStatus.OK)
+
+    def stream(self):
+        # Each stream holds a thread of the worker: keep the others for the commands
+        listener = state_stream.get_listener()
+        client = listener.subscribe(self.state_key, state_stream.max_clients())
+        if client is None:
+            response = make_response(jsonify({"errorMessage": "Too many streams."}), HTTPStatus.SERVICE_UNAVAILABLE)
+            response.headers['Retry-After'] = int(config.get_float('STREAM_RETRY'))
+            return response
+
+        # Server-Sent Events of the state, resumed from the backlog with Last-Event-ID
+        events = state_stream.stream(request.headers.get('Last-Event-ID'), self.state_key, client)
+        response = Response(stream_with_context(events), mimetype='text/event-stream')
+        response.call_on_close(lambda: listener.unsubscribe(client))
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    def accepted(self, action, body):
+        # Queue the command for the executors and answer at once
+        command_id = enqueue(action, body, request.headers.get('USER-ID'), self.resource)
+        response = make_response(jsonify({"id": command_id, "status": QUEUED}), HTTPStatus.ACCEPTED)
+        response.headers['Location'] = '{prefix}/resource/commands/{id}'.format(prefix=self.resource.prefix,
+                                                                                id=command_id)
+        return response
+
     def status(self): # not used -> deprecated
         try:
-            res = requests.get(self.hue_urls['status'])
-            text_res = res.text
-        except:
+            text_res = self.bridge.light()
+        except HueBridgeError:
             abort_json(HTTPStatus.BAD_REQUEST, "abort in status()")
         return make_response(jsonify(text_res), HTTPStatus.OK)
 
@@ -99,6 +157,9 @@ class hueAPI(ResourceAPI):
         elif action == "off":
             return self.off()
 
+        elif action == "batch":
+            return self.batch()
+
         else:
             #abort(400, description="Invalid action")
             abort_json(HTTPStatus.BAD_REQUEST, "Invalid action.")
@@ -114,18 +175,21 @@ class hueAPI(ResourceAPI):
     )
     def on(self):
         on_message_body = {"on": True, "sat": 254, "bri": 254, "hue": 10000}
+        if async_requested(request.headers):
+            return self.accepted("on", on_message_body)
         #res = requests.put('http://143.248.49.87:88/api/XAI8Yvp26NTLSxP0uGurWuI091Qxj65C2VFjSsr2/lights/2/state',data=json.dumps(on_message_body))
         
-        res = requests.put(self.hue_urls['action'],data=json.dumps(on_message_body))
-
-        self.redis.set('status', "On")
-        if res.status_code == 200:
-            #return make_response(jsonify(res.text), HTTPStatus.OK)
-            return make_response(jsonify({"status": self.redis.get('status')}), 200)
-        else:
+        # Commands are paced and coalesced with concurrent ones: the light ends up in the applied state
+        try:
+            applied = send(self.bridge, on_message_body)
+        except HueBridgeError:
             #abort(400, description="abort in post() for on")
             abort_json(HTTPStatus.BAD_REQUEST, "abort in post() about on func")
 
+        # The bridge applied the change: no need to read the state back
+        update_state(applied, self.state_key)
+        return make_response(jsonify({"status": "On" if applied.get('on', True) else "Off"}), 200)
+
     @logger
     @add_action(
         name="off",
@@ -137,33 +201,100 @@ class hueAPI(ResourceAPI):
     )
     def off(self):
         off_message_body = {"on": False}
+        if async_requested(request.headers):
+            return self.accepted("off", off_message_body)
         #res = requests.put('http://143.248.49.87:88/api/XAI8Yvp26NTLSxP0uGurWuI091Qxj65C2VFjSsr2/lights/2/state',data=json.dumps(off_message_body))
         
-        res = requests.put(self.hue_urls['action'],data=json.dumps(off_message_body))
-
-        self.redis.set('status', "Off")
-        if res.status_code == 200:
-            #return make_response(jsonify(res.text), HTTPStatus.OK)
-            return make_response(jsonify({"status": self.redis.get('status')}), 200)
-        else:
+        # Commands are paced and coalesced with concurrent ones: the light ends up in the applied state
+        try:
+            applied = send(self.bridge, off_message_body)
+        except HueBridgeError:
             #abort(400, description="abort in post() for off")
             abort_json(HTTPStatus.BAD_REQUEST, "abort in post() about off func")
 
+        # The bridge applied the change: no need to read the state back
+        update_state(applied, self.state_key)
+        return make_response(jsonify({"status": "On" if applied.get('on', False) else "Off"}), 200)
+
+    @logger
+    @add_action(
+        name="batch",
+        title="Control many hues",
+        description="It changes the state of the listed lights, or of a group of the bridge, at once",
+        output={"group": {"type": "string"}, "lights": {"type": "object"}},
+        path="/resource/batch",
+        security="basic_sc",
+        input={
+            "lights": {"type": "array", "items": {"type": "string"}},
+            "group": {"type": "string"},
+            "state": {"type": "object"}
+        }
+    )
+    def batch(self):
+        body = request.get_json(silent=True) or {}
+        lights = body.get('lights')
+        group = body.get('group')
+        state = body.get('state')
+
+        # Exactly one of lights or group, and the state to apply
+        if not isinstance(state, dict) or not state or (lights is None) == (group is None) \
+                or (lights is not None and (not isinstance(lights, list) or not lights)):
+            abort_json(HTTPStatus.BAD_REQUEST, "Invalid batch.")
+
+        if async_requested(request.headers):
+            return self.accepted("batch", {"lights": lights, "group": group, "state": state})
+
+        try:
+            group_id, results = apply_batch(self.bridge, state, lights=lights, group=group)
+        except KeyError:
+            abort_json(HTTPStatus.NOT_FOUND, "Group not found.")
+        except HueBridgeError:
+            abort_json(HTTPStatus.BAD_REQUEST, "abort in post() about batch func")
+
+        # Keep the cached state of the controlled light up to date
+        result = results.get(self.bridge.light_id)
+        if result is not None and result['status'] == APPLIED:
+            update_state(result['state'], self.state_key)
+
+        failed = any(result['status'] != APPLIED for result in results.values())
+        return make_response(jsonify({
+            "group": group_id,
+            "lights": results
+        }), HTTPStatus.MULTI_STATUS if failed else HTTPStatus.OK)
+
     @staticmethod
     def add_url_rule(_app):
         view = hueAPI.as_view('resource_api')
         # hue resource API View
         _app.add_url_rule('/resource', view_func=view, methods=['GET', ])
         _app.add_url_rule('/resource/<action>', view_func=view, methods=['POST', ])
+        _app.add_url_rule('/resource/commands/<command_id>', view_func=view, methods=['GET', ])
+        _app.add_url_rule('/resource/stream', view_func=view, methods=['GET', ], defaults={'action': 'stream'})
+
+
+def start_pollers():
+    # Opt-in pollers of the worker, one per resource
+    for resource in resources.all_resources():
+        ensure_poller(lambda resource=resource: resource.bridge.light_state(), resource.key(STATE_KEY))
+
+
+def read_url_set():
+    # Read once before the workers fork, which inherit it (the url sets of RESOURCES are read with the resources)
+    if not resources.enabled():
+        load_url_set()
+
+
+def create_app(settings=None):
+    """
+    create_app: create the app of the Hue controller
+    :param settings: dictionary of settings overriding the environment, e.g. {"APP_STARTUP": False} for tests
+    :return: flask app
+    """
+    return base.create_app(settings, __name__, apis=[StatsAPI, MetricsAPI],
+                           resource_apis=[BindAPI, DescriptionAPI, hueAPI],
+                           startup_hooks=[read_url_set], worker_hooks=[start_pollers])
 
 
-# Run server
+# Run server: the app is created by gunicorn, e.g. gunicorn "hue_controller:create_app()" (run.sh)
 #if __name__ == "__main__":
-app = Flask(__name__)
-CORS(app)
-BindAPI.add_url_rule(app)
-DescriptionAPI.add_url_rule(app)
-hueAPI.add_url_rule(app)
-
-register_api()
-    #app.run(host='0.0.0.0', port=5000)
+    #create_app().run(host='0.0.0.0', port=5000)
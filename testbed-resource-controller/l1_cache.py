@@ -0,0 +1,159 @@
+"""
+    Per-worker cache of read-mostly Redis keys
+
+    Values such as the owner of the binding are kept in the memory of each worker process for at most
+    L1_CACHE_TTL seconds. Writers publish the name of a changed key on a Redis pub/sub channel (from their Lua
+    scripts, or with invalidate()), and a listener thread of every worker drops the key at once. While the
+    subscription is down, the cache is cleared and bypassed, as invalidations may be missed.
+"""
+import logging
+import os
+import threading
+import time
+
+import config
+from redis_pool import get_redis
+
+
+log = logging.getLogger(__name__)
+
+CHANNEL = 'l1_invalidate'
+
+# Functions called when a key is invalidated, by key
+_callbacks = {}
+
+
+def on_invalidate(key, callback):
+    """
+    on_invalidate: call a function whenever a key is invalidated, e.g. to drop a value derived from it
+    :param key: Redis key
+    :param callback: function without argument
+    :return: None
+    """
+    _callbacks.setdefault(key, []).append(callback)
+
+
+class L1Cache:
+    """
+    L1Cache: in-process cache invalidated through Redis pub/sub
+    """
+    def __init__(self, ttl):
+        """
+        :param ttl: maximum seconds a value is kept without invalidation
+        """
+        self.ttl = ttl
+        self.pid = os.getpid()
+        # Incremented by every invalidation, so a value read from Redis before one is not cached
+        self.generation = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='l1-invalidation', daemon=True)
+        self._thread.start()
+
+    def get(self, key):
+        """
+        get: read a cached value
+        :param key: Redis key
+        :return: value, None if not cached, expired or the invalidations are not received
+        """
+        entry = self._entries.get(key) if self._subscribed.is_set() else None
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value, generation, ttl=None):
+        """
+        set: cache a value
+        :param key: Redis key
+        :param value: value, not None
+        :param generation: generation of the cache before the value was read from Redis
+        :param ttl: seconds the value is valid, at most the ttl of the cache
+        :return: None
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = (value, time.monotonic() + ttl)
+
+    def invalidate(self, key):
+        """
+        invalidate: drop a key from the cache of this process
+        :param key: Redis key
+        :return: None
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+        for callback in _callbacks.get(key, []):
+            callback()
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+        for callbacks in list(_callbacks.values()):
+            for callback in callbacks:
+                callback()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CHANNEL)
+                # Values cached before the subscription may be stale
+                self.clear()
+                self._subscribed.set()
+                while not self._stop_event.is_set():
+                    # Wait with a timeout: a blocking read would fail after REDIS_SOCKET_TIMEOUT
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message['type'] == 'message':
+                        self.invalidate(message['data'])
+            except Exception:
+                log.exception("Cache invalidation subscription failed")
+            finally:
+                self._subscribed.clear()
+                pubsub.close()
+            self.clear()
+            self._stop_event.wait(1.0)
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    get_cache: get the cache of the current process
+    :return: L1Cache, None if L1_CACHE_TTL is 0
+    """
+    global _cache
+
+    ttl = config.get_float('L1_CACHE_TTL')
+    if ttl <= 0:
+        return None
+
+    # Threads do not survive fork: subscribe in each worker process
+    pid = os.getpid()
+    if _cache is None or _cache.pid != pid:
+        with _lock:
+            if _cache is None or _cache.pid != pid:
+                _cache = L1Cache(ttl)
+    return _cache
+
+
+def invalidate(key):
+    """
+    invalidate: drop a key from the cache of every worker, after it was changed without a Lua script publishing it
+    :param key: Redis key
+    :return: None
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(key)
+    get_redis().publish(CHANNEL, key)
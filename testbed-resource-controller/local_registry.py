@@ -0,0 +1,48 @@
+"""
+    Local stand-in of the registry for tests and development
+
+    It accepts descriptions like the registry does (POST /api/services/ with raw_description form data)
+    and keeps them in memory. Point REGISTRY_URL to it, e.g.
+        gunicorn local_registry:app -b 0.0.0.0:8100
+        export REGISTRY_URL=http://localhost:8100/api/services/
+    FAIL_FIRST=N makes the first N posts fail with 503, to exercise the retries of the controllers.
+"""
+import json
+import os
+import threading
+
+from http import HTTPStatus
+from flask import Flask, request, jsonify, make_response
+
+
+def create_registry(fail_first=0):
+    """
+    create_registry: create a stand-in registry app
+    :param fail_first: number of posts answered with 503 before accepting descriptions
+    :return: flask app, whose `services` attribute lists the received descriptions
+    """
+    registry = Flask(__name__)
+    registry.services = []
+    registry.posts = 0
+    lock = threading.Lock()
+
+    @registry.route('/api/services/', methods=['POST'])
+    def add_service():
+        with lock:
+            registry.posts += 1
+            if registry.posts <= fail_first:
+                return make_response(jsonify({"errorMessage": "Registry unavailable."}),
+                                     HTTPStatus.SERVICE_UNAVAILABLE)
+
+            description = json.loads(request.form['raw_description'])
+            registry.services.append(description)
+        return make_response(jsonify({"id": description.get('id')}), HTTPStatus.CREATED)
+
+    @registry.route('/api/services/', methods=['GET'])
+    def list_services():
+        return make_response(jsonify(registry.services), HTTPStatus.OK)
+
+    return registry
+
+
+app = create_registry(int(os.environ.get('FAIL_FIRST', 0)))
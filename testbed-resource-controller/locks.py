@@ -0,0 +1,65 @@
+"""
+    Auto-expiring Redis locks shared by the gunicorn workers
+
+    A lock is held by a random token and expires by itself, so a crashed holder never blocks the others.
+    Only the holder of the token can renew or release it.
+"""
+import os
+import socket
+import uuid
+
+from redis_pool import get_redis, get_script
+
+
+# KEYS[1]: lock key, ARGV[1]: token of the holder, ARGV[2]: ttl in milliseconds
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1]: lock key, ARGV[1]: token of the holder
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def new_token():
+    """
+    new_token: a token identifying the holder of a lock
+    :return: "{host}:{pid}:{random}"
+    """
+    return '{host}:{pid}:{random}'.format(host=socket.gethostname(), pid=os.getpid(), random=uuid.uuid4().hex)
+
+
+def acquire(key, token, ttl):
+    """
+    acquire: acquire the lock if nobody holds it
+    :param key: Redis key of the lock
+    :param token: token of the holder
+    :param ttl: seconds until the lock expires
+    :return: True if acquired
+    """
+    return bool(get_redis().set(key, token, nx=True, px=int(ttl * 1000)))
+
+
+def renew(key, token, ttl):
+    """
+    renew: extend the lock held by the token
+    :return: True if the token still holds the lock
+    """
+    db = get_redis()
+    return bool(get_script(_RENEW)(keys=[key], args=[token, int(ttl * 1000)], client=db))
+
+
+def release(key, token):
+    """
+    release: release the lock held by the token
+    :return: True if the token held the lock
+    """
+    db = get_redis()
+    return bool(get_script(_RELEASE)(keys=[key], args=[token], client=db))
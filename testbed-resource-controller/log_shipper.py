@@ -0,0 +1,293 @@
+"""
+    Asynchronous shipping of action logs
+
+    The logger decorator only pushes records onto a bounded in-process queue. A background flusher sends
+    them to the data collector in batches, when LOG_BATCH_SIZE records are waiting or every
+    LOG_FLUSH_INTERVAL seconds, so request latency no longer depends on the collector.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import config
+import metrics
+from spool import Spool
+
+
+log = logging.getLogger(__name__)
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class DeliveryError(requests.RequestException):
+    """
+    DeliveryError: the collector failed in the middle of a batch, after its first records were delivered
+    """
+    def __init__(self, delivered, error):
+        """
+        :param delivered: number of records of the batch delivered before the failure
+        :param error: exception raised by the collector
+        """
+        super().__init__(str(error))
+        self.delivered = delivered
+
+
+class LogShipper:
+    """
+    LogShipper: bounded queue of log records and its background flusher
+    """
+    def __init__(self, url, batch_size=50, flush_interval=1.0, max_queue=10000, policy=DROP_NEWEST,
+                 block_timeout=0.1, batch_mode="each", timeout=5.0, spool=None, replay_interval=10.0):
+        """
+        :param url: url of the data collector
+        :param batch_size: number of records sent at once
+        :param flush_interval: seconds a record waits at most before being sent
+        :param max_queue: number of records kept in memory
+        :param policy: what to do when the queue is full: drop_newest, drop_oldest, or block
+        :param block_timeout: seconds to block when the policy is block, the record is dropped afterwards
+        :param batch_mode: "each" posts records one by one as form data, "json" posts a batch as a JSON list
+        :param timeout: seconds to wait for the collector
+        :param spool: Spool keeping the records which could not be delivered, None to drop them
+        :param replay_interval: seconds between two replays of the spool
+        """
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_mode = batch_mode
+        self.timeout = timeout
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.session = metrics.instrument_session(requests.Session())
+        self.counters = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0, "spooled": 0, "replayed": 0}
+        self._counters_lock = threading.Lock()
+        self.pid = os.getpid()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log-shipper', daemon=True)
+        self._thread.start()
+
+    def _count(self, name, n):
+        # Updated by the request threads and the flusher
+        with self._counters_lock:
+            self.counters[name] += n
+
+    def ship(self, record):
+        """
+        ship: queue a record without waiting for the collector
+        :param record: dictionary of the log record
+        :return: True if queued, False if dropped
+        """
+        try:
+            if self.policy == BLOCK:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            if self.policy != DROP_OLDEST:
+                self._count("dropped", 1)
+                return False
+
+            # Make room by dropping the oldest record
+            try:
+                self.queue.get_nowait()
+                self._count("dropped", 1)
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._count("dropped", 1)
+                return False
+
+        self._count("queued", 1)
+        return True
+
+    def deliver(self, batch):
+        """
+        deliver: send a batch of records to the collector
+        :param batch: list of records
+        :return: None
+        :raise requests.RequestException: the collector is unreachable or rejected the batch,
+                                          DeliveryError if the first records were delivered one by one
+        """
+        if self.batch_mode == "json":
+            self.session.post(url=self.url, json=batch, timeout=self.timeout).raise_for_status()
+            return
+
+        for delivered, record in enumerate(batch):
+            try:
+                self.session.post(url=self.url, data=record, timeout=self.timeout).raise_for_status()
+            except requests.RequestException as e:
+                if not delivered:
+                    raise
+                raise DeliveryError(delivered, e)
+
+    def failed(self, batch, error):
+        """
+        failed: handle a batch which could not be delivered
+        :param batch: list of records
+        :param error: exception raised by deliver
+        :return: None
+        """
+        # Records delivered before the failure are not sent again
+        delivered = getattr(error, 'delivered', 0)
+        self._count("sent", delivered)
+        batch = batch[delivered:]
+
+        self._count("failed", len(batch))
+        if self.spool is None:
+            log.warning("Dropped %d log records: %s", len(batch), error)
+            return
+
+        # Keep the records on disk until the collector recovers
+        try:
+            self.spool.append(batch)
+            self._count("spooled", len(batch))
+        except OSError:
+            log.exception("Dropped %d log records", len(batch))
+
+    def replay(self):
+        """
+        replay: deliver the spooled records in order
+        :return: None
+        """
+        try:
+            self._count("replayed", self.spool.replay(self.deliver, self.batch_size))
+        except requests.RequestException as e:
+            log.info("Collector still unavailable: %s", e)
+        except Exception:
+            log.exception("Replaying the spool failed")
+
+    def flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.deliver(batch)
+            self._count("sent", len(batch))
+        except requests.RequestException as e:
+            self.failed(batch, e)
+
+    def _run(self):
+        batch = []
+        deadline = time.time() + self.flush_interval
+        replay_at = time.time()
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            try:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0.01)))
+                except queue.Empty:
+                    pass
+
+                # Flush when the batch is full or the oldest record waited long enough
+                if len(batch) >= self.batch_size or time.time() >= deadline:
+                    self.flush(batch)
+                    batch = []
+                    deadline = time.time() + self.flush_interval
+
+                if self.spool is not None and time.time() >= replay_at:
+                    replay_at = time.time() + self.replay_interval
+                    self.replay()
+            except Exception:
+                # Keep the flusher alive: only the current batch is lost
+                log.exception("Shipping log records failed")
+                batch = []
+                deadline = time.time() + self.flush_interval
+        self.flush(batch)
+
+    def close(self, timeout=5.0):
+        """
+        close: send the queued records and stop the flusher
+        :param timeout: seconds to wait for the queued records to be sent
+        :return: None
+        """
+        self._stop_event.set()
+        self._thread.join(timeout)
+        self.session.close()
+        if self.spool is not None:
+            self.spool.close()
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self.counters)
+        stats["waiting"] = self.queue.qsize()
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+        return stats
+
+
+_shipper = None
+_lock = threading.Lock()
+
+
+def create_shipper():
+    spool = None
+    if config.get('LOG_SPOOL_DIR'):
+        spool = Spool(
+            directory=config.get('LOG_SPOOL_DIR'),
+            segment_size=config.get_int('LOG_SPOOL_SEGMENT_SIZE'),
+            max_size=config.get_int('LOG_SPOOL_MAX_SIZE'),
+            fsync=config.get('LOG_SPOOL_FSYNC')
+        )
+
+    return LogShipper(
+        url=config.get('LOG_COLLECTOR_URL'),
+        batch_size=config.get_int('LOG_BATCH_SIZE'),
+        flush_interval=config.get_float('LOG_FLUSH_INTERVAL'),
+        max_queue=config.get_int('LOG_QUEUE_SIZE'),
+        policy=config.get('LOG_QUEUE_POLICY'),
+        block_timeout=config.get_float('LOG_BLOCK_TIMEOUT'),
+        batch_mode=config.get('LOG_BATCH_MODE'),
+        timeout=config.get_float('LOG_COLLECTOR_TIMEOUT'),
+        spool=spool,
+        replay_interval=config.get_float('LOG_SPOOL_REPLAY_INTERVAL')
+    )
+
+
+def get_shipper():
+    """
+    get_shipper: get the log shipper of the current process, started on first use
+    :return: LogShipper
+    """
+    global _shipper
+
+    # Threads do not survive fork: start a new flusher in each worker process
+    pid = os.getpid()
+    if _shipper is None or _shipper.pid != pid:
+        with _lock:
+            if _shipper is None or _shipper.pid != pid:
+                _shipper = create_shipper()
+    return _shipper
+
+
+def ship(record):
+    """
+    ship: queue a log record for the data collector
+    :param record: dictionary of the log record
+    :return: True if queued, False if dropped
+    """
+    return get_shipper().ship(record)
+
+
+def shutdown():
+    """
+    shutdown: drain the queue of the current process, called at exit
+    :return: None
+    """
+    global _shipper
+
+    with _lock:
+        if _shipper is not None and _shipper.pid == os.getpid():
+            _shipper.close(config.get_float('LOG_DRAIN_TIMEOUT'))
+        _shipper = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,136 @@
+"""
+    Prometheus metrics of the controllers
+
+    Latency histograms of the routes, of the Redis commands and of the outbound HTTP calls (Hue bridge,
+    resources, log collector) by host and status, and a counter of the binding conflicts. Under gunicorn,
+    set PROMETHEUS_MULTIPROC_DIR (run.sh does) so every worker writes its samples to memory-mapped files
+    of this directory and GET /metrics, served by any worker, aggregates all of them.
+"""
+import os
+import time
+
+from urllib.parse import urlsplit
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+
+import config
+
+
+# Redis round trips are much shorter than requests
+_REDIS_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0)
+
+REQUEST_LATENCY = Histogram('controller_request_duration_seconds', 'Latency of the requests by route',
+                            ['method', 'route', 'status'])
+REDIS_LATENCY = Histogram('controller_redis_command_duration_seconds', 'Latency of the Redis commands',
+                          ['command'], buckets=_REDIS_BUCKETS)
+REDIS_ERRORS = Counter('controller_redis_errors_total', 'Failed Redis commands', ['command'])
+OUTBOUND_LATENCY = Histogram('controller_outbound_request_duration_seconds',
+                             'Latency of the outbound HTTP requests by host and status ("error" if failed)',
+                             ['host', 'status'])
+BINDING_CONFLICTS = Counter('controller_binding_conflicts_total',
+                            'Binding operations refused because the resource is bound to another user',
+                            ['operation'])
+
+
+def enabled():
+    """
+    enabled: check whether the hot paths are instrumented (METRICS)
+    :return: bool
+    """
+    return config.get_bool('METRICS')
+
+
+def _multiprocess_dir():
+    # prometheus_client < 0.10 reads the lower-case variable
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def render():
+    """
+    render: metrics in Prometheus text format, aggregated over the workers in multiprocess mode
+    :return: (body bytes, content type)
+    """
+    if _multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    """
+    init_app: time every request of a Flask or Quart app by route
+    :param app: flask or quart app
+    :return: None
+    """
+    if not enabled():
+        return
+
+    if app.__class__.__module__.startswith('quart'):
+        from quart import g, request
+    else:
+        from flask import g, request
+
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    def observe(response):
+        start = getattr(g, 'metrics_start', None)
+        if start is not None:
+            # The rule keeps the cardinality bounded, e.g. /resource/<action>
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - start)
+        return response
+
+    app.before_request(start_timer)
+    app.after_request(observe)
+
+
+def observe_redis(command, seconds, failed=False):
+    """
+    observe_redis: record a Redis command
+    :param command: name of the command, e.g. 'EVALSHA'
+    :param seconds: latency of the command
+    :param failed: True if the command raised
+    :return: None
+    """
+    REDIS_LATENCY.labels(command).observe(seconds)
+    if failed:
+        REDIS_ERRORS.labels(command).inc()
+
+
+def instrument_session(session):
+    """
+    instrument_session: time the requests of a session by host and status
+    :param session: requests.Session
+    :return: the session
+    """
+    if not enabled():
+        return session
+
+    send = session.send
+
+    def timed_send(prepared, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = send(prepared, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            OUTBOUND_LATENCY.labels(urlsplit(prepared.url).netloc, status).observe(time.perf_counter() - start)
+
+    session.send = timed_send
+    return session
+
+
+def binding_conflict(operation):
+    """
+    binding_conflict: count a binding operation refused because of another user
+    :param operation: 'bind', 'unbind' or 'authorize'
+    :return: None
+    """
+    BINDING_CONFLICTS.labels(operation).inc()
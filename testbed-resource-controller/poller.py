@@ -0,0 +1,110 @@
+"""
+    Background poller of the light state
+
+    Every worker runs a poller thread (per resource of a multi-resource controller), but only the one holding
+    the Redis leader lock polls the bridge. It publishes the state into the shared state cache at a fixed
+    interval, so bridge traffic does not depend on the number of clients. The lock expires when the leader
+    dies, and another worker takes over.
+"""
+import logging
+import os
+import threading
+
+import config
+import locks
+from state_cache import STATE_KEY, put_state
+
+
+log = logging.getLogger(__name__)
+
+
+class StatePoller(threading.Thread):
+    """
+    StatePoller: daemon thread polling the bridge while it is the elected leader
+    """
+    def __init__(self, fetch, key=STATE_KEY, interval=None, lock_ttl=None):
+        """
+        :param fetch: function reading the state from the bridge
+        :param key: Redis key of the state
+        :param interval: seconds between two polls, STATE_POLL_INTERVAL by default
+        :param lock_ttl: seconds until the leader lock expires, STATE_POLL_LOCK_TTL by default
+        """
+        super().__init__(name='state-poller', daemon=True)
+        self.fetch = fetch
+        self.key = key
+        self.lock_key = key + ':poller'
+        self.interval = interval or config.get_float('STATE_POLL_INTERVAL')
+        self.lock_ttl = lock_ttl or config.get_float('STATE_POLL_LOCK_TTL') or 3 * self.interval
+        self.token = locks.new_token()
+        self.leader = False
+        self.pid = os.getpid()
+        self._stop_event = threading.Event()
+
+    def elect(self):
+        """
+        elect: keep or take the leadership
+        :return: True if this poller is the leader
+        """
+        if self.leader:
+            self.leader = locks.renew(self.lock_key, self.token, self.lock_ttl)
+        if not self.leader:
+            self.leader = locks.acquire(self.lock_key, self.token, self.lock_ttl)
+        return self.leader
+
+    def poll(self):
+        put_state(self.fetch(), self.key)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                if self.elect():
+                    self.poll()
+            except Exception:
+                # Bridge or Redis failure: try again on the next interval
+                log.exception("State poller failed")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.leader:
+            locks.release(self.lock_key, self.token)
+            self.leader = False
+
+
+# Pollers of the current process by state key, one per resource of a multi-resource controller
+_pollers = {}
+_lock = threading.Lock()
+
+
+def enabled():
+    return config.get_bool('STATE_POLLER')
+
+
+def ensure_poller(fetch, key=STATE_KEY):
+    """
+    ensure_poller: start the poller of the state in the current process if the poller mode is enabled
+    :param fetch: function reading the state from the bridge
+    :param key: Redis key of the state
+    :return: StatePoller, None if the poller mode is disabled
+    """
+    if not enabled():
+        return None
+
+    # Threads do not survive fork: start a new poller in each worker process
+    pid = os.getpid()
+    poller = _pollers.get(key)
+    if poller is None or poller.pid != pid:
+        with _lock:
+            poller = _pollers.get(key)
+            if poller is None or poller.pid != pid:
+                poller = _pollers[key] = StatePoller(fetch, key)
+                poller.start()
+    return poller
+
+
+def stop_poller():
+    with _lock:
+        for poller in _pollers.values():
+            if poller.pid == os.getpid():
+                poller.stop()
+        _pollers.clear()
@@ -0,0 +1,165 @@
+"""
+    On-demand profiling of requests
+
+    A request is profiled if it is sampled (PROFILE_SAMPLE_RATE, a fraction of the requests), or if it carries
+    the PROFILE header and its USER-ID is allowed (PROFILE_USERS). The stack of the thread serving the request
+    is sampled every PROFILE_INTERVAL seconds and written in collapsed format ('module:function;... count',
+    ready for flamegraph.pl or speedscope) to PROFILE_DIR, next to the per-function timing of cProfile.
+    Only the PROFILE_MAX_FILES most recent profiles are kept.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+
+import config
+
+
+log = logging.getLogger(__name__)
+
+
+def requested(headers):
+    """
+    requested: check whether the current request should be profiled
+    :param headers: HTTP request headers
+    :return: bool
+    """
+    rate = config.get_float('PROFILE_SAMPLE_RATE')
+    if rate > 0 and random.random() < rate:
+        return True
+
+    if headers.get('PROFILE') is None:
+        return False
+    users = [user.strip() for user in config.get('PROFILE_USERS').split(',') if user.strip()]
+    return headers.get('USER-ID') in users
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{module}:{function}'.format(module=os.path.splitext(os.path.basename(code.co_filename))[0],
+                                        function=code.co_name)
+
+
+class StackSampler(threading.Thread):
+    """
+    StackSampler: daemon thread counting the stacks of another thread
+    """
+    def __init__(self, thread_id, interval):
+        """
+        :param thread_id: ident of the profiled thread
+        :param interval: seconds between two samples
+        """
+        super().__init__(name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        """
+        collapsed: the sampled stacks in collapsed format
+        :return: str, one 'frame;frame;... count' line per stack
+        """
+        return ''.join('{stack} {count}\n'.format(stack=stack, count=count)
+                       for stack, count in sorted(self.stacks.items()))
+
+
+class RequestProfile:
+    """
+    RequestProfile: context manager profiling the current thread and writing the profile when leaving
+    """
+    def __init__(self, name):
+        """
+        :param name: name of the profiled request, e.g. 'POST /resource/<action>'
+        """
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.directory = config.get('PROFILE_DIR')
+        self.sampler = StackSampler(threading.get_ident(), config.get_float('PROFILE_INTERVAL'))
+        self.profile = cProfile.Profile()
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        self.sampler.start()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another request of the process is already profiled: keep the stack samples only
+            self.profile = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profile is not None:
+            self.profile.disable()
+        self.sampler.stop()
+        try:
+            self.write(time.time() - self.started)
+        except OSError:
+            log.exception("Writing the profile %s failed", self.id)
+        return False
+
+    def write(self, elapsed):
+        """
+        write: write the collapsed stacks (.folded) and the per-function timing (.txt), and rotate the profiles
+        :param elapsed: duration of the request in seconds
+        :return: None
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, '{time}-{pid}-{id}'.format(time=int(self.started * 1000),
+                                                                       pid=os.getpid(), id=self.id))
+        with open(base + '.folded', 'w') as f:
+            f.write(self.sampler.collapsed())
+
+        timing = io.StringIO()
+        timing.write('{name} {elapsed:.6f}s\n\n'.format(name=self.name, elapsed=elapsed))
+        if self.profile is not None:
+            pstats.Stats(self.profile, stream=timing).sort_stats('cumulative').print_stats(50)
+        with open(base + '.txt', 'w') as f:
+            f.write(timing.getvalue())
+
+        rotate(self.directory, config.get_int('PROFILE_MAX_FILES'))
+
+
+def rotate(directory, max_files):
+    """
+    rotate: remove the oldest profiles of the directory
+    :param directory: directory of the profiles
+    :param max_files: number of profiles to keep (0: keep all)
+    :return: None
+    """
+    if max_files <= 0:
+        return
+
+    # Both files of a profile share the same name, which starts with its time
+    names = sorted({os.path.splitext(name)[0] for name in os.listdir(directory)
+                    if name.endswith(('.folded', '.txt'))})
+    for name in names[:-max_files]:
+        for extension in ('.folded', '.txt'):
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError:
+                # Another worker removed it meanwhile
+                pass
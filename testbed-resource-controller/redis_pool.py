@@ -0,0 +1,126 @@
+"""
+    Process-wide Redis connection pool
+
+    One pool is created lazily per worker process and shared by every API view, the description
+    helpers and the decorators in utils.py. The pool is re-created when the process id changes,
+    so a client created before gunicorn forks its workers is never shared with the children.
+"""
+import os
+import threading
+import time
+
+import redis
+
+import config
+import metrics
+
+
+class CountingConnectionPool(redis.ConnectionPool):
+    """
+    CountingConnectionPool: connection pool that counts checkouts to show connection reuse
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+
+    def get_connection(self, *args, **kwargs):
+        self.checkouts += 1
+        return super().get_connection(*args, **kwargs)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    InstrumentedRedis: Redis client recording the latency of every command
+    """
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            metrics.observe_redis(str(args[0]).upper(), time.perf_counter() - start, failed)
+
+
+_lock = threading.Lock()
+_pool = None
+_client = None
+_pid = None
+_scripts = {}
+
+
+def _create_pool():
+    return CountingConnectionPool(
+        host=config.get('REDIS_HOST'),
+        port=config.get_int('REDIS_PORT'),
+        db=config.get_int('REDIS_DB'),
+        max_connections=config.get_int('REDIS_MAX_CONNECTIONS'),
+        socket_timeout=config.get_float('REDIS_SOCKET_TIMEOUT'),
+        decode_responses=True
+    )
+
+
+def get_redis():
+    """
+    get_redis: get the Redis client of the current process
+    :return: redis.Redis client backed by the shared connection pool
+    """
+    global _pool, _client, _pid
+
+    pid = os.getpid()
+    if _client is None or _pid != pid:
+        with _lock:
+            if _client is None or _pid != pid:
+                _pool = _create_pool()
+                client_class = InstrumentedRedis if metrics.enabled() else redis.Redis
+                _client = client_class(connection_pool=_pool)
+                _pid = pid
+    return _client
+
+
+def get_script(source):
+    """
+    get_script: get a Lua script registered once per process, re-loaded automatically when flushed
+    :param source: Lua source of the script
+    :return: redis Script, call it with keys, args and client=get_redis()
+    """
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = get_redis().register_script(source)
+    return script
+
+
+def reset():
+    """
+    reset: drop the pool of the current process, e.g. after the Redis settings were changed
+    :return: None
+    """
+    global _pool, _client, _pid
+
+    with _lock:
+        if _pool is not None and _pid == os.getpid():
+            _pool.disconnect()
+        _pool = None
+        _client = None
+        _pid = None
+
+
+def pool_stats():
+    """
+    pool_stats: statistics of the connection pool of the current process
+    :return: dictionary of pool statistics
+    """
+    get_redis()
+    pool = _pool
+    created = pool._created_connections
+    return {
+        "pid": _pid,
+        "maxConnections": pool.max_connections,
+        "createdConnections": created,
+        "availableConnections": len(pool._available_connections),
+        "inUseConnections": len(pool._in_use_connections),
+        "checkouts": pool.checkouts,
+        # Average number of commands served by each opened connection
+        "reuseRatio": pool.checkouts / created if created else 0.0
+    }
@@ -0,0 +1,147 @@
+"""
+    Background registration of the description to the registry
+
+    Registration runs in a daemon thread, so worker boot never waits for the registry. Only the worker
+    holding the registration lock posts the description, retrying with exponential backoff, and the
+    content hash acknowledged by the registry is kept in Redis: an unchanged description is never posted again.
+"""
+import json
+import logging
+import os
+import random
+import threading
+
+import requests
+
+import config
+import locks
+from redis_pool import get_redis
+
+
+log = logging.getLogger(__name__)
+
+LOCK_KEY = 'registration'
+ACKED_KEY = 'registration_hash'
+
+
+class Registration(threading.Thread):
+    """
+    Registration: daemon thread registering one description until the registry acknowledges it
+    """
+    def __init__(self, api_dict, digest, url=None, namespace=''):
+        """
+        :param api_dict: description of the controller
+        :param digest: content hash of the description
+        :param url: url of the registry, REGISTRY_URL by default
+        :param namespace: prefix of the Redis keys of the registration, one per resource of the controller
+        """
+        super().__init__(name='registration', daemon=True)
+        self.api_dict = api_dict
+        self.digest = digest
+        self.url = url or config.get('REGISTRY_URL')
+        self.lock_key = namespace + LOCK_KEY
+        self.acked_key = namespace + ACKED_KEY
+        self.timeout = config.get_float('REGISTRY_TIMEOUT')
+        self.lock_ttl = config.get_float('REGISTRY_LOCK_TTL')
+        self.backoff = config.get_float('REGISTRY_BACKOFF_INITIAL')
+        self.max_backoff = config.get_float('REGISTRY_BACKOFF_MAX')
+        self.max_attempts = config.get_int('REGISTRY_MAX_ATTEMPTS')
+        self.token = locks.new_token()
+        self.attempts = 0
+        self.registered = threading.Event()
+        self._stop_event = threading.Event()
+
+    def acked(self):
+        return get_redis().get(self.acked_key) == self.digest
+
+    def post(self):
+        """
+        post: post the description to the registry once
+        :return: None
+        :raise requests.RequestException: the registry is unreachable or rejected the description
+        """
+        # TODO scheme
+        data = {
+            "raw_description": json.dumps(self.api_dict)
+        }
+        requests.post(url=self.url, data=data, timeout=self.timeout).raise_for_status()
+
+    def _wait(self, seconds):
+        # Keep the lock while waiting, so no other worker posts meanwhile
+        while seconds > 0 and not self._stop_event.is_set():
+            step = min(seconds, self.lock_ttl / 3)
+            self._stop_event.wait(step)
+            locks.renew(self.lock_key, self.token, self.lock_ttl)
+            seconds -= step
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                if self.acked():
+                    self.registered.set()
+                    return
+
+                # Another worker is registering: check again once its lock may have expired
+                if not locks.acquire(self.lock_key, self.token, self.lock_ttl):
+                    self._stop_event.wait(self.lock_ttl / 2)
+                    continue
+
+                try:
+                    while not self._stop_event.is_set():
+                        self.attempts += 1
+                        try:
+                            self.post()
+                            get_redis().set(self.acked_key, self.digest)
+                            self.registered.set()
+                            log.info("Registered to %s", self.url)
+                            return
+                        except requests.RequestException as e:
+                            if self.max_attempts and self.attempts >= self.max_attempts:
+                                log.error("Registration to %s failed: %s", self.url, e)
+                                return
+
+                            # Exponential backoff with jitter
+                            delay = min(self.backoff * 2 ** (self.attempts - 1), self.max_backoff)
+                            delay *= random.uniform(0.5, 1.0)
+                            log.warning("Registration to %s failed, retrying in %.1fs: %s", self.url, delay, e)
+                            self._wait(delay)
+                finally:
+                    locks.release(self.lock_key, self.token)
+            except Exception:
+                # Redis failure: try again later
+                log.exception("Registration failed")
+                self._stop_event.wait(self.lock_ttl / 2)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_registrations = {}
+_pid = None
+_lock = threading.Lock()
+
+
+def register(api_dict, digest, url=None, namespace=''):
+    """
+    register: register the description in the background, once per controller (or resource of the controller)
+    :param api_dict: description of the controller
+    :param digest: content hash of the description
+    :param url: url of the registry, REGISTRY_URL by default
+    :param namespace: prefix of the Redis keys of the registration
+    :return: Registration thread
+    """
+    global _pid
+
+    with _lock:
+        # Threads do not survive fork
+        if _pid != os.getpid():
+            _registrations.clear()
+            _pid = os.getpid()
+
+        registration = _registrations.get(namespace)
+        if registration is None or registration.digest != digest:
+            if registration is not None:
+                registration.stop()
+            registration = _registrations[namespace] = Registration(api_dict, digest, url, namespace)
+            registration.start()
+    return registration
@@ -0,0 +1,124 @@
+"""
+    Client used by services to bind, unbind and control the resources they require
+
+    Calls go over one pooled keep-alive session per process with a timeout (RESOURCE_TIMEOUT), and
+    several resources are bound or unbound concurrently on a shared thread pool.
+"""
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+
+
+_lock = threading.Lock()
+_session = None
+_executor = None
+_pid = None
+
+
+def _ensure():
+    global _session, _executor, _pid
+
+    # Sessions and threads do not survive fork: create them in each worker process
+    pid = os.getpid()
+    if _session is None or _pid != pid:
+        with _lock:
+            if _session is None or _pid != pid:
+                parallelism = config.get_int('RESOURCE_PARALLELISM')
+                adapter = HTTPAdapter(pool_connections=parallelism, pool_maxsize=parallelism)
+                _session = requests.Session()
+                _session.mount('http://', adapter)
+                _session.mount('https://', adapter)
+                metrics.instrument_session(_session)
+                _executor = ThreadPoolExecutor(max_workers=parallelism)
+                _pid = pid
+
+
+def get_session():
+    """
+    get_session: get the HTTP session of the current process
+    :return: requests.Session
+    """
+    _ensure()
+    return _session
+
+
+def call(url, action, user_id, headers=None):
+    """
+    call: post an action to a resource on behalf of the user
+    :param url: url of the resource controller
+    :param action: path of the action, e.g. 'user/bind'
+    :param user_id: id of the user
+    :param headers: additional HTTP headers
+    :return: HTTP status code, or None if the resource is unreachable
+    """
+    headers = dict(headers or {}, **{'USER-ID': str(user_id)})
+    try:
+        response = get_session().post(url=urljoin(base=url, url=action), headers=headers,
+                                      timeout=config.get_float('RESOURCE_TIMEOUT'))
+        return response.status_code
+    except requests.RequestException:
+        return None
+
+
+def call_all(urls, action, user_id, headers=None):
+    """
+    call_all: post the same action to many resources concurrently
+    :param urls: urls of the resource controllers
+    :param action: path of the action
+    :param user_id: id of the user
+    :param headers: additional HTTP headers
+    :return: list of HTTP status codes (None if unreachable), in the order of urls
+    """
+    if len(urls) == 1:
+        return [call(urls[0], action, user_id, headers)]
+
+    _ensure()
+    return list(_executor.map(lambda url: call(url, action, user_id, headers), urls))
+
+
+def bind_error(statuses):
+    """
+    bind_error: HTTP error of failed binds
+    :param statuses: HTTP status codes of the binds
+    :return: (status code, message)
+    """
+    if None in statuses and HTTPStatus.CONFLICT not in statuses:
+        return HTTPStatus.BAD_GATEWAY, "Resource unavailable."
+    return HTTPStatus.CONFLICT, "Resource bound to another user."
+
+
+def bind_all(urls, user_id):
+    """
+    bind_all: bind every resource or none of them
+    :param urls: urls of the resource controllers
+    :param user_id: id of the user
+    :return: None if every resource was bound, otherwise the HTTP error (status code, message)
+    """
+    statuses = call_all(urls, 'user/bind', user_id)
+    if all(status == HTTPStatus.OK for status in statuses):
+        return None
+
+    # Roll back the resources which were bound
+    unbind_all([url for url, status in zip(urls, statuses) if status == HTTPStatus.OK], user_id)
+    return bind_error(statuses)
+
+
+def unbind_all(urls, user_id):
+    """
+    unbind_all: unbind resources concurrently
+    :param urls: urls of the resource controllers
+    :param user_id: id of the user
+    :return: list of HTTP status codes
+    """
+    if not urls:
+        return []
+    return call_all(urls, 'user/unbind', user_id)
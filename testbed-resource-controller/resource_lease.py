@@ -0,0 +1,232 @@
+"""
+    Sticky binding leases of the resources required by a service
+
+    In lease mode, resource_required keeps the resources bound between consecutive actions instead of
+    binding and unbinding them on every call. The lease of each resource is shared by the workers of the
+    service in Redis (bound state, actions in flight, last use). A background reaper in every worker renews
+    the bindings, so the resource keeps them (LEASE-TTL), and unbinds the resources idle for longer than
+    the idle timeout. Leases of unused resources are released at shutdown.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from http import HTTPStatus
+
+import config
+import resource_client
+from redis_pool import get_redis, get_script
+
+
+log = logging.getLogger(__name__)
+
+LEASE_KEY = 'resource_lease:{url}'
+
+# Idle timeout of the leases requested with lease=True while RESOURCE_LEASE_IDLE is not set
+DEFAULT_IDLE = 30.0
+
+# KEYS[1]: lease hash, ARGV[1]: user id, ARGV[2]: now, ARGV[3]: seconds after which a release is abandoned
+# return: 1 if the resource is bound to the user, 0 if it has to be bound, -1 if it is being released,
+#         -2 if it is leased to another user and in use, 2 if the idle lease of another user must be released first
+# The lease of another user is left untouched, so it still expires when idle
+_ACQUIRE = """
+local lease = redis.call('HMGET', KEYS[1], 'state', 'last_used', 'user', 'inflight')
+local state = lease[1]
+if state == 'releasing' and tonumber(ARGV[2]) - tonumber(lease[2] or 0) < tonumber(ARGV[3]) then
+    return -1
+end
+if state == 'bound' and lease[3] ~= ARGV[1] then
+    if tonumber(lease[4] or 0) > 0 then
+        return -2
+    end
+    redis.call('HSET', KEYS[1], 'state', 'releasing', 'last_used', ARGV[2])
+    return 2
+end
+redis.call('HINCRBY', KEYS[1], 'inflight', 1)
+redis.call('HSET', KEYS[1], 'last_used', ARGV[2])
+if state == 'bound' then
+    return 1
+end
+return 0
+"""
+
+# KEYS[1]: lease hash, ARGV[1]: now
+_DONE = """
+if redis.call('HINCRBY', KEYS[1], 'inflight', -1) < 0 then
+    redis.call('HSET', KEYS[1], 'inflight', 0)
+end
+redis.call('HSET', KEYS[1], 'last_used', ARGV[1])
+return 1
+"""
+
+# KEYS[1]: lease hash, ARGV[1]: now, ARGV[2]: idle timeout in seconds
+# return: user id of the lease to release, false if the lease is in use or not idle
+_EXPIRE = """
+local lease = redis.call('HMGET', KEYS[1], 'state', 'inflight', 'last_used', 'user')
+if lease[1] ~= 'bound' or tonumber(lease[2] or 0) > 0 then
+    return false
+end
+if tonumber(ARGV[1]) - tonumber(lease[3] or 0) < tonumber(ARGV[2]) then
+    return false
+end
+redis.call('HSET', KEYS[1], 'state', 'releasing', 'last_used', ARGV[1])
+return lease[4]
+"""
+
+
+class LeaseManager:
+    """
+    LeaseManager: leases used by the current process, and the reaper thread renewing or releasing them
+    """
+    def __init__(self, idle):
+        """
+        :param idle: seconds a lease is kept without any action
+        """
+        self.idle = idle
+        self.urls = set()
+        self.pid = os.getpid()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-lease', daemon=True)
+        self._thread.start()
+
+    def headers(self):
+        # The resource expires the binding by itself if the service stops renewing it
+        return {'LEASE-TTL': str(2 * self.idle)}
+
+    def acquire(self, urls, user_id):
+        """
+        acquire: use the leases of the resources, binding the resources not leased yet
+        :param urls: urls of the resource controllers
+        :param user_id: id of the user of the service
+        :return: None if every resource is bound, otherwise the HTTP error (status code, message)
+        """
+        db = get_redis()
+        timeout = config.get_float('RESOURCE_TIMEOUT')
+        deadline = time.time() + timeout
+        unbound = []
+        for url in urls:
+            self.urls.add(url)
+
+            # Wait while another worker releases the lease (a release never completed is abandoned)
+            key = LEASE_KEY.format(url=url)
+            while True:
+                leased = get_script(_ACQUIRE)(keys=[key], args=[user_id, time.time(), 2 * timeout], client=db)
+                if leased == 2:
+                    # The lease of the previous user of the service is idle: hand the resource over
+                    self.release(url, db.hget(key, 'user'))
+                    continue
+                if leased != -1 or time.time() >= deadline:
+                    break
+                time.sleep(0.01)
+            if leased < 0:
+                self.done(urls[:urls.index(url)])
+                return HTTPStatus.CONFLICT, "Resource bound to another user."
+            if leased == 0:
+                unbound.append(url)
+
+        if not unbound:
+            return None
+
+        statuses = resource_client.call_all(unbound, 'user/bind', user_id, self.headers())
+        for url, status in zip(unbound, statuses):
+            if status == HTTPStatus.OK:
+                db.hset(LEASE_KEY.format(url=url), mapping={'state': 'bound', 'user': user_id})
+
+        if all(status == HTTPStatus.OK for status in statuses):
+            return None
+
+        # Resources bound meanwhile stay leased until they are idle
+        self.done(urls)
+        return resource_client.bind_error(statuses)
+
+    def done(self, urls):
+        """
+        done: stop using the leases of the resources, they stay bound until idle
+        :param urls: urls of the resource controllers
+        :return: None
+        """
+        db = get_redis()
+        for url in urls:
+            get_script(_DONE)(keys=[LEASE_KEY.format(url=url)], args=[time.time()], client=db)
+
+    def release(self, url, user_id):
+        """
+        release: unbind the resource of a lease marked as releasing
+        :param url: url of the resource controller
+        :param user_id: id of the user of the lease
+        :return: None
+        """
+        resource_client.call(url, 'user/unbind', user_id)
+        get_redis().hset(LEASE_KEY.format(url=url), 'state', 'unbound')
+
+    def reap(self, idle=None):
+        """
+        reap: release the idle leases and renew the others
+        :param idle: idle timeout in seconds, the timeout of the manager by default
+        :return: None
+        """
+        db = get_redis()
+        idle = self.idle if idle is None else idle
+        for url in list(self.urls):
+            key = LEASE_KEY.format(url=url)
+            user_id = get_script(_EXPIRE)(keys=[key], args=[time.time(), idle], client=db)
+            if user_id:
+                self.release(url, user_id)
+                continue
+
+            # Keep the binding of the leases in use
+            lease = db.hmget(key, 'state', 'user')
+            if lease[0] == 'bound':
+                resource_client.call(url, 'user/bind', lease[1], self.headers())
+
+    def _run(self):
+        while not self._stop_event.wait(self.idle / 3):
+            try:
+                self.reap()
+            except Exception:
+                log.exception("Renewing resource leases failed")
+
+    def close(self):
+        """
+        close: stop the reaper and release the leases which are not in use
+        :return: None
+        """
+        self._stop_event.set()
+        try:
+            self.reap(idle=0)
+        except Exception:
+            log.exception("Releasing resource leases failed")
+
+
+_manager = None
+_lock = threading.Lock()
+
+
+def get_manager():
+    """
+    get_manager: get the lease manager of the current process
+    :return: LeaseManager
+    """
+    global _manager
+
+    # Threads do not survive fork: start a new reaper in each worker process
+    pid = os.getpid()
+    if _manager is None or _manager.pid != pid:
+        with _lock:
+            if _manager is None or _manager.pid != pid:
+                _manager = LeaseManager(config.get_float('RESOURCE_LEASE_IDLE') or DEFAULT_IDLE)
+    return _manager
+
+
+def shutdown():
+    global _manager
+
+    with _lock:
+        if _manager is not None and _manager.pid == os.getpid():
+            _manager.close()
+        _manager = None
+
+
+atexit.register(shutdown)
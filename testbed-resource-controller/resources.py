@@ -0,0 +1,169 @@
+"""
+    Resources hosted by a multi-resource controller
+
+    One controller process may serve many lights instead of one container per light. The resources are listed
+    in the RESOURCES file, one entry per light with the url set of its bridge, e.g.
+        [{"name": "hall-1", "bridge": "http://{bridge}/api/{username}", "light": "1"}, ...]
+    Each resource is served under /<name> (GET /hall-1/ is its Thing Description, POST /hall-1/resource/on ...),
+    and its binding, cached state, events and registration live under Redis keys prefixed with '<name>:'.
+    Without RESOURCES, the controller serves its only resource at the root with the global keys, as before.
+"""
+import json
+import os
+import threading
+
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from flask import g, has_request_context
+
+import config
+from hue_bridge import HueBridgeClient, get_bridge, load_url_set
+
+
+class Resource:
+    """
+    Resource: one light served by the controller, with its URL prefix and Redis namespace
+    """
+    def __init__(self, name=None, url_set=None):
+        """
+        :param name: name of the resource, None for the only resource of a single-resource controller
+        :param url_set: dictionary with "bridge" and "light" (see hue_url_set.json), HUE_URL_SET by default
+        """
+        self.name = name
+        self.url_set = url_set
+        self.prefix = '/' + name if name else ''
+        self._bridge = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def key(self, key):
+        """
+        key: Redis key of the resource
+        :param key: global key, e.g. 'user_id'
+        :return: namespaced key, e.g. 'hall-1:user_id'
+        """
+        return '{name}:{key}'.format(name=self.name, key=key) if self.name else key
+
+    @property
+    def bridge(self):
+        """
+        bridge: keep-alive client of the bridge of the resource, created once per process
+        :return: HueBridgeClient
+        """
+        if self.url_set is None:
+            return get_bridge()
+
+        pid = os.getpid()
+        if self._bridge is None or self._pid != pid:
+            with self._lock:
+                if self._bridge is None or self._pid != pid:
+                    # Lights of the same bridge share its command queue and rate limit
+                    url = self.url_set.get('bridge') or self.url_set.get('action', '')
+                    namespace = 'bridge:{host}:'.format(host=urlsplit(url).netloc)
+                    self._bridge = HueBridgeClient.from_url_set(
+                        self.url_set,
+                        connect_timeout=config.get_float('HUE_CONNECT_TIMEOUT'),
+                        read_timeout=config.get_float('HUE_READ_TIMEOUT'),
+                        retries=config.get_int('HUE_RETRIES'),
+                        pool_size=config.get_int('HUE_POOL_SIZE'),
+                        namespace=namespace
+                    )
+                    self._pid = pid
+        return self._bridge
+
+    def describe(self, api_dict):
+        """
+        describe: Thing Description of the resource
+        :param api_dict: description of the controller
+        :return: description with the id ('webeng:hue:1:<name>'), title and urls of the resource
+        """
+        if not self.name:
+            return api_dict
+
+        base_url = api_dict.get('url') or ''
+        described = json.loads(json.dumps(api_dict))
+        described['id'] = '{id}:{name}'.format(id=api_dict['id'], name=self.name)
+        described['title'] = '{title}-{name}'.format(title=api_dict['title'], name=self.name)
+        # Trailing slash: actions are joined to the url, e.g. urljoin(url, 'user/bind') is <url>/hall-1/user/bind
+        described['url'] = base_url + self.prefix + '/'
+        for interactions in (described.get('properties', {}), described.get('actions', {})):
+            for interaction in interactions.values():
+                for form in interaction.get('forms', []):
+                    if form['href'].startswith(base_url):
+                        form['href'] = base_url + self.prefix + form['href'][len(base_url):]
+        return described
+
+
+DEFAULT = Resource()
+
+_resources = None
+_lock = threading.Lock()
+
+
+def load(path):
+    """
+    load: read the resources of the controller
+    :param path: path of a JSON list of {"name", "bridge", "light"}, or of a dictionary of url sets by name
+    :return: OrderedDict of Resource by name
+    """
+    entries = load_url_set(path)
+    if isinstance(entries, dict):
+        entries = [dict(url_set, name=name) for name, url_set in entries.items()]
+
+    resources = OrderedDict()
+    for entry in entries:
+        url_set = dict(entry)
+        name = str(url_set.pop('name'))
+        if not name or '/' in name or name in resources:
+            raise ValueError("Invalid resource name {name!r}".format(name=name))
+        resources[name] = Resource(name, url_set)
+    return resources
+
+
+def get_resources():
+    """
+    get_resources: get the resources of the RESOURCES file, read only once
+    :return: OrderedDict of Resource by name, empty for a single-resource controller
+    """
+    global _resources
+
+    if _resources is None:
+        with _lock:
+            if _resources is None:
+                path = config.get('RESOURCES')
+                _resources = load(path) if path else OrderedDict()
+    return _resources
+
+
+def enabled():
+    return bool(get_resources())
+
+
+def get(name):
+    """
+    get: find a resource by name
+    :param name: name of the resource, empty for the only resource of a single-resource controller
+    :return: Resource, None if unknown
+    """
+    if not name:
+        return DEFAULT
+    return get_resources().get(name)
+
+
+def all_resources():
+    """
+    all_resources: every resource served by the controller
+    :return: list of Resource
+    """
+    return list(get_resources().values()) or [DEFAULT]
+
+
+def current():
+    """
+    current: resource of the current request
+    :return: Resource, DEFAULT outside of a request or in a single-resource controller
+    """
+    if has_request_context():
+        return g.get('resource', DEFAULT)
+    return DEFAULT
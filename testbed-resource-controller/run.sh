@@ -7,7 +7,27 @@ export NAME=$1;
 export ID=$2;
 export URL=http://$3;
 
+# Metrics of all the workers, aggregated by GET /metrics (prometheus_client < 0.10 reads the lower-case name)
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/controller-metrics}
+export prometheus_multiproc_dir=$PROMETHEUS_MULTIPROC_DIR
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Executors of the asynchronous commands, separate from the HTTP workers
+# COMMAND_EXECUTOR is read like config.get_bool: 1, true, yes or on, in any case
+case "$(printf '%s' "${COMMAND_EXECUTOR}" | tr -d '[:space:]' | tr '[:upper:]' '[:lower:]')" in
+    1|true|yes|on) COMMAND_EXECUTOR_ENABLED=1 ;;
+    *) COMMAND_EXECUTOR_ENABLED= ;;
+esac
+if [ "${COMMAND_MODE}" = "async" ] || [ -n "${COMMAND_EXECUTOR_ENABLED}" ]; then
+    nohup python3 async_commands.py &
+fi
+
 # 2. Run Flask along with Gunicorn as a resource controller
 # get controller name from argument. e. g. sh run.sh basic
 # may change the number of workers and the number of threads for each worker
-gunicorn "$NAME":app -w 4 -b 0.0.0.0:8000
+# threaded workers: a stream (GET /resource/stream) holds a thread, half of them are left to the other requests
+# controllers built on aio_base.py run on an ASGI worker: WORKER_CLASS=uvicorn.workers.UvicornWorker
+export THREADS=${THREADS:-8}
+# controllers with an app factory create the app in gunicorn, not when the module is imported
+if grep -q "^def create_app" "$NAME.py"; then APP="$NAME:create_app()"; else APP="$NAME:app"; fi
+gunicorn "$APP" -w "${WORKERS:-4}" -k "${WORKER_CLASS:-gthread}" --threads "$THREADS" -b 0.0.0.0:8000
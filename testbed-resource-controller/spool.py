@@ -0,0 +1,226 @@
+"""
+    Durable on-disk spool of log records
+
+    Records which could not be delivered to the data collector are appended to a local spool, one JSON
+    record per line. Every worker appends to its own open segment, so workers never interleave writes;
+    a segment is closed when it reaches LOG_SPOOL_SEGMENT_SIZE. The replayer holding the spool file lock
+    sends closed segments in order once the collector recovers, and remembers its offset in each segment.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+FSYNC_ALWAYS = "always"
+FSYNC_BATCH = "batch"
+FSYNC_NEVER = "never"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Spool:
+    """
+    Spool: append-only, segment-rotated, size-capped spool of log records
+    """
+    def __init__(self, directory, segment_size=1 << 20, max_size=64 << 20, fsync=FSYNC_BATCH):
+        """
+        :param directory: directory of the segments
+        :param segment_size: bytes of a segment before it is closed
+        :param max_size: bytes of the spool, the oldest segments are dropped beyond it
+        :param fsync: always (every record), batch (every appended batch) or never
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.fsync = fsync
+        self.dropped = 0
+        self._file = None
+        self._path = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        # Segment names sort in creation order: {time in ns}-{pid}
+        self._path = os.path.join(self.directory, '{time:020d}-{pid}.open'.format(time=int(time.time() * 1e9),
+                                                                                  pid=os.getpid()))
+        self._file = open(self._path, 'a', buffering=1 << 16)
+
+    def _close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        if os.path.getsize(self._path):
+            os.rename(self._path, self._path[:-len('.open')] + '.seg')
+        else:
+            os.remove(self._path)
+        self._file = None
+        self._path = None
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, records):
+        """
+        append: append records to the open segment of the process
+        :param records: list of records
+        :return: None
+        """
+        with self._lock:
+            if self._file is None:
+                self._open()
+            for record in records:
+                self._file.write(json.dumps(record) + '\n')
+                if self.fsync == FSYNC_ALWAYS:
+                    self._sync()
+            if self.fsync == FSYNC_BATCH:
+                self._sync()
+            else:
+                self._file.flush()
+
+            if self._file.tell() >= self.segment_size:
+                self._close()
+                self._cap()
+
+    def rotate(self):
+        """
+        rotate: close the open segment of the process so it can be replayed
+        :return: None
+        """
+        with self._lock:
+            self._close()
+            self._cap()
+
+    def close(self):
+        self.rotate()
+
+    def segments(self):
+        """
+        segments: closed segments in creation order, including segments left open by dead processes
+        :return: list of paths
+        """
+        paths = glob.glob(os.path.join(self.directory, '*.seg'))
+        for path in glob.glob(os.path.join(self.directory, '*.open')):
+            pid = int(os.path.basename(path)[:-len('.open')].split('-')[1])
+            if pid != os.getpid() and not _alive(pid):
+                paths.append(path)
+        return sorted(paths, key=os.path.basename)
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.directory, '*.*')))
+
+    def _cap(self):
+        # Drop the oldest closed segments beyond the size of the spool
+        segments = self.segments()
+        while segments and self.size() > self.max_size:
+            path = segments.pop(0)
+            try:
+                with open(path, 'rb') as f:
+                    self.dropped += sum(1 for _ in f)
+            except FileNotFoundError:
+                # Replayed meanwhile
+                continue
+            self._remove(path)
+            log.warning("Spool full, dropped %s", path)
+
+    @staticmethod
+    def _remove(path):
+        for name in (path, path + '.offset'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def replay(self, deliver, batch_size=50):
+        """
+        replay: deliver the spooled records in order, one replayer at a time
+        :param deliver: function sending a list of records, raises when the collector is unavailable; an exception
+                        with attribute 'delivered' reports the number of records delivered before the failure
+        :param batch_size: number of records delivered at once
+        :return: number of records delivered
+        """
+        self.rotate()
+
+        with open(os.path.join(self.directory, '.replay.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is replaying
+                return 0
+
+            delivered = 0
+            for path in self.segments():
+                delivered += self._replay_segment(path, deliver, batch_size)
+                self._remove(path)
+            return delivered
+
+    def _replay_segment(self, path, deliver, batch_size):
+        offset_path = path + '.offset'
+        try:
+            with open(offset_path) as f:
+                offset = int(f.read() or 0)
+        except FileNotFoundError:
+            offset = 0
+
+        delivered = 0
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # Dropped by another worker capping the spool: nothing left to deliver
+            return 0
+        with f:
+            f.seek(offset)
+            while True:
+                lines = [line for line in (f.readline() for _ in range(batch_size)) if line.endswith(b'\n')]
+                if not lines:
+                    return delivered
+
+                # Records with the offset following each of them
+                records = []
+                for line in lines:
+                    offset += len(line)
+                    try:
+                        records.append((offset, json.loads(line.decode('utf-8'))))
+                    except ValueError:
+                        # Truncated or corrupted record: skip it, it would block the rest of the spool forever
+                        self.dropped += 1
+                        log.warning("Dropped a corrupted record of %s: %r", path, line[:100])
+                if records:
+                    try:
+                        deliver([record for _, record in records])
+                    except Exception as e:
+                        # Partial failure: the records delivered before it are skipped by the next replay
+                        sent = getattr(e, 'delivered', 0)
+                        if sent:
+                            self._save_offset(offset_path, records[sent - 1][0])
+                        raise
+                    delivered += len(records)
+
+                # Remember the progress so a failure does not deliver the same records again
+                self._save_offset(offset_path, offset)
+
+    @staticmethod
+    def _save_offset(offset_path, offset):
+        with open(offset_path, 'w') as offset_file:
+            offset_file.write(str(offset))
+
+    def stats(self):
+        return {
+            "segments": len(self.segments()),
+            "bytes": self.size(),
+            "dropped": self.dropped
+        }
@@ -0,0 +1,186 @@
+"""
+    Shared cache of the light state
+
+    The last state read from (or written to) the bridge is kept in Redis so every worker serves it while
+    it is fresh. When it is stale, only one request refreshes it ("single-flight"); concurrent requests
+    wait for that refresh instead of calling the bridge themselves.
+
+    Every change of the cached state is published as an event (see state_stream.py): it gets the next id of
+    the key, is kept in a short backlog list (STATE_EVENT_BACKLOG) and is sent on the pub/sub channel of the key.
+"""
+import json
+import time
+
+import config
+import locks
+from redis_pool import get_redis, get_script
+
+
+STATE_KEY = 'light_state'
+
+# Event of a changed state, KEYS[2]: event id counter, KEYS[3]: backlog list, KEYS[4]: channel,
+# ARGV[4]: size of the backlog
+_EMIT = """
+local function emit(state)
+    local id = redis.call('INCR', KEYS[2])
+    local event = cjson.encode({id = id, state = state})
+    redis.call('LPUSH', KEYS[3], event)
+    redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[4]) - 1)
+    redis.call('PUBLISH', KEYS[4], event)
+end
+"""
+
+# KEYS[1]: state key, ARGV[1]: state in JSON, ARGV[2]: time of the read, ARGV[3]: retention in milliseconds
+# return: 1 if the state changed
+_PUT = _EMIT + """
+local state = cjson.decode(ARGV[1])
+local previous = redis.call('GET', KEYS[1])
+redis.call('SET', KEYS[1], cjson.encode({state = state, fetchedAt = tonumber(ARGV[2])}), 'PX', ARGV[3])
+
+local changed = not previous
+if previous then
+    previous = cjson.decode(previous)['state']
+    for name, value in pairs(state) do
+        changed = changed or cjson.encode(value) ~= cjson.encode(previous[name])
+    end
+    for name, _ in pairs(previous) do
+        changed = changed or state[name] == nil
+    end
+end
+if changed then
+    emit(state)
+    return 1
+end
+return 0
+"""
+
+# KEYS[1]: state key, ARGV[1]: changes in JSON, ARGV[2]: time of the change, ARGV[3]: retention in milliseconds
+_MERGE = _EMIT + """
+local entry = redis.call('GET', KEYS[1])
+if not entry then
+    return 0
+end
+entry = cjson.decode(entry)
+local changed = false
+for name, value in pairs(cjson.decode(ARGV[1])) do
+    changed = changed or cjson.encode(value) ~= cjson.encode(entry['state'][name])
+    entry['state'][name] = value
+end
+entry['fetchedAt'] = tonumber(ARGV[2])
+redis.call('SET', KEYS[1], cjson.encode(entry), 'PX', ARGV[3])
+if changed then
+    emit(entry['state'])
+end
+return 1
+"""
+
+
+def event_keys(key=STATE_KEY):
+    """
+    event_keys: Redis keys of the events of a state
+    :param key: Redis key of the state
+    :return: [event id counter, backlog list, pub/sub channel]
+    """
+    return [key + ':event_id', key + ':events', key + ':changes']
+
+
+def _read(db, key):
+    entry = db.get(key)
+    return json.loads(entry) if entry else None
+
+
+def _retention():
+    return int(config.get_float('STATE_CACHE_RETENTION') * 1000)
+
+
+def max_age_of(cache_control):
+    """
+    max_age_of: freshness requested by the client
+    :param cache_control: Cache-Control header of the request (werkzeug RequestCacheControl)
+    :return: seconds, 0 for no-cache, None when the client did not ask
+    """
+    if cache_control.no_cache:
+        return 0
+    return cache_control.max_age
+
+
+def put_state(state, key=STATE_KEY):
+    """
+    put_state: store the full state of the light
+    :param state: state dictionary of the light
+    :param key: Redis key of the state
+    :return: None
+    """
+    args = [json.dumps(state), time.time(), _retention(), config.get_int('STATE_EVENT_BACKLOG')]
+    get_script(_PUT)(keys=[key] + event_keys(key), args=args, client=get_redis())
+
+
+def update_state(changes, key=STATE_KEY):
+    """
+    update_state: apply changes written to the bridge to the cached state
+    :param changes: attributes of the state which were applied successfully, e.g. {"on": false}
+    :param key: Redis key of the state
+    :return: True if the cached state was updated, False if nothing was cached
+    """
+    db = get_redis()
+    args = [json.dumps(changes), time.time(), _retention(), config.get_int('STATE_EVENT_BACKLOG')]
+    merged = get_script(_MERGE)(keys=[key] + event_keys(key), args=args, client=db)
+    return bool(merged)
+
+
+def read_state(key=STATE_KEY):
+    """
+    read_state: read the cached state of the light regardless of its age
+    :param key: Redis key of the state
+    :return: (state dictionary, age of the state in seconds), None if nothing is cached
+    """
+    entry = _read(get_redis(), key)
+    if entry is None:
+        return None
+    return entry['state'], max(time.time() - entry['fetchedAt'], 0.0)
+
+
+def invalidate(key=STATE_KEY):
+    get_redis().delete(key)
+
+
+def get_state(fetch, max_age=None, key=STATE_KEY):
+    """
+    get_state: read the state of the light from the cache, refreshing it when stale
+    :param fetch: function reading the state from the bridge
+    :param max_age: maximum age of the state in seconds, STATE_CACHE_TTL by default
+    :param key: Redis key of the state
+    :return: (state dictionary, age of the state in seconds)
+    """
+    if max_age is None:
+        max_age = config.get_float('STATE_CACHE_TTL')
+
+    db = get_redis()
+    timeout = config.get_float('STATE_REFRESH_TIMEOUT')
+    started = time.time()
+    token = locks.new_token()
+
+    while True:
+        # A state fetched after the request arrived is always fresh enough
+        entry = _read(db, key)
+        if entry is not None:
+            age = max(time.time() - entry['fetchedAt'], 0.0)
+            if age <= max_age or entry['fetchedAt'] >= started:
+                return entry['state'], age
+
+        # Only one request refreshes the state, the others wait for it
+        if locks.acquire(key + ':refresh', token, timeout):
+            try:
+                state = fetch()
+                put_state(state, key)
+                return state, 0.0
+            finally:
+                locks.release(key + ':refresh', token)
+
+        # The refreshing request is stuck: read the state without waiting anymore
+        if time.time() - started >= timeout:
+            state = fetch()
+            put_state(state, key)
+            return state, 0.0
+
+        time.sleep(0.01)
@@ -0,0 +1,214 @@
+"""
+    Server-Sent Events of the light state
+
+    Each worker process holds one Redis pub/sub subscription to the changes of the state of every resource
+    (published by state_cache.py, whichever worker or poller changed it) and fans the events out to its stream clients.
+    A client resuming with Last-Event-ID first receives the events it missed from the backlog in Redis, or the
+    current state if the backlog does not reach back that far. Idle streams receive a comment every
+    STREAM_HEARTBEAT seconds, so proxies keep them open and dead clients are detected.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import config
+from redis_pool import get_redis
+from state_cache import STATE_KEY, event_keys, read_state
+
+
+log = logging.getLogger(__name__)
+
+
+class StateListener(threading.Thread):
+    """
+    StateListener: daemon thread forwarding the state events of Redis to the stream clients of the process
+    """
+    def __init__(self, key=STATE_KEY):
+        """
+        :param key: Redis key of the state, whose namespaced keys (resources.py) are followed as well
+        """
+        super().__init__(name='state-listener', daemon=True)
+        self.pattern = '*' + event_keys(key)[2]
+        self.clients = {}
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def subscribe(self, key=STATE_KEY, limit=None):
+        """
+        subscribe: register a stream client
+        :param key: Redis key of the state followed by the client
+        :param limit: number of stream clients of the process above which the client is refused, no limit by default
+        :return: queue.Queue receiving the events, then None if the client was dropped and must reconnect;
+                 None if the process already serves limit clients
+        """
+        client = queue.Queue(maxsize=config.get_int('STREAM_QUEUE_SIZE'))
+        with self._lock:
+            if limit is not None and sum(len(clients) for clients in self.clients.values()) >= limit:
+                return None
+            self.clients.setdefault(event_keys(key)[2], set()).add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            for channel, clients in list(self.clients.items()):
+                clients.discard(client)
+                if not clients:
+                    del self.clients[channel]
+
+    def _publish(self, event, channel=None):
+        with self._lock:
+            if channel is None:
+                clients = [client for clients in self.clients.values() for client in clients]
+            else:
+                clients = list(self.clients.get(channel, ()))
+        for client in clients:
+            try:
+                client.put_nowait(event)
+            except queue.Full:
+                # Drop the slow client: it resumes from the backlog with Last-Event-ID
+                self.unsubscribe(client)
+                with client.mutex:
+                    client.queue.clear()
+                client.put_nowait(None)
+
+    def run(self):
+        while True:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(self.pattern)
+                while True:
+                    # Wait with a timeout: a blocking read would fail after REDIS_SOCKET_TIMEOUT
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message['type'] == 'pmessage':
+                        self._publish(json.loads(message['data']), message['channel'])
+            except Exception:
+                log.exception("State events subscription failed")
+            finally:
+                pubsub.close()
+
+            # Clients missed events meanwhile: make them resume from the backlog
+            self._publish(None)
+            time.sleep(1.0)
+
+
+_listener = None
+_lock = threading.Lock()
+
+
+def get_listener():
+    """
+    get_listener: get the state listener of the current process
+    :return: StateListener
+    """
+    global _listener
+
+    # Threads do not survive fork: subscribe in each worker process
+    pid = os.getpid()
+    if _listener is None or _listener.pid != pid:
+        with _lock:
+            if _listener is None or _listener.pid != pid:
+                _listener = StateListener()
+                _listener.start()
+    return _listener
+
+
+def _format(event, name='state'):
+    return 'id: {id}\nevent: {name}\ndata: {data}\n\n'.format(id=event['id'], name=name,
+                                                              data=json.dumps({"state": event['state']}))
+
+
+def backlog(last_event_id, key=STATE_KEY):
+    """
+    backlog: events following an event id
+    :param last_event_id: id of the last event received by the client
+    :param key: Redis key of the state
+    :return: list of events in order, None if the backlog does not go back to the event
+    """
+    events = [json.loads(event) for event in reversed(get_redis().lrange(event_keys(key)[1], 0, -1))]
+    missed = [event for event in events if event['id'] > last_event_id]
+    if missed and missed[0]['id'] > last_event_id + 1:
+        return None
+
+    # The event ids restarted, e.g. Redis was flushed
+    if events and last_event_id > events[-1]['id']:
+        return None
+    return missed
+
+
+def current(key=STATE_KEY):
+    """
+    current: the current state as an event with the id of the last event
+    :param key: Redis key of the state
+    :return: event, None if nothing is cached
+    """
+    db = get_redis()
+    last_id = int(db.get(event_keys(key)[0]) or 0)
+    cached = read_state(key)
+    if cached is None:
+        return None
+    return {"id": last_id, "state": cached[0]}
+
+
+def max_clients():
+    """
+    max_clients: number of streams a worker process serves at once (STREAM_MAX_CLIENTS)
+    Each stream holds a thread of the worker until the client disconnects: by default, streams get half of the
+    THREADS of the worker and the other half serve the other requests, and at least one stream is served
+    :return: int
+    """
+    limit = config.get('STREAM_MAX_CLIENTS')
+    if limit is not None and limit != '':
+        return int(limit)
+    return max(config.get_int('THREADS') // 2, 1)
+
+
+def stream(last_event_id=None, key=STATE_KEY, client=None):
+    """
+    stream: Server-Sent Events of the state, until the client disconnects
+    :param last_event_id: Last-Event-ID header of a resuming client
+    :param key: Redis key of the state
+    :param client: queue subscribed with get_listener().subscribe(key) before reading Redis, subscribed here by default
+    :return: generator of event stream text
+    """
+    listener = get_listener()
+
+    # Subscribe before reading Redis, so no event is missed in between
+    if client is None:
+        client = listener.subscribe(key)
+    try:
+        yield 'retry: {ms}\n\n'.format(ms=int(config.get_float('STREAM_RETRY') * 1000))
+
+        last = -1
+        try:
+            missed = backlog(int(last_event_id), key) if last_event_id is not None else None
+        except ValueError:
+            missed = None
+        if missed is not None:
+            for event in missed:
+                yield _format(event)
+            last = missed[-1]['id'] if missed else int(last_event_id)
+        else:
+            event = current(key)
+            if event is not None:
+                yield _format(event)
+                last = event['id']
+
+        heartbeat = config.get_float('STREAM_HEARTBEAT')
+        while True:
+            try:
+                event = client.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+
+            # Dropped: the client reconnects with the id of its last event
+            if event is None:
+                return
+            if event['id'] > last:
+                yield _format(event)
+                last = event['id']
+    finally:
+        listener.unsubscribe(client)
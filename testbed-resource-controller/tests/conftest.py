@@ -0,0 +1,49 @@
+"""
+    Fixtures of the tests: settings restored after each test, and an in-memory Redis server (fakeredis)
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('NAME', 'test')
+os.environ.setdefault('ID', '1')
+os.environ.setdefault('URL', 'http://localhost:8000')
+
+import config  # noqa: E402
+import redis_pool  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    """
+    settings: override settings for one test, e.g. settings({"BIND_LEASE_TTL": 10})
+    """
+    overrides = dict(config._overrides)
+    # No pub/sub listener threads in tests
+    config.update({"L1_CACHE_TTL": 0})
+    yield config.update
+    config._overrides.clear()
+    config._overrides.update(overrides)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    fake_redis: every client of redis_pool connects to a new in-memory server
+    """
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+
+    def create_pool():
+        return redis_pool.CountingConnectionPool(connection_class=fakeredis.FakeConnection, server=server,
+                                                 decode_responses=True,
+                                                 max_connections=config.get_int('REDIS_MAX_CONNECTIONS'))
+
+    monkeypatch.setattr(redis_pool, '_create_pool', create_pool)
+    redis_pool.reset()
+    redis_pool._scripts.clear()
+    yield redis_pool.get_redis()
+    redis_pool.reset()
+    redis_pool._scripts.clear()
@@ -0,0 +1,60 @@
+import async_commands
+
+
+PREFER_ASYNC = {'Prefer': 'respond-async'}
+
+
+def test_prefer_async_runs_synchronously_without_executors(settings):
+    settings({"COMMAND_MODE": "sync", "COMMAND_EXECUTOR": False})
+    assert not async_commands.requested(PREFER_ASYNC)
+
+
+def test_prefer_async_is_queued_with_executors(settings):
+    settings({"COMMAND_MODE": "sync", "COMMAND_EXECUTOR": "1"})
+    assert async_commands.requested(PREFER_ASYNC)
+    assert not async_commands.requested({})
+
+
+def test_async_mode_queues_every_command(settings):
+    settings({"COMMAND_MODE": "async"})
+    assert async_commands.requested({})
+
+
+class Resource:
+    name = ''
+    bridge = None
+
+    def key(self, key):
+        return key
+
+
+def test_unexpected_error_fails_the_command(fake_redis, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(async_commands.resources, 'get', lambda name: Resource())
+    monkeypatch.setattr(async_commands, 'execute', broken)
+    command_id = async_commands.enqueue('on', {"on": True})
+
+    async_commands.CommandExecutor('test', None).process(command_id)
+
+    command = async_commands.get_command(command_id)
+    assert command["status"] == async_commands.FAILED
+    assert "boom" in command["error"]
+    assert fake_redis.ttl(async_commands.COMMAND_KEY.format(id=command_id)) > 0
+
+
+def test_expired_command_is_not_created_again(fake_redis, monkeypatch):
+    command_id = async_commands.enqueue('on', {"on": True})
+    key = async_commands.COMMAND_KEY.format(id=command_id)
+
+    # Expires while the command is running
+    def expiring(*args):
+        fake_redis.delete(key)
+        return async_commands.APPLIED, {"state": {"on": True}}
+
+    monkeypatch.setattr(async_commands.resources, 'get', lambda name: Resource())
+    monkeypatch.setattr(async_commands, 'execute', expiring)
+    async_commands.CommandExecutor('test', None).process(command_id)
+
+    assert not fake_redis.exists(key)
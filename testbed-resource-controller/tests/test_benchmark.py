@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import benchmark
+import fake_bridge
+import hue_controller
+from hue_bridge import HueBridgeClient, HueBridgeError
+
+
+def serve(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:{port}'.format(port=server.server_port)
+
+
+@pytest.fixture
+def bridge(request):
+    app = fake_bridge.create_bridge(**getattr(request, 'param', {}))
+    server, url = serve(app)
+    app.client = HueBridgeClient(url + '/api/bench', '1', retries=0)
+    yield app
+    server.shutdown()
+
+
+def test_fake_bridge_applies_light_and_group_states(bridge):
+    bridge.client.set_state({"on": True, "bri": 10})
+    assert bridge.client.light_state() == {"on": True, "bri": 10}
+
+    group_id, lights = bridge.client.find_group(lights=['3', '2', '1'])
+    bridge.client.set_group_action(group_id, {"on": False})
+    assert group_id == '1'
+    assert all(not bridge.client.light_state(light_id)["on"] for light_id in lights)
+    assert bridge.calls["PUT"] == 2
+
+
+@pytest.mark.parametrize('bridge', [{"error_rate": 1.0}], indirect=True)
+def test_fake_bridge_errors_are_raised(bridge):
+    with pytest.raises(HueBridgeError, match='rejected'):
+        bridge.client.set_state({"on": True})
+
+
+@pytest.mark.parametrize('bridge', [{"rate_limit": 2}], indirect=True)
+def test_fake_bridge_rate_limit_answers_429(bridge):
+    bridge.client.light_state()
+    bridge.client.light_state()
+    with pytest.raises(HueBridgeError, match='429'):
+        bridge.client.light_state()
+
+
+def test_percentiles_are_nearest_rank():
+    latencies = [i / 1000 for i in range(1, 101)]
+    summary = benchmark.summarize(latencies, 2, 2.0)
+
+    assert benchmark.percentile([], 0.5) is None
+    assert summary["requests"] == 100 and summary["errors"] == 2 and summary["rps"] == 50.0
+    assert (summary["p50"], summary["p95"], summary["p99"], summary["max"]) == (50.0, 95.0, 99.0, 100.0)
+
+
+def test_load_generator_drives_a_scenario(fake_redis):
+    server, url = serve(hue_controller.create_app({"APP_STARTUP": False}))
+    try:
+        summary = benchmark.LoadGenerator(url, 'description', concurrency=2, rate=20).run(0.5)
+    finally:
+        server.shutdown()
+
+    assert summary["requests"] == 10
+    assert summary["errors"] == 0
@@ -0,0 +1,23 @@
+from http import HTTPStatus
+
+import pytest
+from flask import Flask
+
+import binding
+from base import BindAPI
+
+
+@pytest.mark.parametrize('lease', ['inf', '-inf', 'nan', '-5', '0', 'soon'])
+def test_invalid_lease_is_rejected(fake_redis, lease):
+    app = Flask(__name__)
+    BindAPI.add_url_rule(app)
+
+    response = app.test_client().post('/user/bind', headers={'USER-ID': 'alice', 'LEASE-TTL': lease})
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert fake_redis.get(binding.BINDING_KEY) is None
+
+
+def test_lease_expires_the_binding(fake_redis):
+    assert binding.bind('alice', '2.5') == (binding.BOUND, 'alice')
+    assert 0 < fake_redis.pttl(binding.BINDING_KEY) <= 2500
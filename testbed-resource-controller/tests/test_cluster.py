@@ -0,0 +1,124 @@
+import itertools
+import json
+import threading
+from collections import Counter
+from http import HTTPStatus
+
+import pytest
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+import cluster
+import hue_controller
+import resources
+
+
+def test_ring_spreads_keys_and_moves_few_on_join():
+    keys = ['light-{i}'.format(i=i) for i in range(3000)]
+    before = cluster.HashRing(['a', 'b', 'c'])
+    after = cluster.HashRing(['a', 'b', 'c', 'd'])
+
+    counts = Counter(before.node(key) for key in keys)
+    assert all(count > len(keys) / 3 * 0.7 for count in counts.values())
+
+    # Only the keys taken by the new node move
+    moved = [key for key in keys if before.node(key) != after.node(key)]
+    assert all(after.node(key) == 'd' for key in moved)
+    assert len(moved) < len(keys) / 4 * 1.4
+    assert cluster.HashRing([]).node('light-1') is None
+
+
+@pytest.fixture
+def membership(fake_redis, settings):
+    settings({"CLUSTER_HEARTBEAT": 60, "CLUSTER_NODE_TTL": 60})
+    memberships = []
+
+    def join(node):
+        memberships.append(cluster.Membership(node))
+        return memberships[-1]
+
+    yield join
+    for member in memberships:
+        member.close()
+
+
+def test_dead_nodes_leave_the_ring(membership, fake_redis):
+    local = membership('http://local')
+    membership('http://other')
+    assert local.refresh().nodes == {'http://local', 'http://other'}
+
+    # The heartbeat of the other node expired
+    fake_redis.delete(cluster.NODE_KEY.format(node='http://other'))
+    assert local.refresh().nodes == {'http://local'}
+    assert fake_redis.smembers(cluster.NODES_KEY) == {'http://local'}
+
+
+@pytest.fixture
+def remote():
+    # Other node, answering with what it received
+    app = Flask(__name__)
+
+    @app.route('/<path:path>', methods=['GET', 'POST'])
+    def echo(path):
+        return jsonify({"path": request.full_path, "forwardedBy": request.headers.get(cluster.FORWARDED_HEADER),
+                        "user": request.headers.get('USER-ID')}), HTTPStatus.ACCEPTED
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{port}'.format(port=server.server_port)
+    server.shutdown()
+
+
+@pytest.fixture
+def node(membership, remote, monkeypatch, tmp_path):
+    membership(remote)
+    local = membership('http://local')
+    monkeypatch.setattr(cluster, 'get_membership', lambda: local)
+
+    # The port of the other node moves the resources on the ring: pick one resource of each node
+    names = ('hall-{i}'.format(i=i) for i in itertools.count(1))
+    local_name = next(name for name in names if local.owner(name) == 'http://local')
+    remote_name = next(name for name in names if local.owner(name) == remote)
+
+    path = tmp_path / 'resources.json'
+    path.write_text(json.dumps([{"name": name, "bridge": "http://127.0.0.1:9/api/test", "light": "1"}
+                                for name in (local_name, remote_name)]))
+    monkeypatch.setattr(resources, '_resources', None)
+    app = hue_controller.create_app({"APP_STARTUP": False, "RESOURCES": str(path), "CLUSTER": True})
+    return app.test_client(), local_name, remote_name
+
+
+def test_requests_are_forwarded_to_the_owner(node, remote):
+    client, local_name, remote_name = node
+
+    response = client.get('/{name}/user?x=1'.format(name=remote_name), headers={'USER-ID': 'alice'})
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert response.get_json() == {"path": '/{name}/user?x=1'.format(name=remote_name),
+                                   "forwardedBy": 'http://local', "user": 'alice'}
+
+    assert client.get('/{name}/user'.format(name=local_name)).get_json() == {"bound": 0, "userId": None}
+
+
+def test_forwarded_requests_are_served_locally(node):
+    client, _, remote_name = node
+    response = client.get('/{name}/user'.format(name=remote_name), headers={cluster.FORWARDED_HEADER: 'http://x'})
+    assert response.get_json() == {"bound": 0, "userId": None}
+
+
+def test_requests_are_redirected_to_the_owner(node, remote, settings):
+    settings({"CLUSTER_ROUTING": "redirect"})
+    client, _, remote_name = node
+
+    response = client.get('/{name}/user'.format(name=remote_name))
+    assert response.status_code == HTTPStatus.TEMPORARY_REDIRECT
+    assert response.headers['Location'] == '{node}/{name}/user'.format(node=remote, name=remote_name)
+
+
+def test_unreachable_owner_is_served_locally(node):
+    client, _, remote_name = node
+    cluster.get_membership().ring = cluster.HashRing(['http://127.0.0.1:9'])
+
+    response = client.get('/{name}/user'.format(name=remote_name))
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json() == {"bound": 0, "userId": None}
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+import command_queue
+import locks
+
+
+class RecordingBridge:
+    namespace = ''
+    light_id = '1'
+
+    def __init__(self):
+        self.puts = []
+
+    def set_state(self, body, light_id=None):
+        self.puts.append(body)
+
+
+def test_each_caller_reads_the_result_of_its_own_command(fake_redis):
+    bridge = RecordingBridge()
+    on = command_queue.submit('1', {"on": True, "bri": 254}, bridge)
+    token = locks.new_token()
+    queue = command_queue.QUEUE_KEY.format(light='1')
+
+    # Dispatched before its caller reads the result, then a later command without "on" is applied
+    assert locks.acquire(queue + ':dispatcher', token, 10)
+    command_queue.dispatch(bridge, '1', token)
+    command_queue.submit('1', {"bri": 10}, bridge)
+    command_queue.dispatch(bridge, '1', token)
+    locks.release(queue + ':dispatcher', token)
+
+    assert bridge.puts == [{"on": True, "bri": 254}, {"bri": 10}]
+    assert command_queue.send(bridge, {"bri": 20}) == {"bri": 20}
+    assert json.loads(fake_redis.get(command_queue._applied_key(queue, on)))['state'] == {"on": True, "bri": 254}
+
+
+def test_coalesced_commands_share_the_merged_result(fake_redis):
+    bridge = RecordingBridge()
+    first = command_queue.submit('1', {"on": True}, bridge)
+    second = command_queue.submit('1', {"bri": 10}, bridge)
+
+    assert command_queue.send(bridge, {"hue": 100}) == {"on": True, "bri": 10, "hue": 100}
+    assert bridge.puts == [{"on": True, "bri": 10, "hue": 100}]
+    queue = command_queue.QUEUE_KEY.format(light='1')
+    for seq in (first, second):
+        assert fake_redis.get(command_queue._applied_key(queue, seq)) is not None
+
+
+class BrokenBridge(RecordingBridge):
+    def set_state(self, body, light_id=None):
+        raise RuntimeError("boom")
+
+
+def test_unexpected_error_answers_the_taken_commands(fake_redis):
+    bridge = BrokenBridge()
+    first = command_queue.submit('1', {"on": True}, bridge)
+    second = command_queue.submit('1', {"bri": 10}, bridge)
+    token = locks.new_token()
+    queue = command_queue.QUEUE_KEY.format(light='1')
+
+    assert locks.acquire(queue + ':dispatcher', token, 10)
+    with pytest.raises(RuntimeError):
+        command_queue.dispatch(bridge, '1', token)
+
+    for seq in (first, second):
+        assert 'error' in json.loads(fake_redis.get(command_queue._applied_key(queue, seq)))
@@ -0,0 +1,49 @@
+import gzip
+import json
+from http import HTTPStatus
+
+import pytest
+
+import hue_controller
+import utils
+
+
+@pytest.fixture
+def client(fake_redis):
+    utils.invalidate_description()
+    yield hue_controller.create_app({"APP_STARTUP": False}).test_client()
+    utils.invalidate_description()
+
+
+def test_description_is_revalidated_with_etag(client):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    assert response.status_code == HTTPStatus.OK
+    assert etag
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    assert client.get('/', headers={'If-None-Match': '"other"'}).status_code == HTTPStatus.OK
+
+
+def test_description_is_gzipped_for_clients_accepting_it(client):
+    plain = client.get('/')
+    zipped = client.get('/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['Vary'] == 'Accept-Encoding'
+    assert json.loads(gzip.decompress(zipped.data)) == plain.get_json()
+    assert zipped.headers['ETag'] == plain.headers['ETag']
+
+
+def test_description_is_not_gzipped_when_disabled(client, settings):
+    settings({"DESCRIPTION_GZIP": False})
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == HTTPStatus.OK
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()['actions']
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import discovery
+import local_registry
+
+
+HUE = {"id": "webeng:hue:1", "title": "WebEng-hue", "url": "http://hue:8000/", "@type": ["Light"],
+       "actions": {"on": {}, "off": {}}}
+HALL = {"id": "webeng:hue:2:hall-1", "title": "WebEng-hue", "url": "http://hue:8000/hall-1/", "@type": "Light",
+        "actions": {"on": {}}}
+SPEAKER = {"id": "webeng:speaker:1", "title": "WebEng-speaker", "url": "http://speaker:8000/", "actions": {"play": {}}}
+
+
+@pytest.fixture
+def registry():
+    app = local_registry.create_registry()
+    app.services.extend([HUE, HALL])
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    app.url = 'http://127.0.0.1:{port}/api/services/'.format(port=server.server_port)
+    yield app
+    server.shutdown()
+
+
+@pytest.fixture
+def index(registry):
+    index = discovery.DiscoveryIndex(registry.url, ttl=60, negative_ttl=60, timeout=5)
+    assert index.loaded.wait(5)
+    yield index
+    index.close()
+
+
+def test_resources_are_found_by_name_type_and_action(index):
+    assert index.lookup(resource='hue')['url'] == HUE['url']
+    assert index.lookup(resource='hall-1')['url'] == HALL['url']
+    assert index.lookup(type='Light', action='off')['id'] == HUE['id']
+    assert index.lookup(resource='hall-1', action='off', wait=False) is None
+
+
+def test_missing_resource_refreshes_at_most_once_per_negative_ttl(index, registry):
+    refreshes = index.refreshes
+    assert index.lookup(resource='speaker') is None
+    registry.services.append(SPEAKER)
+
+    # Negative caching: the registry is not asked again
+    assert index.lookup(resource='speaker') is None
+    assert index.refreshes == refreshes
+
+    index.negative_ttl = 0
+    assert index.lookup(resource='speaker')['actions'] == ['play']
+
+
+def test_last_descriptions_are_served_while_the_registry_is_down(index):
+    index.url = 'http://127.0.0.1:9/api/services/'
+    index.negative_ttl = 0
+
+    assert index.lookup(resource='speaker') is None
+    assert index.lookup(resource='hue')['url'] == HUE['url']
+
+
+def test_resolve_keeps_given_urls(index, monkeypatch):
+    monkeypatch.setattr(discovery, 'get_index', lambda: index)
+    resolved = discovery.resolve([{"name": "light", "url": "http://light:8000/"}, {"name": "hue"},
+                                  {"name": "any", "action": "on", "type": "Light"}, {"name": "radio"}], wait=False)
+
+    assert resolved == [{"name": "light", "url": "http://light:8000/"}, {"name": "hue", "url": HUE['url']},
+                        {"name": "any", "url": HUE['url']}, None]
@@ -0,0 +1,22 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('quart')
+
+import aio_base  # noqa: E402
+import dummy_async_resource  # noqa: E402
+
+
+def test_description_is_registered_when_serving_starts(monkeypatch):
+    registered = []
+    monkeypatch.setattr(aio_base, 'register_api', lambda: registered.append(True))
+    app = dummy_async_resource.create_app({"APP_STARTUP": True})
+    assert registered == []
+
+    async def serve():
+        async with app.test_app():
+            pass
+
+    asyncio.run(serve())
+    assert registered == [True]
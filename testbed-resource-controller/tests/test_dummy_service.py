@@ -0,0 +1,23 @@
+from http import HTTPStatus
+
+import resource_client
+
+
+def test_service_action_binds_and_unbinds_resource(fake_redis, monkeypatch):
+    import dummy_service
+
+    calls = []
+
+    def call(url, action, user_id, headers=None):
+        calls.append((url, action, user_id))
+        return HTTPStatus.OK
+
+    monkeypatch.setattr(resource_client, 'call', call)
+    client = dummy_service.app.test_client()
+
+    assert client.post('/user/bind', headers={'USER-ID': 'alice'}).status_code == HTTPStatus.OK
+    response = client.post('/service/fake', headers={'USER-ID': 'alice'})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json() == {"name": "dummy", "url": "http://localhost:8001"}
+    assert calls == [("http://localhost:8001", 'user/bind', 'alice'), ("http://localhost:8001", 'user/unbind', 'alice')]
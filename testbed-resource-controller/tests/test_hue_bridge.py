@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from hue_bridge import HueBridgeClient, HueBridgeError
+
+
+class Response:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def client_answering(monkeypatch, status_code, text):
+    client = HueBridgeClient('http://127.0.0.1:9/api/test', '1')
+    monkeypatch.setattr(client.session, 'request', lambda *args, **kwargs: Response(status_code, text))
+    return client
+
+
+def test_invalid_body_raises_hue_bridge_error(monkeypatch):
+    client = client_answering(monkeypatch, 200, '<html>Bad gateway</html>')
+    with pytest.raises(HueBridgeError, match='invalid body'):
+        client.light_state()
+
+
+def test_errors_answered_with_200_are_raised(monkeypatch):
+    client = client_answering(monkeypatch, 200, '[{"error": {"type": 201, "description": "off"}}]')
+    with pytest.raises(HueBridgeError, match='rejected'):
+        client.set_state({"bri": 10})
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+from http import HTTPStatus
+
+import base
+import hue_controller
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_needs_neither_redis_nor_environment():
+    env = {key: value for key, value in os.environ.items() if key not in ('NAME', 'ID', 'URL')}
+    env['REDIS_PORT'] = '1'
+    result = subprocess.run([sys.executable, '-c', 'import hue_controller'], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+    assert result.returncode == 0, result.stdout.decode()
+    assert b'Traceback' not in result.stdout
+
+
+def test_app_serves_bindings_and_description(fake_redis):
+    client = hue_controller.create_app({"APP_STARTUP": False}).test_client()
+
+    assert client.post('/user/bind', headers={'USER-ID': 'alice'}).status_code == HTTPStatus.OK
+    assert client.post('/user/bind', headers={'USER-ID': 'bob'}).status_code == HTTPStatus.CONFLICT
+
+    response = client.get('/')
+    assert response.status_code == HTTPStatus.OK
+    hrefs = [form['href'] for action in response.get_json()['actions'].values() for form in action['forms']]
+    assert any(href.endswith('/resource/on') for href in hrefs)
+
+
+def test_startup_publishes_description_once(fake_redis, monkeypatch):
+    # Worker hooks (registration, pollers) run at the first request only, none is sent here
+    monkeypatch.setattr(base, '_worker_hooks', [])
+    monkeypatch.setattr(base, '_worker_pid', None)
+
+    hue_controller.create_app({"APP_STARTUP": True, "HUE_URL_SET": os.path.join(ROOT, 'hue_url_set.json')})
+
+    assert fake_redis.get('description') is not None
+    assert fake_redis.get('actions') is not None
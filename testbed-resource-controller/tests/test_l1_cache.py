@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import binding
+import l1_cache
+
+
+@pytest.fixture
+def cache(fake_redis, settings, monkeypatch):
+    settings({"L1_CACHE_TTL": 60})
+    monkeypatch.setattr(l1_cache, '_cache', None)
+    cache = l1_cache.get_cache()
+    assert cache._subscribed.wait(5)
+    yield cache
+    cache.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_owner_is_cached_until_another_worker_changes_it(cache, fake_redis):
+    assert binding.bind('alice') == (binding.BOUND, 'alice')
+    assert binding.owner() == 'alice'
+
+    # Changed without publishing: the cached owner is still served
+    fake_redis.set(binding.BINDING_KEY, 'bob')
+    assert binding.owner() == 'alice'
+
+    # Unbound by the script of another worker, which publishes the change
+    fake_redis.set(binding.BINDING_KEY, 'alice')
+    binding._run(binding._UNBIND, binding.BINDING_KEY, 'alice')
+    wait_for(lambda: binding.owner() is None)
+
+
+def test_value_read_before_an_invalidation_is_not_cached(cache):
+    generation = cache.generation
+    # Invalidated while the value was read from Redis
+    cache.invalidate('key')
+    cache.set('key', 'stale', generation)
+    assert cache.get('key') is None
+
+    cache.set('key', 'fresh', cache.generation)
+    assert cache.get('key') == 'fresh'
+
+
+def test_invalidation_callbacks_are_called(cache, fake_redis, monkeypatch):
+    called = []
+    monkeypatch.setattr(l1_cache, '_callbacks', {'description': [lambda: called.append(True)]})
+
+    fake_redis.publish(l1_cache.CHANNEL, 'description')
+    wait_for(lambda: called)
+
+
+def test_cache_is_bypassed_while_unsubscribed(cache):
+    cache.set('key', 'value', cache.generation)
+    cache._subscribed.clear()
+    assert cache.get('key') is None
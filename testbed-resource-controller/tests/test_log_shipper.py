@@ -0,0 +1,103 @@
+import threading
+import time
+
+import requests
+
+import log_shipper
+
+
+class FlakyCollector:
+    """
+    FlakyCollector: session of the shipper, accepting the first posts and then failing
+    """
+    def __init__(self, accepted):
+        self.accepted = accepted
+        self.received = []
+
+    def post(self, url, data=None, json=None, timeout=None):
+        if len(self.received) >= self.accepted:
+            raise requests.ConnectionError("Collector down")
+        self.received.append(data if json is None else json)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    def close(self):
+        pass
+
+
+class MemorySpool:
+    def __init__(self):
+        self.records = []
+
+    def append(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+def test_records_are_posted_one_by_one_by_default(settings):
+    settings({"LOG_SPOOL_DIR": ""})
+    shipper = log_shipper.create_shipper()
+    shipper.close(0)
+    shipper.session = collector = FlakyCollector(accepted=10)
+    records = [{"n": n} for n in range(5)]
+
+    shipper.flush(records)
+
+    assert collector.received == records
+
+
+def test_json_mode_posts_a_batch_at_once(settings):
+    settings({"LOG_SPOOL_DIR": "", "LOG_BATCH_MODE": "json"})
+    shipper = log_shipper.create_shipper()
+    shipper.close(0)
+    shipper.session = collector = FlakyCollector(accepted=10)
+    records = [{"n": n} for n in range(5)]
+
+    shipper.flush(records)
+
+    assert collector.received == [records]
+
+
+def test_counters_are_exact_under_concurrent_ships():
+    shipper = log_shipper.LogShipper('http://collector', max_queue=100000)
+    shipper.close(0)
+
+    threads = [threading.Thread(target=lambda: [shipper.ship({}) for _ in range(2000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert shipper.stats()["queued"] == 16000
+
+
+def test_only_undelivered_records_are_spooled():
+    spool = MemorySpool()
+    shipper = log_shipper.LogShipper('http://collector', batch_mode="each", spool=spool)
+    shipper.close(0)
+    shipper.session = collector = FlakyCollector(accepted=2)
+    records = [{"n": n} for n in range(5)]
+
+    shipper.flush(records)
+
+    assert collector.received == records[:2]
+    assert spool.records == records[2:]
+    assert shipper.counters["sent"] == 2 and shipper.counters["spooled"] == 3
+
+
+def test_flusher_survives_a_failing_replay():
+    class BrokenSpool(MemorySpool):
+        def replay(self, deliver, batch_size):
+            raise OSError("Disk gone")
+
+    shipper = log_shipper.LogShipper('http://collector', flush_interval=0.01, spool=BrokenSpool(),
+                                     replay_interval=0.01)
+    try:
+        shipper.session = FlakyCollector(accepted=10)
+        time.sleep(0.1)
+        assert shipper._thread.is_alive()
+    finally:
+        shipper.close(1)
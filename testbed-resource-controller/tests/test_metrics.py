@@ -0,0 +1,60 @@
+from http import HTTPStatus
+
+import pytest
+import requests
+from prometheus_client import REGISTRY
+
+import hue_controller
+import metrics
+
+
+@pytest.fixture
+def client(fake_redis, monkeypatch):
+    # Metrics of this process only
+    monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+    monkeypatch.delenv('prometheus_multiproc_dir', raising=False)
+    return hue_controller.create_app({"APP_STARTUP": False}).test_client()
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_timed_by_route(client):
+    labels = {"method": 'POST', "route": '/user/<action>', "status": '409'}
+    before = sample('controller_request_duration_seconds_count', **labels)
+    conflicts = sample('controller_binding_conflicts_total', operation='bind')
+
+    assert client.post('/user/bind', headers={'USER-ID': 'alice'}).status_code == HTTPStatus.OK
+    assert client.post('/user/bind', headers={'USER-ID': 'bob'}).status_code == HTTPStatus.CONFLICT
+
+    assert sample('controller_request_duration_seconds_count', **labels) == before + 1
+    assert sample('controller_binding_conflicts_total', operation='bind') == conflicts + 1
+
+
+def test_metrics_are_served_in_prometheus_format(client):
+    client.get('/')
+    response = client.get('/metrics')
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['Content-Type'].startswith('text/plain')
+    assert b'controller_request_duration_seconds_bucket{' in response.data
+    assert b'controller_redis_command_duration_seconds' in response.data
+
+
+def test_failed_outbound_requests_are_counted_as_errors():
+    labels = {"host": '127.0.0.1:9', "status": 'error'}
+    before = sample('controller_outbound_request_duration_seconds_count', **labels)
+    session = metrics.instrument_session(requests.Session())
+
+    with pytest.raises(requests.ConnectionError):
+        session.get('http://127.0.0.1:9/', timeout=1)
+    assert sample('controller_outbound_request_duration_seconds_count', **labels) == before + 1
+
+
+def test_nothing_is_instrumented_when_disabled(settings):
+    settings({"METRICS": False})
+    session = requests.Session()
+    send = session.send
+
+    assert metrics.instrument_session(session).send == send
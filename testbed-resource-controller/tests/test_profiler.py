@@ -0,0 +1,50 @@
+import os
+from http import HTTPStatus
+
+import hue_controller
+import profiler
+
+
+def test_only_allowed_users_request_a_profile(settings):
+    settings({"PROFILE_USERS": "alice, carol", "PROFILE_SAMPLE_RATE": 0.0})
+
+    assert profiler.requested({'PROFILE': '1', 'USER-ID': 'alice'})
+    assert not profiler.requested({'PROFILE': '1', 'USER-ID': 'bob'})
+    assert not profiler.requested({'USER-ID': 'alice'})
+
+    settings({"PROFILE_SAMPLE_RATE": 1.0})
+    assert profiler.requested({})
+
+
+def test_profiled_request_writes_its_profile(fake_redis, settings, tmp_path):
+    settings({"PROFILE_USERS": "alice", "PROFILE_DIR": str(tmp_path)})
+    client = hue_controller.create_app({"APP_STARTUP": False}).test_client()
+
+    assert 'PROFILE-ID' not in client.post('/user/bind', headers={'USER-ID': 'alice'}).headers
+    response = client.get('/user', headers={'USER-ID': 'alice', 'PROFILE': '1'})
+
+    assert response.status_code == HTTPStatus.OK
+    profile_id = response.headers['PROFILE-ID']
+    names = os.listdir(str(tmp_path))
+    assert sorted(os.path.splitext(name)[1] for name in names) == ['.folded', '.txt']
+    assert all(profile_id in name for name in names)
+    timing = [name for name in names if name.endswith('.txt')][0]
+    with open(os.path.join(str(tmp_path), timing)) as f:
+        assert f.readline().startswith('GET /user ')
+
+
+def test_rotate_keeps_the_most_recent_profiles(tmp_path):
+    for started in range(5):
+        for extension in ('.folded', '.txt'):
+            (tmp_path / '{started}-1-id{extension}'.format(started=started, extension=extension)).write_text('')
+
+    profiler.rotate(str(tmp_path), 2)
+
+    assert sorted(os.listdir(str(tmp_path))) == ['3-1-id.folded', '3-1-id.txt', '4-1-id.folded', '4-1-id.txt']
+
+
+def test_sampler_collapses_the_stacks_of_a_thread():
+    sampler = profiler.StackSampler(0, 1.0)
+    sampler.stacks.update({'a:main;b:work': 3, 'a:main': 1})
+
+    assert sampler.collapsed() == 'a:main 1\na:main;b:work 3\n'
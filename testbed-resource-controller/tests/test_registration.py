@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import local_registry
+import registration
+
+
+@pytest.fixture
+def registry():
+    app = local_registry.create_registry(fail_first=2)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    app.url = 'http://127.0.0.1:{port}/api/services/'.format(port=server.server_port)
+    yield app
+    server.shutdown()
+
+
+def test_registration_retries_until_acknowledged_once(fake_redis, registry, settings):
+    settings({"REGISTRY_BACKOFF_INITIAL": 0.01, "REGISTRY_BACKOFF_MAX": 0.05})
+    description = {"id": "webeng:test:1", "title": "WebEng-test"}
+
+    first = registration.Registration(description, 'digest', registry.url)
+    first.start()
+    assert first.registered.wait(10)
+    assert first.attempts == 3
+    assert registry.services == [description]
+
+    # The registry already acknowledged this description: no other post
+    second = registration.Registration(description, 'digest', registry.url)
+    second.start()
+    assert second.registered.wait(10)
+    assert registry.posts == 3
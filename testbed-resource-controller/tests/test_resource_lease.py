@@ -0,0 +1,28 @@
+from http import HTTPStatus
+
+import resource_client
+import resource_lease
+
+
+URL = 'http://localhost:8001'
+
+
+def test_idle_lease_is_handed_over_to_the_next_user(fake_redis, monkeypatch):
+    calls = []
+    monkeypatch.setattr(resource_client, 'call', lambda url, action, user_id, headers=None:
+                        calls.append((action, user_id)) or HTTPStatus.OK)
+    manager = resource_lease.LeaseManager(idle=60)
+    key = resource_lease.LEASE_KEY.format(url=URL)
+    try:
+        assert manager.acquire([URL], 'alice') is None
+        manager.done([URL])
+
+        assert manager.acquire([URL], 'bob') is None
+        assert calls == [('user/bind', 'alice'), ('user/unbind', 'alice'), ('user/bind', 'bob')]
+
+        # The lease of bob is in use: alice is refused without touching it
+        last_used = fake_redis.hget(key, 'last_used')
+        assert manager.acquire([URL], 'alice') == (HTTPStatus.CONFLICT, "Resource bound to another user.")
+        assert fake_redis.hmget(key, 'user', 'inflight', 'last_used') == ['bob', '1', last_used]
+    finally:
+        manager._stop_event.set()
@@ -0,0 +1,39 @@
+import json
+import threading
+from http import HTTPStatus
+
+import pytest
+from werkzeug.serving import make_server
+
+import binding
+import discovery
+import hue_controller
+import resource_client
+import resources
+
+
+@pytest.fixture
+def multi_resource(fake_redis, monkeypatch, tmp_path):
+    path = tmp_path / 'resources.json'
+    path.write_text(json.dumps([{"name": name, "bridge": "http://127.0.0.1:9/api/test", "light": light}
+                                for name, light in (("hall-1", "1"), ("hall-2", "2"))]))
+    monkeypatch.setattr(resources, '_resources', None)
+    app = hue_controller.create_app({"APP_STARTUP": False, "RESOURCES": str(path)})
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{port}'.format(port=server.server_port)
+    server.shutdown()
+
+
+def test_service_binds_a_discovered_resource_under_its_prefix(multi_resource, fake_redis):
+    api_dict = {"id": "webeng:hue:1", "title": "WebEng-hue", "url": multi_resource}
+    entries = [discovery._entry(resource.describe(api_dict)) for resource in resources.all_resources()]
+    assert [entry["name"] for entry in entries] == ["hall-1", "hall-2"]
+
+    assert resource_client.bind_all([entries[1]["url"]], 'service') is None
+
+    assert fake_redis.get(resources.get('hall-2').key(binding.BINDING_KEY)) == 'service'
+    assert fake_redis.get(resources.get('hall-1').key(binding.BINDING_KEY)) is None
+    assert resource_client.unbind_all([entries[1]["url"]], 'service') == [HTTPStatus.OK]
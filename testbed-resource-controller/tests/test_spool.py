@@ -0,0 +1,46 @@
+import pytest
+
+from log_shipper import DeliveryError
+from spool import Spool
+
+
+def test_replay_resumes_after_the_records_delivered(tmp_path):
+    spool = Spool(str(tmp_path))
+    records = [{"n": n} for n in range(6)]
+    spool.append(records)
+    received = []
+
+    def flaky(batch):
+        # The collector fails after two records of the first replay
+        if not received:
+            received.extend(batch[:2])
+            raise DeliveryError(2, "Collector down")
+        received.extend(batch)
+
+    with pytest.raises(DeliveryError):
+        spool.replay(flaky)
+    assert spool.replay(flaky) == 4
+
+    assert received == records
+    assert spool.stats()["segments"] == 0
+
+
+def test_corrupted_records_are_skipped(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append([{"n": 0}])
+    spool.rotate()
+    segment = spool.segments()[0]
+    with open(segment, 'ab') as f:
+        f.write(b'{corrupt\n\xff\xfe\n')
+    spool.append([{"n": 1}])
+    received = []
+
+    assert spool.replay(received.extend) == 2
+
+    assert received == [{"n": 0}, {"n": 1}]
+    assert spool.stats() == {"segments": 0, "bytes": 0, "dropped": 2}
+
+
+def test_missing_segment_is_consumed(tmp_path):
+    spool = Spool(str(tmp_path))
+    assert spool._replay_segment(str(tmp_path / 'gone.seg'), list, 50) == 0
@@ -0,0 +1,20 @@
+import state_stream
+
+
+def test_streams_beyond_the_limit_are_refused(settings):
+    settings({"STREAM_MAX_CLIENTS": 1})
+    listener = state_stream.StateListener()
+
+    first = listener.subscribe(limit=state_stream.max_clients())
+    assert first is not None
+    assert listener.subscribe(limit=state_stream.max_clients()) is None
+
+    listener.unsubscribe(first)
+    assert listener.subscribe(limit=state_stream.max_clients()) is not None
+
+
+def test_streams_get_half_of_the_threads(settings):
+    settings({"THREADS": 1})
+    assert state_stream.max_clients() == 1
+    settings({"THREADS": 8})
+    assert state_stream.max_clients() == 4
@@ -1,16 +1,23 @@
 import os
-import requests
-import redis
+import gzip
+import hashlib
 import json
 
 from http import HTTPStatus
-from urllib.parse import urljoin
+from collections import namedtuple
 from functools import wraps
 from flask import abort, request, jsonify, make_response
 
-
-# TODO hard-coded and duplicated call. Better to globally call once
-db = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+import binding
+import config
+import discovery
+import l1_cache
+import log_shipper
+import registration
+import resource_client
+import resource_lease
+import resources
+from redis_pool import get_redis, get_script
 
 
 def abort_json(status_code, error_message):
@@ -51,68 +58,97 @@ def authorization_required(f):
     def check_authorization(self, *args, **kwargs):
         user_id = request.headers.get('USER-ID')
 
-        # Raise 401 error if the resource is not bound
-        if not self.redis.exists('user_id'):
-            abort_json(HTTPStatus.UNAUTHORIZED, "Resource not bound.")
+        # Check the binding of the resource of the request and renew its lease in one atomic round trip
+        result, _ = binding.authorize(user_id, resources.current().key(binding.BINDING_KEY))
 
-        # Raise 409 Conflict error if the resource is already bound to another user
-        if self.redis.get('user_id') != user_id:
-            abort_json(HTTPStatus.CONFLICT, "Resource bound to another user.")
+        # Raise 401 error if the resource is not bound,
+        # or 409 Conflict error if the resource is already bound to another user
+        if result != binding.BOUND:
+            abort_json(*binding.http_error(result))
 
         return f(self, *args, **kwargs)
     return check_authorization
 
 
-def resource_required(resource_description):
+def resource_required(*resource_descriptions, lease=None):
     """
     resource_required: a decorator to indicate required resources for the action
-    :param resource_description: url of required resource
+    With one resource, the action receives it as argument 'resource'. With several resources, they are
+    bound concurrently, all or nothing, and the action receives a dictionary of resources by name.
+    Resources are unbound concurrently after the action, even if it fails. In lease mode, they stay bound
+    between consecutive actions and are unbound once idle for RESOURCE_LEASE_IDLE seconds.
+    Resources described without url are found in the discovery index, by 'resource' (name of the resource
+    controller, the name of the resource by default), 'type' and/or 'action'.
+    :param resource_descriptions: names and urls, or names and capabilities, of required resources
+    :param lease: keep the bindings as leases, by default if RESOURCE_LEASE_IDLE is set
     :return: resource binding function as a decorator
     """
-    # TODO currently, allow single resource only: extend to multiple resources
-    # TODO currently, directly specify url of the required resource: extend to use registry and discovery
     def decorator(f):
         @wraps(f)
         def bind_resource(self, *args, **kwargs):
-            # TODO how to pass resource information to service?
-            url = resource_description["url"]
+            resolved = discovery.resolve(resource_descriptions)
+            if None in resolved:
+                abort_json(HTTPStatus.SERVICE_UNAVAILABLE, "Resource not found.")
+            urls = [resource["url"] for resource in resolved]
+            leased = lease if lease is not None else config.get_float('RESOURCE_LEASE_IDLE') > 0
 
             # Use the service's user id to control resources
-            user_id = self.redis.get('user_id')
-            headers = {'USER-ID': user_id}
+            user_id = binding.owner(resources.current().key(binding.BINDING_KEY))
 
-            # Bind the resource
-            bind_response = requests.post(url=urljoin(base=url, url='user/bind'),
-                                          headers=headers)
+            # Bind every resource, or roll back the bound ones (lease mode: bind the resources not leased yet)
+            if leased:
+                error = resource_lease.get_manager().acquire(urls, user_id)
+            else:
+                error = resource_client.bind_all(urls, user_id)
+            if error is not None:
+                abort_json(*error)
+
+            by_name = {resource["name"]: resource for resource in resolved}
+            resource = by_name if len(resolved) > 1 else resolved[0]
+
+            # Service action
+            try:
+                return f(self, resource, *args, **kwargs)
+            finally:
+                # Unbind the resources, or keep them leased until idle
+                if leased:
+                    resource_lease.get_manager().done(urls)
+                else:
+                    resource_client.unbind_all(urls, user_id)
+        return bind_resource
+    return decorator
 
-            if bind_response.status_code == HTTPStatus.OK:
-                # Binding successful
 
-                resource = {
-                    "name": resource_description["name"],
-                    "url": resource_description["url"]
-                }
+# Description of the API recorded by the decorators of this process, published to Redis by publish_description()
+_registry = {
+    "description": None,
+    "properties": {},
+    "actions": {}
+}
 
-                # Service action
-                result = f(self, resource, *args, **kwargs)
+# KEYS[1..4]: description, properties, actions, hash; ARGV[1..4]: their values;
+# KEYS[5]: invalidation channel of the per-worker caches (l1_cache.py), notified with the description key
+# return: 1 if written, 0 if the same description is already published
+_PUBLISH = """
+if redis.call('GET', KEYS[4]) == ARGV[4] then
+    return 0
+end
+redis.call('MSET', KEYS[1], ARGV[1], KEYS[2], ARGV[2], KEYS[3], ARGV[3], KEYS[4], ARGV[4])
+redis.call('PUBLISH', KEYS[5], KEYS[1])
+return 1
+"""
 
-                # Unbind the resource
-                unbind_response = requests.post(url=urljoin(base=url, url='user/unbind'),
-                                                headers=headers)
 
-                return result
-            else:
-                # Binding failed
-                # TODO error code
-                abort_json(HTTPStatus.CONFLICT, "Resource bound to another user.")
-        return bind_resource
-    return decorator
+def _serialize(api_dict):
+    # Deterministic serialization: the same decorators always give the same bytes and hash
+    return json.dumps(api_dict, sort_keys=True, separators=(',', ':')).encode('utf-8')
 
 
-def api_description(description): # for storing api description into redis(db) 
+def api_description(description, type=None): # for storing api description into redis(db) 
     """
     api_description: a decorator for decorating API to construct description and register automatically
     :param description: description of the API
+    :param type: semantic type(s) of the thing ('@type'), used by services to discover resources
     :return:
     """
     def decorator(cls):
@@ -121,10 +157,10 @@ def api_description(description): # for storing api description into redis(db)
                 "https://www.w3.org/2019/wot/td/v1",
                 {"@language": "en"}
             ],
-            "id": "webeng:{name}:{id}".format(name=os.environ.get('NAME').lower(),
-                                              id=os.environ.get('ID')),
-            "title": "WebEng-{name}".format(name=os.environ.get('NAME')),
-            "url": os.environ.get('URL'),
+            "id": "webeng:{name}:{id}".format(name=os.environ.get('NAME', '').lower(),
+                                              id=os.environ.get('ID', '')),
+            "title": "WebEng-{name}".format(name=os.environ.get('NAME', '')),
+            "url": os.environ.get('URL', ''),
             "description": description,
             "securityDefinitions": {
                 "nosec_sc": {
@@ -138,7 +174,9 @@ def api_description(description): # for storing api description into redis(db)
             },
             "security": "basic_sc"
         }
-        db.set('description', json.dumps(api_dict))
+        if type is not None:
+            api_dict["@type"] = type
+        _registry['description'] = api_dict
 
         return cls
     return decorator
@@ -146,9 +184,16 @@ def api_description(description): # for storing api description into redis(db)
 
 def get_description():
     """
-    get_description: get the description stored in redis server
+    get_description: get the description recorded by the decorators of this process, or else stored in redis server
     :return:
     """
+    if _registry['description'] is not None:
+        api_dict = dict(_registry['description'])
+        api_dict['properties'] = _registry['properties']
+        api_dict['actions'] = _registry['actions']
+        return api_dict
+
+    db = get_redis()
     description = db.get("description")
     if description:
         api_dict = json.loads(description)
@@ -161,23 +206,98 @@ def get_description():
         return api_dict
     return None
 
+
+CompiledDescription = namedtuple('CompiledDescription', ['body', 'gzipped', 'etag'])
+
+# Compiled descriptions by resource name
+_compiled_descriptions = {}
+
+
+def compiled_description(resource=None):
+    """
+    compiled_description: get the description serialized once per process, until it is published again
+    :param resource: resources.Resource described, the only resource of the controller by default
+    :return: CompiledDescription of JSON bytes, gzipped bytes (None if DESCRIPTION_GZIP is off) and content hash,
+             None if no description is stored
+    """
+    resource = resource or resources.DEFAULT
+    compiled = _compiled_descriptions.get(resource.name)
+    if compiled is None:
+        # Start receiving the invalidations before reading the description
+        l1_cache.get_cache()
+        api_dict = get_description()
+        if api_dict is None:
+            return None
+
+        body = _serialize(resource.describe(api_dict))
+        gzipped = gzip.compress(body) if config.get_bool('DESCRIPTION_GZIP') else None
+        compiled = CompiledDescription(body, gzipped, hashlib.sha256(body).hexdigest()[:32])
+        _compiled_descriptions[resource.name] = compiled
+    return compiled
+
+
+def invalidate_description():
+    """
+    invalidate_description: drop the compiled descriptions of the process, e.g. after the description changed
+    :return: None
+    """
+    _compiled_descriptions.clear()
+
+
+l1_cache.on_invalidate('description', invalidate_description)
+
+
+def description_hash(api_dict):
+    """
+    description_hash: content hash of a description
+    :param api_dict: description
+    :return: hex digest
+    """
+    return hashlib.sha256(_serialize(api_dict)).hexdigest()
+
+
+def publish_description():
+    """
+    publish_description: write the recorded description to redis server at once, atomically,
+    unless the same description (by content hash) is already published
+    :return: True if written, False if unchanged or nothing is recorded
+    """
+    api_dict = get_description() if _registry['description'] is not None else None
+    if api_dict is None:
+        return False
+
+    db = get_redis()
+    digest = description_hash(api_dict)
+    written = get_script(_PUBLISH)(
+        keys=['description', 'properties', 'actions', 'description_hash', l1_cache.CHANNEL],
+        args=[json.dumps(_registry['description'], sort_keys=True),
+              json.dumps(_registry['properties'], sort_keys=True),
+              json.dumps(_registry['actions'], sort_keys=True),
+              digest],
+        client=db
+    )
+    return bool(written)
+
+
 # here -> parameter typeerror
 def register_api():
 #def register_api(description):
     """
     register_api: register the description of APIs stored in redis server
-    :return:
+    Registration runs in the background, once per controller (per resource of a multi-resource controller),
+    and is skipped if the registry already acknowledged the same description
+    :return: Registration thread (of the first resource), None if no description is recorded
     """
+    publish_description()
     api_dict = get_description()
+    if not api_dict:
+        return None
 
-    if api_dict:
-        # TODO scheme
-        data = {
-            "raw_description": json.dumps(api_dict)
-        }
-
-        # TODO url hard-coded
-        requests.post(url='http://143.248.47.96:8000/api/services/', data=data)
+    registrations = []
+    for resource in resources.all_resources():
+        described = resource.describe(api_dict)
+        registrations.append(registration.register(described, description_hash(described), namespace=resource.key('')))
+    return registrations[0]
 
 
 def add_property(name, title, description, properties, path, security="basic_sc"):
@@ -200,7 +320,7 @@ def add_property(name, title, description, properties, path, security="basic_sc"
                 "properties": properties,
                 "required": list(properties.keys()),
                 "forms": [{
-                    "href": os.environ.get('URL') + path,
+                    "href": os.environ.get('URL', '') + path,
                     "htv:methodName": "GET",  # Assume every property is GET
                     "security": security
                 }]
@@ -208,14 +328,8 @@ def add_property(name, title, description, properties, path, security="basic_sc"
         }
         f.__property = new_property_dict
 
-        properties_dict = db.get('properties')
-        if properties_dict:
-            properties_dict = json.loads(properties_dict)
-        else:
-            properties_dict = {}
-
-        properties_dict.update(new_property_dict)
-        db.set('properties', json.dumps(properties_dict))
+        # Recorded in memory, written to redis server at once by publish_description()
+        _registry['properties'].update(new_property_dict)
 
         return f
     return decorator
@@ -245,7 +359,7 @@ def add_action(name, title, description, output, path, security="basic_sc", inpu
                 },
                 "required": [list(output.keys())],
                 "forms": [{
-                    "href": os.environ.get('URL') + path,
+                    "href": os.environ.get('URL', '') + path,
                     "htv:methodName": "POST",  # Assume every action is POST
                     "security": security
                 }]
@@ -260,14 +374,8 @@ def add_action(name, title, description, output, path, security="basic_sc", inpu
 
         f.__action = new_action_dict
 
-        actions_dict = db.get('actions')
-        if actions_dict:
-            actions_dict = json.loads(actions_dict)
-        else:
-            actions_dict = {}
-
-        actions_dict.update(new_action_dict)
-        db.set('actions', json.dumps(actions_dict))
+        # Recorded in memory, written to redis server at once by publish_description()
+        _registry['actions'].update(new_action_dict)
 
         return f
     return decorator
@@ -282,9 +390,6 @@ def logger(f):
     @wraps(f)
     def log(self, *args, **kwargs):
 
-        # TODO currently, simple rest API is provided to collect raw data
-        url = "http://143.248.47.96:8000/api/data/"
-
         # Get user ID
         user_id = request.headers.get('USER-ID')
 
@@ -300,7 +405,7 @@ def logger(f):
             "type": type(self).__name__,
             "id": request_id,
             "user_id": str(user_id),
-            "bounded_user_id": str(self.redis.get('user_id')),
+            "bounded_user_id": str(binding.owner(resources.current().key(binding.BINDING_KEY))),
             "request_ip": str(request.remote_addr),
             "function_name": f.__name__,
             "function_argument": {
@@ -310,7 +415,8 @@ def logger(f):
             "function_result": str(result)
         }
 
-        requests.post(url=url, data=data)
+        # Sent to the data collector (LOG_COLLECTOR_URL) in the background
+        log_shipper.ship(data)
 
         return result
     return log